@@ -0,0 +1,187 @@
+"""Measures the cold start of the Cloud Function entry points.
+
+Every function is imported in a fresh interpreter with ``-X importtime`` and its
+handler is called once with stub clients, heavy dependencies are only imported by
+that first call. The time until the handler is resolved, the time until the first
+call returned and the cumulative import cost of every module imported by main or
+by the first call are reported. Run from the repository root:
+
+    python benchmarks/cold_start.py [--runs 5] [--top 15] [--json]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Path, handler and the modules the real client factory imports, the factory
+# itself connects so the stub registry only imports them.
+FUNCTIONS = {
+    "bunq": (
+        "functions/bunq_money_flow",
+        "bunq_monthly_sorter",
+        (
+            "bunq.sdk.security.security",
+            "src.bunq_lib",
+            "src.secret_loader",
+            "src.security_monkey_patch",
+        ),
+    ),
+    "kraken": ("functions/kraken_crypto_automation", "monthly_sorter", ()),
+}
+
+# Imports main in a clean interpreter and calls the handler once against a stub
+# registry: every client, including Firestore, is a MagicMock, so the store has
+# no flows and nothing is connected. The undecorated handler is called so errors
+# are not turned into a response. Prints the seconds until the handler could be
+# called and until the first call returned, the interpreter startup is excluded.
+_PROBE = """
+import importlib
+import time
+from unittest import mock
+
+class StubClients:
+    def get(self, key, factory, **_):
+        if isinstance(key, tuple):
+            for module in {client_modules!r}:
+                importlib.import_module(module)
+        return mock.MagicMock()
+
+start = time.perf_counter()
+import main
+handler = getattr(main, {handler!r})
+resolved = time.perf_counter()
+main.clients = StubClients()
+getattr(handler, "__wrapped__", handler)(None)
+print(resolved - start, time.perf_counter() - start)
+"""
+
+_IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+@dataclass
+class ColdStartResult:
+    function: str
+    time_to_handler: List[float] = field(default_factory=list)
+    time_to_first_call: List[float] = field(default_factory=list)
+    modules: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def median(self) -> Optional[float]:
+        if not self.time_to_first_call:
+            return None
+
+        return statistics.median(self.time_to_first_call)
+
+
+def _run_probe(
+    path: str, handler: str, client_modules: Tuple[str, ...]
+) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([path, ROOT])}
+    probe = _PROBE.format(handler=handler, client_modules=client_modules)
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=path,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+def _main_import_times(stderr: str) -> Dict[str, float]:
+    # importtime prints "self | cumulative | name" with nested imports indented
+    # by two spaces per level, children are printed before their parent. Only
+    # the modules imported directly by main and the top level imports of the
+    # first call, which follow main, are kept, in seconds.
+    children = {}
+    after_main = False
+    for line in stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+
+        _, cumulative, indent, name = match.groups()
+        depth = (len(indent) - 1) // 2
+        seconds = int(cumulative) / 1_000_000
+        if after_main:
+            if depth == 0:
+                children[name] = seconds
+        elif depth == 1:
+            children[name] = seconds
+        elif depth == 0:
+            if name == "main":
+                after_main = True
+                continue
+            children = {}
+
+    return children if after_main else {}
+
+
+def measure(name: str, runs: int) -> ColdStartResult:
+    relative_path, handler, client_modules = FUNCTIONS[name]
+    path = os.path.join(ROOT, relative_path)
+    result = ColdStartResult(function=name)
+
+    for _ in range(runs):
+        process = _run_probe(path, handler, client_modules)
+        if process.returncode != 0:
+            result.error = process.stderr.strip().splitlines()[-1]
+            return result
+
+        # The handler logs to stdout as well, the probe prints last
+        time_to_handler, time_to_first_call = process.stdout.split()[-2:]
+        result.time_to_handler.append(float(time_to_handler))
+        result.time_to_first_call.append(float(time_to_first_call))
+        for module, seconds in _main_import_times(process.stderr).items():
+            result.modules[module] = max(result.modules.get(module, 0.0), seconds)
+
+    return result
+
+
+def report(result: ColdStartResult, top: int):
+    print(f"{result.function}:")
+    if result.error:
+        print(f"\t failed: {result.error}")
+        return
+
+    print(
+        f"\t time to handler: median "
+        f"{statistics.median(result.time_to_handler) * 1000:.1f} ms, "
+        f"min {min(result.time_to_handler) * 1000:.1f} ms"
+    )
+    print(
+        f"\t time to first call: median {result.median * 1000:.1f} ms, "
+        f"min {min(result.time_to_first_call) * 1000:.1f} ms"
+    )
+    modules = sorted(result.modules.items(), key=lambda x: x[1], reverse=True)
+    for module, seconds in modules[:top]:
+        print(f"\t {seconds * 1000:8.1f} ms  {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("functions", nargs="*", default=list(FUNCTIONS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", action="store_true", help="print JSON lines")
+    args = parser.parse_args()
+
+    for name in args.functions:
+        result = measure(name, args.runs)
+        if args.json:
+            print(json.dumps({**asdict(result), "median": result.median}))
+        else:
+            report(result, args.top)
+
+
+if __name__ == "__main__":
+    main()
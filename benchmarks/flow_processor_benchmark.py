@@ -0,0 +1,259 @@
+"""Synthetic load benchmark for the flow engine.
+
+Generates flow sets of configurable shape, runs them through FlowProcessor with
+the bunq adapter on top of a fake bank that injects latency, and reports
+flows/sec, wall time and peak memory. Every result is appended as a JSON line
+to benchmarks/results.jsonl together with the current commit, so runs can be
+compared across engine changes. Run from the repository root:
+
+    python benchmarks/flow_processor_benchmark.py --scenario mixed
+    python benchmarks/flow_processor_benchmark.py --sources 100 --flows 50 --latency 2
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import tracemalloc
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from decimal import Decimal
+from time import perf_counter, sleep
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from functions.bunq_money_flow.src.money_flow import BankClientAdapter  # noqa: E402
+from functions.bunq_money_flow.src.transfer_flows import TransferFlows  # noqa: E402
+from functions.bunq_money_flow.src.types import (  # noqa: E402
+    BankClient,
+    PaymentRequest,
+    PaymentResult,
+)
+from lib.flow_processor import FlowProcessor  # noqa: E402
+from simulations.documents import StaticDocuments  # noqa: E402
+
+RESULTS_PATH = os.path.join(ROOT, "benchmarks", "results.jsonl")
+
+STRATEGY_TYPES = ("fixed", "percentage", "top_up")
+
+
+@dataclass(frozen=True)
+class Scenario:
+    sources: int
+    flows: int
+    priorities: int
+    latency: float = 0.0  # ms per bank call
+    jitter: float = 0.0  # ms, uniformly added on top of the latency
+    workers: Optional[int] = None
+    batch_payments: bool = False
+    flow_table: bool = False
+    vectorized: bool = False
+
+
+SCENARIOS = {
+    "small": Scenario(sources=10, flows=10, priorities=3),
+    "wide": Scenario(sources=10_000, flows=1, priorities=1),
+    "deep": Scenario(sources=1, flows=1_000, priorities=50),
+    "mixed": Scenario(sources=200, flows=50, priorities=10),
+    "latency": Scenario(sources=20, flows=10, priorities=3, latency=5, jitter=2),
+    "concurrent": Scenario(
+        sources=20, flows=10, priorities=3, latency=5, jitter=2, workers=3
+    ),
+    "table": Scenario(sources=200, flows=50, priorities=10, flow_table=True),
+    "vectorized": Scenario(sources=200, flows=50, priorities=10, vectorized=True),
+}
+
+
+class FakeBank(BankClient):
+    def __init__(self, latency: float, jitter: float, seed: int = 0):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.balances: Dict[str, Decimal] = {}
+        self.payments = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency or self.jitter:
+            sleep(self.latency + self._random.random() * self.jitter)
+
+    def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
+        self._wait()
+        with self._lock:
+            return self.balances.setdefault(iban, Decimal("10000.00"))
+
+    def get_balances(self) -> Dict[str, Decimal]:
+        # Only the accounts read so far, every other one starts at 10000.00
+        self._wait()
+        with self._lock:
+            return dict(self.balances)
+
+    def make_payment(self, *, amount: Decimal, source_iban: str, **_) -> bool:
+        self._wait()
+        with self._lock:
+            self.payments += 1
+
+        return True
+
+    def make_payments(self, payments: List[PaymentRequest]) -> List[PaymentResult]:
+        self._wait()
+        with self._lock:
+            self.payments += len(payments)
+
+        return [PaymentResult(payment=payment, success=True) for payment in payments]
+
+    def invalidate_accounts(self):
+        pass
+
+
+class SyntheticStore(StaticDocuments, TransferFlows):
+    # Serves generated documents through the regular loading code. Every run
+    # gets a new store, so the conversion into flows or into a flow table is
+    # part of every run.
+    pass
+
+
+def generate_documents(scenario: Scenario, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    documents = []
+    for source in range(scenario.sources):
+        source_iban = f"NL00SYNT{source:010d}"
+        for index in range(scenario.flows):
+            strategy_type = rng.choice(STRATEGY_TYPES)
+            value = (
+                str(rng.randint(1, 50))
+                if strategy_type == "percentage"
+                else f"{rng.randint(100, 50_000) / 100:.2f}"
+            )
+            document = {
+                "description": f"flow {source}/{index}",
+                "value": value,
+                "strategy_type": strategy_type,
+                "priority": rng.randint(1, scenario.priorities),
+                "enabled": True,
+                "target_iban": f"NL00TRGT{rng.randint(0, 999):010d}",
+                "target_iban_name": f"target {index}",
+                "source_iban": source_iban,
+            }
+            if rng.random() < 0.2:
+                document["minimum"] = "1.00"
+            if rng.random() < 0.2:
+                document["maximum"] = "250.00"
+            documents.append(document)
+
+    return documents
+
+
+def run_once(scenario: Scenario, documents: List[Dict]) -> float:
+    bank = FakeBank(scenario.latency, scenario.jitter)
+    processor = FlowProcessor(
+        client_adapter=BankClientAdapter(bank, batch_payments=scenario.batch_payments),
+        store=SyntheticStore(documents),
+        max_workers=scenario.workers,
+        flow_table=scenario.flow_table,
+        vectorized=scenario.vectorized,
+    )
+
+    start = perf_counter()
+    processor.run()
+    return perf_counter() - start
+
+
+def peak_memory(scenario: Scenario, documents: List[Dict]) -> int:
+    # A separate run, tracemalloc slows down allocations too much to time it
+    tracemalloc.start()
+    try:
+        run_once(scenario, documents)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def commit_hash() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(name: str, scenario: Scenario, repeat: int, memory: bool) -> Dict:
+    documents = generate_documents(scenario)
+    wall_times = [run_once(scenario, documents) for _ in range(repeat)]
+    best = min(wall_times)
+
+    return {
+        "scenario": name,
+        "commit": commit_hash(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        **asdict(scenario),
+        "flow_count": len(documents),
+        "wall_times": wall_times,
+        "best_wall_time": best,
+        "flows_per_second": len(documents) / best if best else None,
+        "peak_memory_bytes": peak_memory(scenario, documents) if memory else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append")
+    parser.add_argument("--sources", type=int)
+    parser.add_argument("--flows", type=int, help="flows per source")
+    parser.add_argument("--priorities", type=int)
+    parser.add_argument("--latency", type=float, help="ms per bank call")
+    parser.add_argument("--jitter", type=float, help="ms of random extra latency")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--batch-payments", action="store_true", default=None)
+    parser.add_argument("--flow-table", action="store_true", default=None)
+    parser.add_argument("--vectorized", action="store_true", default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", dest="memory", action="store_false")
+    parser.add_argument("--output", default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    # Strategies log every flow, that is not what is being measured here
+    logging.basicConfig(level=logging.WARNING)
+
+    overrides = {
+        key: value
+        for key in Scenario.__dataclass_fields__
+        if (value := getattr(args, key)) is not None
+    }
+    if args.scenario:
+        scenarios = {
+            name: Scenario(**{**asdict(SCENARIOS[name]), **overrides})
+            for name in args.scenario
+        }
+    elif overrides:
+        scenarios = {"custom": Scenario(**{**asdict(SCENARIOS["small"]), **overrides})}
+    else:
+        scenarios = SCENARIOS
+
+    with open(args.output, "a") as file:
+        for name, scenario in scenarios.items():
+            result = benchmark(name, scenario, args.repeat, args.memory)
+            file.write(json.dumps(result) + "\n")
+            memory = result["peak_memory_bytes"]
+            print(
+                f"{name:<12} {result['flow_count']:>8} flows  "
+                f"{result['best_wall_time']:8.3f} s  "
+                f"{result['flows_per_second']:>10.0f} flows/s  "
+                + (f"{memory / 1024 / 1024:8.1f} MiB" if memory else "")
+            )
+
+
+if __name__ == "__main__":
+    main()
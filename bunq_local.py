@@ -6,7 +6,12 @@ from bunq.sdk.security import security
 from dotenv import load_dotenv
 from firebase_admin import credentials, firestore, initialize_app
 
-from functions.bunq_money_flow.src import BunqClient, BankClientAdapter, TransferFlows
+from functions.bunq_money_flow.src import (
+    BalanceLedger,
+    BunqClient,
+    BankClientAdapter,
+    TransferFlows,
+)
 from functions.bunq_money_flow.src.security_monkey_patch import is_valid_response_body
 from lib.flow_processor import FlowProcessor
 
@@ -52,5 +57,7 @@ if __name__ == "__main__":
         api_context_loader=ApiContextFileLoader(API_CONTEXT_FILE_PATH),
     )
     bunq_.connect()
+    ledger = BalanceLedger(bunq_)
 
-    FlowProcessor(BankClientAdapter(bunq_), store=store_).run()
+    FlowProcessor(BankClientAdapter(ledger), store=store_).run()
+    ledger.reconcile()
@@ -1,9 +1,36 @@
+import json
+import random
 from decimal import Decimal
-from unittest.mock import MagicMock, Mock, call
-
-from functions.bunq_money_flow.src import BankClientAdapter
-from functions.bunq_money_flow.src.transfer_flows import Transfer
+from functools import partial
+from time import sleep
+from unittest.mock import MagicMock, Mock, call, patch
+from urllib.request import urlopen
+
+import google_crc32c
+import pytest
+from bunq.sdk.exception.api_exception import ApiException
+from bunq.sdk.exception.too_many_requests_exception import TooManyRequestsException
+from requests.exceptions import ConnectionError, ReadTimeout
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from functions.bunq_money_flow.src import BalanceLedger, BankClientAdapter, BunqClient
+from functions.bunq_money_flow.src.rate_limiter import (
+    BackoffPolicy,
+    RateLimiter,
+    SlidingWindow,
+)
+from functions.bunq_money_flow.src.transfer_flows import Transfer, TransferFlows
+from functions.bunq_money_flow.src.secret_loader import ApiContextSecretLoader
+from functions.bunq_money_flow.src.security_monkey_patch import is_valid_response_body
+from functions.bunq_money_flow.src.types import PaymentRequest, PaymentResult
+from lib.client_registry import ClientRegistry
 from lib.flow_processor import FlowProcessor
+from lib.flow_table import FlowTable
+from lib.metrics import MetricsRegistry
+from lib.money import Money, round_down
+from lib.tracing import JsonLinesSink, MemorySink, Tracer
+from simulations import Assumptions, MonthlyAmount, OneOffExpense, simulate
+from stand_ins import BunqStandIn, BunqState, bunq_config
 
 default_payment_kwargs = {
     "description": "test description",
@@ -525,3 +552,1391 @@ class TestMixedTransfer:
                 call(amount=Decimal("24.78"), **self.expected_transfers[3]),
             ]
         )
+
+
+class TestConcurrentSources:
+    def setup_method(self):
+        self.bunq_ = MagicMock()
+        self.bunq_.make_payment = Mock()
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("100.00"))
+        self.store_ = MagicMock()
+        self.store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal(value),
+                    strategy_type=strategy_type,
+                    description=f"{source} {strategy_type}",
+                    target_iban="NL76BUNQ2063655073",
+                    target_iban_name="Folkert Plank",
+                    source_iban=source,
+                )
+                for source in ["NL76BUNQ2063655001", "NL76BUNQ2063655002"]
+                for value, strategy_type in [
+                    ("30.00", "fixed"),
+                    ("50.00", "percentage"),
+                ]
+            ]
+        )
+
+    def _run(self, max_workers=None):
+        FlowProcessor(
+            client_adapter=BankClientAdapter(self.bunq_),
+            store=self.store_,
+            max_workers=max_workers,
+        ).run()
+        return self.bunq_.make_payment.call_args_list
+
+    def test_when_running_concurrently_expect_same_payments_as_serial(self):
+        serial_calls = list(self._run())
+        self.bunq_.make_payment.reset_mock()
+
+        concurrent_calls = self._run(max_workers=4)
+
+        assert len(concurrent_calls) == 4
+        assert sorted(map(str, concurrent_calls)) == sorted(map(str, serial_calls))
+
+    def test_when_streaming_flows_expect_source_processed_before_next_is_read(self):
+        events = []
+        flows = self.store_.get_flows.return_value
+
+        def stream():
+            for flow in flows:
+                events.append(f"read {flow.source_iban}")
+                yield flow
+
+        self.store_.get_flows = Mock(return_value=stream())
+        self.bunq_.make_payment = Mock(
+            side_effect=lambda **kwargs: events.append(f"pay {kwargs['source_iban']}")
+        )
+
+        self._run()
+
+        # The first flow of the next source is needed to end the current group
+        reads_of_second_source = [
+            index
+            for index, event in enumerate(events)
+            if event == "read NL76BUNQ2063655002"
+        ]
+        assert events.index("pay NL76BUNQ2063655001") < reads_of_second_source[1]
+
+    @pytest.mark.parametrize("batch_payments", [False, True])
+    def test_when_source_tops_up_target_of_other_source_expect_serial_result(
+        self, batch_payments
+    ):
+        balances = {"NL00SRCA": Decimal("100.00"), "NL00SRCB": Decimal("100.00")}
+        balances["NL00TRGT"] = Decimal("0.00")
+        payments = []
+
+        def make_payment(*, amount, source_iban, target_iban, **_):
+            # Slow enough for the other source to run ahead without ordering
+            sleep(0.05)
+            payments.append((source_iban, target_iban, amount))
+            return True
+
+        bank = MagicMock()
+        bank.get_balance_by_iban = Mock(side_effect=lambda iban: balances[iban])
+        bank.get_balances = Mock(side_effect=lambda: dict(balances))
+        bank.make_payment = Mock(side_effect=make_payment)
+        bank.make_payments = Mock(
+            side_effect=lambda requests: [
+                PaymentResult(payment=request, success=make_payment(**vars(request)))
+                for request in requests
+            ]
+        )
+        self.store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal(value),
+                    strategy_type=strategy_type,
+                    description=strategy_type,
+                    target_iban="NL00TRGT",
+                    target_iban_name="target",
+                    source_iban=source,
+                )
+                for source, value, strategy_type in [
+                    ("NL00SRCA", "50.00", "fixed"),
+                    ("NL00SRCB", "80.00", "top_up"),
+                ]
+            ]
+        )
+
+        FlowProcessor(
+            BankClientAdapter(BalanceLedger(bank), batch_payments=batch_payments),
+            store=self.store_,
+            max_workers=3,
+        ).run()
+
+        assert payments == [
+            ("NL00SRCA", "NL00TRGT", Decimal("50.00")),
+            ("NL00SRCB", "NL00TRGT", Decimal("30.00")),
+        ]
+
+    def test_when_adapter_limits_concurrency_expect_limit_applied(self):
+        adapter = BankClientAdapter(self.bunq_)
+        adapter.max_concurrency = 2
+
+        processor = FlowProcessor(adapter, store=self.store_, max_workers=8)
+
+        assert processor.concurrency == 2
+
+
+class TestExecutionPlan:
+    def setup_method(self):
+        self.bunq_ = MagicMock()
+        self.bunq_.make_payment = Mock()
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("50.00"))
+        self.flow_processor = FlowProcessor(
+            client_adapter=BankClientAdapter(self.bunq_), store=MagicMock()
+        )
+        self.flows = [
+            Transfer(
+                value=Decimal("100.00"),
+                strategy_type="top_up",
+                priority=1,
+                **default_payment_kwargs,
+            ),
+            Transfer(
+                value=Decimal("50.00"),
+                strategy_type="percentage",
+                priority=2,
+                **default_payment_kwargs,
+            ),
+        ]
+        self.balances = {
+            default_payment_kwargs["source_iban"]: Money.of("500.00"),
+            default_payment_kwargs["target_iban"]: Money.of("50.00"),
+        }
+
+    def test_when_planning_expect_amounts_without_payments(self):
+        plan = self.flow_processor.plan(self.flows, self.balances)
+
+        assert [entry.amount for entry in plan] == [
+            Money.of("50.00"),
+            Money.of("225.00"),
+        ]
+        assert plan.entries[0].target == default_payment_kwargs["target_iban"]
+        assert plan.total == Money.of("275.00")
+        self.bunq_.make_payment.assert_not_called()
+
+    def test_when_executing_plan_expect_payment_per_entry(self):
+        plan = self.flow_processor.plan(self.flows, self.balances)
+
+        self.flow_processor.execute(plan)
+
+        self.bunq_.make_payment.assert_has_calls(
+            [
+                call(amount=Decimal("50.00"), **default_payment_kwargs),
+                call(amount=Decimal("225.00"), **default_payment_kwargs),
+            ]
+        )
+
+    def test_when_fixed_flow_and_top_up_share_target_expect_same_payments_as_run(
+        self,
+    ):
+        flows = [
+            Transfer(
+                value=Decimal("30.00"),
+                strategy_type="fixed",
+                priority=1,
+                **default_payment_kwargs,
+            ),
+            Transfer(
+                value=Decimal("100.00"),
+                strategy_type="top_up",
+                priority=2,
+                **default_payment_kwargs,
+            ),
+        ]
+        ledger = BalanceLedger(self.bunq_)
+        self.bunq_.get_balances = Mock(
+            return_value={
+                default_payment_kwargs["source_iban"]: Decimal("500.00"),
+                default_payment_kwargs["target_iban"]: Decimal("50.00"),
+            }
+        )
+        store = MagicMock()
+        store.get_flows = Mock(return_value=flows)
+        FlowProcessor(BankClientAdapter(ledger), store=store).run()
+        run_payments = self.bunq_.make_payment.call_args_list
+        self.bunq_.make_payment.reset_mock()
+
+        plan = self.flow_processor.plan(flows, self.balances)
+        self.flow_processor.execute(plan)
+
+        assert self.bunq_.make_payment.call_args_list == run_payments
+        assert run_payments == [
+            call(amount=Decimal("30.00"), **default_payment_kwargs),
+            call(amount=Decimal("20.00"), **default_payment_kwargs),
+        ]
+
+
+class TestVectorizedEngine:
+    def setup_method(self):
+        pytest.importorskip("numpy")
+        self.bunq_ = MagicMock()
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("40.00"))
+
+    def _plans(self, flows, balance: Money, adapter=None):
+        adapter = adapter or BankClientAdapter(self.bunq_)
+        balances = {
+            default_payment_kwargs["source_iban"]: balance,
+            default_payment_kwargs["target_iban"]: Money.of("40.00"),
+        }
+        scalar = FlowProcessor(adapter, store=MagicMock()).plan(flows, balances)
+        vectorized = FlowProcessor(adapter, store=MagicMock(), vectorized=True).plan(
+            flows, balances
+        )
+        return scalar, vectorized
+
+    @staticmethod
+    def _random_flows(rng: random.Random):
+        flows = []
+        for _ in range(rng.randint(1, 40)):
+            strategy_type = rng.choice(["fixed", "fixed", "percentage", "top_up"])
+            if strategy_type == "percentage":
+                # Whole percentages round ties, some have more decimals than
+                # the engine handles
+                value = Decimal(rng.randint(0, 100_000_000)).scaleb(
+                    -rng.choice([6, 6, 7])
+                )
+                value = rng.choice([Decimal(rng.randint(0, 100)), min(value, 100)])
+            else:
+                value = Money(rng.randint(0, 50_000))
+
+            flows.append(
+                Transfer(
+                    value=value,
+                    strategy_type=strategy_type,
+                    minimum_amount=rng.choice(
+                        [None, Money(0), Money(rng.randint(0, 20_000))]
+                    ),
+                    maximum_amount=rng.choice([None, Money(rng.randint(0, 30_000))]),
+                    priority=rng.randint(1, 4),
+                    **default_payment_kwargs,
+                )
+            )
+
+        return flows
+
+    def test_when_planning_random_groups_expect_same_plan_as_scalar(self):
+        rng = random.Random(21)
+        for _ in range(300):
+            flows = self._random_flows(rng)
+            balance = Money(rng.choice([0, -500, rng.randint(0, 200_000)]))
+
+            scalar, vectorized = self._plans(flows, balance)
+
+            assert [(entry.flow, entry.amount) for entry in vectorized] == [
+                (entry.flow, entry.amount) for entry in scalar
+            ]
+
+    def test_when_percentage_ends_on_half_cent_expect_rounded_to_even(self):
+        flows = [
+            Transfer(
+                value=Decimal(50), strategy_type="percentage", **default_payment_kwargs
+            )
+            for _ in range(2)
+        ]
+
+        for balance in [Money(101), Money(103)]:
+            scalar, vectorized = self._plans(flows, balance)
+
+            assert list(vectorized) == list(scalar)
+            assert len(vectorized) == 2
+
+    def test_when_many_flows_do_not_fit_expect_same_plan_as_scalar(self):
+        # Every flow is skipped by its minimum, more splits than are vectorized
+        flows = [
+            Transfer(
+                value=Money(10_000 + index),
+                strategy_type="fixed",
+                minimum_amount=Money(10_000),
+                **default_payment_kwargs,
+            )
+            for index in range(40)
+        ] + [
+            Transfer(value=Money(500), strategy_type="fixed", **default_payment_kwargs)
+        ]
+
+        scalar, vectorized = self._plans(flows, Money(5_000))
+
+        assert list(vectorized) == list(scalar)
+        assert [entry.amount for entry in vectorized] == [Money(500)]
+
+    def test_when_adapter_overrides_fixed_expect_its_strategy_used(self):
+        adapter = BankClientAdapter(self.bunq_)
+        adapter_strategies = {"fixed": lambda flow, remainder: Money(1)}
+        flows = [
+            Transfer(value=Money(500), strategy_type="fixed", **default_payment_kwargs)
+        ]
+
+        with patch.object(
+            BankClientAdapter,
+            "strategies_for",
+            lambda self, balances: adapter_strategies,
+        ):
+            _, vectorized = self._plans(flows, Money(1_000), adapter=adapter)
+
+        assert [entry.amount for entry in vectorized] == [Money(1)]
+
+
+class TestTracing:
+    def setup_method(self):
+        self.bunq_ = MagicMock()
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("100.00"))
+        self.store_ = MagicMock()
+        self.store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("30.00"),
+                    strategy_type="fixed",
+                    priority=priority,
+                    description=f"{source} {priority}",
+                    target_iban="NL76BUNQ2063655073",
+                    target_iban_name="Folkert Plank",
+                    source_iban=source,
+                )
+                for source in ["NL76BUNQ2063655001", "NL76BUNQ2063655002"]
+                for priority in [1, 2]
+            ]
+        )
+
+    def _run(self, sink, max_workers=None):
+        FlowProcessor(
+            client_adapter=BankClientAdapter(self.bunq_),
+            store=self.store_,
+            max_workers=max_workers,
+            tracer=Tracer(sink),
+        ).run()
+
+    def test_when_running_expect_nested_spans(self):
+        sink = MemorySink()
+
+        self._run(sink)
+
+        spans = {span.span_id: span for span in sink.spans}
+        names = [span.name for span in sink.spans]
+        assert names.count("run") == 1
+        assert names.count("source") == 2
+        assert names.count("priority_group") == 4
+        assert names.count("flow") == 4
+        for span in sink.spans:
+            if span.name == "flow":
+                assert spans[span.parent_id].name == "priority_group"
+                assert span.attributes["amount"] == Money.of("30.00")
+            if span.name == "adapter":
+                assert span.attributes["method"] in {
+                    "prepare",
+                    "get_balance",
+                    "handle_processed_flow",
+                    "flush",
+                }
+            assert span.duration >= 0
+
+    def test_when_running_concurrently_expect_sources_below_run(self):
+        sink = MemorySink()
+
+        self._run(sink, max_workers=2)
+
+        run = next(span for span in sink.spans if span.name == "run")
+        sources = [span for span in sink.spans if span.name == "source"]
+        assert len(sources) == 2
+        assert all(span.parent_id == run.span_id for span in sources)
+        assert {span.trace_id for span in sink.spans} == {run.span_id}
+
+    def test_when_writing_json_lines_expect_one_line_per_span(self, tmp_path):
+        sink = JsonLinesSink(str(tmp_path / "trace.jsonl"))
+
+        self._run(sink)
+        sink.close()
+
+        with open(tmp_path / "trace.jsonl") as file:
+            lines = [json.loads(line) for line in file]
+        assert lines[-1]["name"] == "run"
+        assert any(line["attributes"].get("amount") == "30.00" for line in lines)
+
+
+class TestBatchedPayments:
+    def setup_method(self):
+        self.bunq_ = MagicMock()
+        self.bunq_.make_payment = Mock()
+        self.bunq_.make_payments = Mock(
+            side_effect=lambda payments: [
+                PaymentResult(payment=payment, success=True) for payment in payments
+            ]
+        )
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("500.00"))
+        self.store_ = MagicMock()
+        self.store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("100.00"),
+                    strategy_type="fixed",
+                    **default_payment_kwargs,
+                ),
+                Transfer(
+                    value=Decimal("50.00"),
+                    strategy_type="percentage",
+                    **default_payment_kwargs,
+                ),
+            ]
+        )
+        self.flow_processor = FlowProcessor(
+            client_adapter=BankClientAdapter(self.bunq_, batch_payments=True),
+            store=self.store_,
+        )
+
+    def test_when_batching_expect_single_batch_per_source(self):
+        self.flow_processor.run()
+
+        self.bunq_.make_payment.assert_not_called()
+        self.bunq_.make_payments.assert_called_once_with(
+            [
+                PaymentRequest(amount=Decimal("100.00"), **default_payment_kwargs),
+                PaymentRequest(amount=Decimal("200.00"), **default_payment_kwargs),
+            ]
+        )
+
+    def test_when_batching_expect_queued_payments_in_top_up(self):
+        self.bunq_.get_balance_by_iban = Mock(return_value=Decimal("100.00"))
+        self.store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("30.00"),
+                    strategy_type="fixed",
+                    priority=1,
+                    **default_payment_kwargs,
+                ),
+                Transfer(
+                    value=Decimal("150.00"),
+                    strategy_type="top_up",
+                    priority=2,
+                    **default_payment_kwargs,
+                ),
+            ]
+        )
+
+        self.flow_processor.run()
+
+        self.bunq_.make_payments.assert_called_once_with(
+            [
+                PaymentRequest(amount=Decimal("30.00"), **default_payment_kwargs),
+                PaymentRequest(amount=Decimal("20.00"), **default_payment_kwargs),
+            ]
+        )
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep", Mock())
+    @patch("functions.bunq_money_flow.src.bunq_lib.Payment", Mock())
+    @patch("functions.bunq_money_flow.src.bunq_lib.PaymentBatch")
+    def test_when_batch_exceeds_size_expect_chunked_requests(self, payment_batch):
+        payment_batch.create = Mock(
+            side_effect=[Mock(value=1)] + [Exception("Rejected")] * 5
+        )
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            payment_batch_size=2,
+            rate_limiter=RateLimiter(sleep_=Mock()),
+        )
+        bunq_.is_connected = True
+        bunq_._get_account_id = Mock(return_value=1)
+        payments = [
+            PaymentRequest(amount=Decimal(amount), **default_payment_kwargs)
+            for amount in ["1.00", "2.00", "3.00"]
+        ]
+
+        results = bunq_.make_payments(payments)
+
+        assert [result.success for result in results] == [True, True, False]
+        assert results[0].batch_id == 1
+        assert results[2].error == "Rejected"
+
+
+class TestRateLimiter:
+    def setup_method(self):
+        self.now = 0.0
+        self.sleep = Mock()
+        self.rate_limiter = RateLimiter(
+            {"POST": 5, "GET": 3}, clock=lambda: self.now, sleep_=self.sleep
+        )
+
+    def test_when_within_limit_expect_no_wait(self):
+        waits = [self.rate_limiter.acquire("POST") for _ in range(5)]
+
+        assert waits == [0.0] * 5
+        assert self.rate_limiter.state()["POST"] == 0
+        self.sleep.assert_not_called()
+
+    def test_when_limit_exceeded_expect_wait_until_oldest_call_leaves_window(self):
+        for _ in range(3):
+            self.rate_limiter.acquire("GET")
+
+        self.now = 1.0
+        wait = self.rate_limiter.acquire("GET")
+
+        assert wait == 2.0
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_when_time_passes_expect_only_calls_older_than_period_released(self):
+        for now in [0.0, 0.0, 1.0, 2.0, 2.5]:
+            self.now = now
+            self.rate_limiter.acquire("POST")
+
+        self.now = 1.5
+        assert self.rate_limiter.state()["POST"] == 0
+        self.now = 3.0
+        assert self.rate_limiter.state()["POST"] == 2
+
+    def test_when_calls_keep_arriving_expect_no_window_above_capacity(self):
+        # Callers arrive every 0.3 s, each one goes once its wait is over
+        times = []
+        for index in range(40):
+            self.now = 0.3 * index
+            times.append(self.now + self.rate_limiter.acquire("POST"))
+
+        assert times == sorted(times)
+        for first, later in zip(times, times[5:]):
+            assert later - first >= 3.0 - 1e-9
+
+    def test_when_penalized_expect_bucket_drained(self):
+        self.rate_limiter.penalize("POST")
+
+        assert self.rate_limiter.state()["POST"] == 0
+        assert SlidingWindow(5, 3.0, clock=lambda: 0.0).available() == 5
+        self.now = 2.9
+        assert self.rate_limiter.acquire("POST") == pytest.approx(3.0 - 2.9)
+
+
+class TestRetries:
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep")
+    def test_when_rate_limited_expect_retry_after_window(self, sleep_):
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+            backoff=BackoffPolicy(base_delay=0.1),
+        )
+        action = Mock(side_effect=[TooManyRequestsException("", 429, ""), "done"])
+
+        assert bunq_._with_retries(action, endpoint="payment") == "done"
+        assert sleep_.call_args.args[0] == 3.0
+        assert bunq_.rate_limiter.state()["POST"] < 1
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep")
+    def test_when_rate_limited_expect_metrics_recorded(self, _sleep):
+        registry = MetricsRegistry()
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+            metrics_registry=registry,
+        )
+        action = Mock(side_effect=[TooManyRequestsException("", 429, ""), "done"])
+
+        bunq_._with_retries(action, endpoint="payment")
+
+        requests = registry.counter(
+            "client_requests_total", "", ("client", "endpoint", "method", "status")
+        )
+        labels = {"client": "bunq", "endpoint": "payment", "method": "POST"}
+        assert requests.value(**labels, status="429") == 1
+        assert requests.value(**labels, status="2xx") == 1
+        assert registry.dump()["client_retries_total"] == [
+            {"labels": {"client": "bunq", "endpoint": "payment"}, "value": 1}
+        ]
+        assert (
+            'client_request_duration_seconds_count{client="bunq",endpoint="payment",method="POST"} 2'
+            in (registry.render())
+        )
+
+    @pytest.mark.parametrize(
+        "error",
+        [ApiException("Invalid IBAN", 400, ""), ReadTimeout("read timed out")],
+    )
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep")
+    def test_when_post_fails_after_sending_expect_no_retry(self, sleep_, error):
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+        )
+        action = Mock(side_effect=[error, "done"])
+
+        with pytest.raises(type(error)):
+            bunq_._with_retries(action, endpoint="payment-batch")
+
+        assert action.call_count == 1
+        sleep_.assert_not_called()
+        assert (
+            bunq_._with_retries(
+                Mock(side_effect=[error, "done"]), method="GET", endpoint="account"
+            )
+            == "done"
+        )
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep")
+    @patch("functions.bunq_money_flow.src.bunq_lib.PaymentBatch")
+    def test_when_batch_times_out_expect_failed_results_without_resubmitting(
+        self, payment_batch, _sleep
+    ):
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+        )
+        payment_batch.create = Mock(side_effect=ReadTimeout("read timed out"))
+        payments = [
+            PaymentRequest(amount=Decimal("1.00"), **default_payment_kwargs)
+            for _ in range(3)
+        ]
+
+        results = bunq_._make_payment_batch(1, payments)
+
+        payment_batch.create.assert_called_once()
+        assert [result.success for result in results] == [False] * 3
+        assert results[0].error == "read timed out"
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.sleep")
+    def test_when_connection_not_made_expect_post_retried(self, _sleep):
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+        )
+        refused = ConnectionError(
+            MaxRetryError(None, "/v1/payment", NewConnectionError(None, "refused"))
+        )
+        action = Mock(side_effect=[refused, "done"])
+
+        assert bunq_._with_retries(action, endpoint="payment") == "done"
+
+    def test_when_scraping_registry_expect_prometheus_text(self):
+        registry = MetricsRegistry()
+        registry.counter("runs_total", "Runs").inc()
+        server = registry.serve(0)
+        try:
+            with urlopen(f"http://127.0.0.1:{server.server_port}/metrics") as response:
+                body = response.read().decode()
+        finally:
+            server.shutdown()
+
+        assert "# TYPE runs_total counter\nruns_total 1" in body
+
+        registry.reset()
+        assert registry.dump() == {"runs_total": []}
+
+    def test_when_backing_off_expect_exponential_ceiling(self):
+        policy = BackoffPolicy(base_delay=0.5, max_delay=3.0)
+
+        delays = [policy.delay(attempt, rng=lambda: 1.0) for attempt in range(1, 5)]
+
+        assert delays == [0.5, 1.0, 2.0, 3.0]
+
+
+class TestAccountIndex:
+    def setup_method(self):
+        self.bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+        )
+        self.bunq_.is_connected = True
+
+    @staticmethod
+    def _account(account_id, iban, balance):
+        referenced_object = MagicMock(id_=account_id)
+        referenced_object.alias = [
+            MagicMock(type_="EMAIL", value="folkert@example.com"),
+            MagicMock(type_="IBAN", value=iban),
+        ]
+        referenced_object.balance.value = balance
+        account = MagicMock()
+        account.is_all_field_none = Mock(return_value=False)
+        account.get_referenced_object = Mock(return_value=referenced_object)
+        return account
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.MonetaryAccount")
+    def test_when_looking_up_accounts_expect_single_list_call(self, monetary_account):
+        monetary_account.list = Mock(
+            return_value=Mock(
+                value=[
+                    self._account(1, "NL76BUNQ2063655001", "10.00"),
+                    self._account(2, "NL76BUNQ2063655002", "20.00"),
+                ]
+            )
+        )
+
+        assert self.bunq_.get_balance_by_iban(iban="NL76BUNQ2063655002") == Decimal(
+            "20.00"
+        )
+        assert self.bunq_._get_account_id(iban="NL76BUNQ2063655001") == 1
+        assert self.bunq_._get_account_by_id(2).balance.value == "20.00"
+        assert self.bunq_.get_balance_by_iban(iban="NL76BUNQ2063655999") is None
+        monetary_account.list.assert_called_once()
+
+    @patch("functions.bunq_money_flow.src.bunq_lib.MonetaryAccount")
+    def test_when_invalidated_expect_accounts_reloaded(self, monetary_account):
+        monetary_account.list = Mock(
+            side_effect=[
+                Mock(value=[self._account(1, "NL76BUNQ2063655001", "10.00")]),
+                Mock(value=[self._account(1, "NL76BUNQ2063655001", "15.00")]),
+            ]
+        )
+
+        self.bunq_.get_balance_by_iban(iban="NL76BUNQ2063655001")
+        self.bunq_.invalidate_accounts()
+
+        assert self.bunq_.get_balance_by_iban(iban="NL76BUNQ2063655001") == Decimal(
+            "15.00"
+        )
+
+
+class TestBalanceLedger:
+    def setup_method(self):
+        self.balances = {
+            "NL76BUNQ2063655000": Decimal("1000.00"),
+            "NL76BUNQ2063655073": Decimal("100.00"),
+        }
+        self.bunq_ = MagicMock()
+        self.bunq_.make_payment = Mock(return_value=True)
+        self.bunq_.get_balances = Mock(side_effect=lambda: dict(self.balances))
+        self.ledger = BalanceLedger(self.bunq_)
+
+    def test_when_payment_made_expect_balances_projected(self):
+        self.ledger.make_payment(amount=Decimal("250.00"), **default_payment_kwargs)
+
+        assert self.ledger.get_balance_by_iban(
+            iban=default_payment_kwargs["source_iban"]
+        ) == Decimal("750.00")
+        assert self.ledger.get_balance_by_iban(
+            iban=default_payment_kwargs["target_iban"]
+        ) == Decimal("350.00")
+
+    def test_when_top_up_follows_payment_expect_projected_balance_used(self):
+        store_ = MagicMock()
+        store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("300.00"),
+                    strategy_type="fixed",
+                    priority=1,
+                    **default_payment_kwargs,
+                ),
+                Transfer(
+                    value=Decimal("500.00"),
+                    strategy_type="top_up",
+                    priority=2,
+                    **default_payment_kwargs,
+                ),
+            ]
+        )
+
+        FlowProcessor(BankClientAdapter(self.ledger), store=store_).run()
+
+        self.bunq_.make_payment.assert_has_calls(
+            [
+                call(amount=Decimal("300.00"), **default_payment_kwargs),
+                call(amount=Decimal("100.00"), **default_payment_kwargs),
+            ]
+        )
+
+    def test_when_client_refetches_balances_expect_payments_counted_once(self):
+        # Like a client whose accounts expire during the run, every read sees
+        # the payments made so far
+        def make_payment(*, amount, source_iban, target_iban, **_):
+            self.balances[source_iban] -= amount
+            self.balances[target_iban] += amount
+            return True
+
+        self.bunq_.make_payment = Mock(side_effect=make_payment)
+        self.bunq_.get_balance_by_iban = Mock(
+            side_effect=lambda iban: self.balances.get(iban)
+        )
+        store_ = MagicMock()
+        store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("300.00"),
+                    strategy_type="fixed",
+                    priority=1,
+                    **default_payment_kwargs,
+                ),
+                Transfer(
+                    value=Decimal("500.00"),
+                    strategy_type="top_up",
+                    priority=2,
+                    **default_payment_kwargs,
+                ),
+            ]
+        )
+
+        FlowProcessor(BankClientAdapter(self.ledger), store=store_).run()
+
+        assert self.bunq_.make_payment.call_args_list == [
+            call(amount=Decimal("300.00"), **default_payment_kwargs),
+            call(amount=Decimal("100.00"), **default_payment_kwargs),
+        ]
+        assert self.ledger.balances == self.balances
+
+    def test_when_reconciling_expect_differences_reported(self):
+        for iban in self.balances:
+            self.ledger.get_balance_by_iban(iban=iban)
+        self.ledger.make_payment(amount=Decimal("250.00"), **default_payment_kwargs)
+        self.balances["NL76BUNQ2063655000"] = Decimal("740.00")
+        self.balances["NL76BUNQ2063655073"] = Decimal("350.00")
+
+        differences = self.ledger.reconcile()
+
+        assert differences == {"NL76BUNQ2063655000": Decimal("-10.00")}
+        self.bunq_.invalidate_accounts.assert_called_once()
+
+
+class TestTransferFlows:
+    def setup_method(self):
+        self.client = MagicMock()
+        self.query = self.client.collection.return_value
+        self.query.where.return_value = self.query
+        self.query.order_by.return_value = self.query
+        self.query.stream = Mock(
+            return_value=[
+                Mock(
+                    to_dict=Mock(
+                        return_value=dict(
+                            value="10.00",
+                            strategy_type="fixed",
+                            minimum="1.00",
+                            priority=2,
+                            enabled=True,
+                            **default_payment_kwargs,
+                        )
+                    )
+                )
+            ]
+        )
+        self.store_ = TransferFlows(client=self.client)
+
+    def test_when_getting_flows_expect_server_side_ordering(self):
+        flows = list(self.store_.get_flows())
+
+        self.client.collection.assert_called_once_with("transfer_flows")
+        self.query.where.assert_not_called()
+        self.query.order_by.assert_called_once_with("source_iban")
+        assert flows[0].value == Money.of("10.00")
+        assert flows[0].minimum_amount == Money.of("1.00")
+
+    def test_when_filtering_flows_expect_filters_in_query(self):
+        list(self.store_.get_flows(enabled=True, source="NL76BUNQ2063655000"))
+
+        filters = [
+            (args.kwargs["filter"].field_path, args.kwargs["filter"].value)
+            for args in self.query.where.call_args_list
+        ]
+        assert filters == [("enabled", True), ("source_iban", "NL76BUNQ2063655000")]
+
+    def test_when_flow_disabled_expect_no_payment(self):
+        bunq_ = MagicMock()
+        bunq_.get_balance_by_iban = Mock(return_value=Decimal("100.00"))
+        store_ = MagicMock()
+        store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal("10.00"),
+                    strategy_type="fixed",
+                    enabled=False,
+                    **default_payment_kwargs,
+                )
+            ]
+        )
+
+        FlowProcessor(BankClientAdapter(bunq_), store=store_).run()
+
+        bunq_.make_payment.assert_not_called()
+
+
+class TestFlowTable:
+    def setup_method(self):
+        self.client = MagicMock()
+        self.query = self.client.collection.return_value
+        self.query.where.return_value = self.query
+        self.query.order_by.return_value = self.query
+        # Deliberately not ordered, as with get_flows(ordered=False)
+        documents = [
+            dict(value="50", strategy_type="percentage", priority=2),
+            dict(value="100.00", strategy_type="fixed", priority=1, maximum="80"),
+            dict(value="10.00", strategy_type="fixed", priority=1, enabled=False),
+            dict(
+                value="20.00",
+                strategy_type="fixed",
+                priority=1,
+                source_iban="NL76BUNQ2063655001",
+            ),
+        ]
+        self.query.stream = Mock(
+            return_value=[
+                # Firestore hands out a new dictionary on every call
+                Mock(to_dict=partial(dict, default_payment_kwargs, **document))
+                for document in documents
+            ]
+        )
+        self.store_ = TransferFlows(client=self.client)
+
+    def test_when_loading_table_expect_flows_grouped_by_source_and_priority(self):
+        table = self.store_.get_flow_table(ordered=False)
+
+        grouped = [
+            (source, [(priority, len(flows)) for priority, flows in groups])
+            for source, groups in table.grouped_flows(enabled=True)
+        ]
+
+        assert len(table) == 4
+        assert grouped == [
+            ("NL76BUNQ2063655000", [(1, 1), (2, 1)]),
+            ("NL76BUNQ2063655001", [(1, 1)]),
+        ]
+
+    def test_when_materializing_row_expect_equal_flow(self):
+        table = self.store_.get_flow_table()
+
+        assert table.flow(0) == Transfer(
+            value=Decimal("50"),
+            strategy_type="percentage",
+            priority=2,
+            **default_payment_kwargs,
+        )
+        assert table.flow(1).maximum_amount == Money.of("80.00")
+
+    def test_when_running_from_table_expect_same_payments_as_from_list(self):
+        bunq_ = MagicMock()
+        bunq_.get_balance_by_iban = Mock(return_value=Decimal("200.00"))
+
+        FlowProcessor(
+            BankClientAdapter(bunq_), store=self.store_, flow_table=True
+        ).run()
+        from_table = bunq_.make_payment.call_args_list
+
+        bunq_.reset_mock()
+        FlowProcessor(BankClientAdapter(bunq_), store=self.store_).run()
+
+        assert from_table == [
+            call(amount=Decimal("80.00"), **default_payment_kwargs),
+            call(amount=Decimal("60.00"), **default_payment_kwargs),
+            call(
+                amount=Decimal("20.00"),
+                **{**default_payment_kwargs, "source_iban": "NL76BUNQ2063655001"},
+            ),
+        ]
+        assert bunq_.make_payment.call_args_list == from_table
+
+    def test_when_percentage_too_precise_expect_flow_with_exact_value(self):
+        table = FlowTable(
+            Transfer, source_field="source_iban", target_field="target_iban"
+        )
+
+        for value in ["33.3333333", "12.5"]:
+            table.append(
+                source="NL76BUNQ2063655000",
+                target="NL76BUNQ2063655073",
+                strategy_type="percentage",
+                value=value,
+                description=default_payment_kwargs["description"],
+                target_iban_name=default_payment_kwargs["target_iban_name"],
+            )
+
+        assert [table.flow(row).value for row in range(2)] == [
+            Decimal("33.3333333"),
+            Decimal("12.5"),
+        ]
+
+
+class TestMoney:
+    def test_when_taking_percentage_expect_half_even_rounding(self):
+        assert Money(1).percentage(Decimal("50")) == Money(0)
+        assert Money(3).percentage(Decimal("50")) == Money(2)
+        assert Money.of("123.45").percentage(Decimal("33.3")) == Money.of("41.11")
+
+    def test_when_rounding_balance_expect_rounded_down(self):
+        assert round_down(Decimal("100.239")) == Money.of("100.23")
+        assert round_down("-0.019", "ZEUR") == Money(-1, "ZEUR")
+
+    def test_when_currency_is_crypto_expect_its_decimals_kept(self):
+        assert Money.of("0.005", "XXBT").to_decimal() == Decimal("0.005")
+        assert round_down("0.01490000001", "XXBT") == Money.of("0.0149", "XXBT")
+        assert str(Money.of("1.5", "ZJPY")) == "2"
+
+    def test_when_combining_currencies_expect_error(self):
+        with pytest.raises(ValueError):
+            Money.of("1.00", "EUR") + Money.of("1.00", "ZEUR")
+
+    def test_when_assigning_expect_immutable(self):
+        with pytest.raises(AttributeError):
+            Money(100).minor_units = 200
+
+    def test_when_creating_flow_expect_values_as_money(self):
+        transfer = Transfer(
+            value=Decimal("10.005"),
+            strategy_type="fixed",
+            maximum_amount=20,
+            **default_payment_kwargs,
+        )
+        percentage = Transfer(
+            value=12.5, strategy_type="percentage", **default_payment_kwargs
+        )
+
+        assert transfer.value == Money(1000)
+        assert transfer.maximum_amount == Money(2000)
+        assert percentage.value == Decimal("12.5")
+
+
+class TestClientRegistry:
+    def setup_method(self):
+        self.now = 1000.0
+        self.registry = ClientRegistry(refresh_margin=60, clock=lambda: self.now)
+
+    def test_when_getting_twice_expect_client_reused(self):
+        factory = Mock(side_effect=lambda: object())
+
+        first = self.registry.get("bunq", factory)
+        second = self.registry.get("bunq", factory)
+
+        assert first is second
+        factory.assert_called_once()
+
+    def test_when_session_expires_within_margin_expect_new_client(self):
+        factory = Mock(side_effect=lambda: MagicMock(session_expires_at=1100.0))
+        expires_at = lambda client: client.session_expires_at
+
+        first = self.registry.get("bunq", factory, expires_at=expires_at)
+        self.now = 1030.0
+        assert self.registry.get("bunq", factory, expires_at=expires_at) is first
+
+        self.now = 1050.0
+        assert self.registry.get("bunq", factory, expires_at=expires_at) is not first
+        assert factory.call_count == 2
+
+    def test_when_invalidated_expect_new_client(self):
+        factory = Mock(side_effect=lambda: object())
+
+        first = self.registry.get("bunq", factory)
+        self.registry.invalidate("bunq")
+
+        assert self.registry.get("bunq", factory) is not first
+
+    def test_when_bunq_client_reset_expect_accounts_reloaded(self):
+        bunq_ = BunqClient(
+            api_key=None,
+            environment_type="sandbox",
+            device_description=None,
+            api_context_loader=MagicMock(),
+        )
+        bunq_.invalidate_accounts = Mock()
+
+        bunq_.reset()
+
+        bunq_.invalidate_accounts.assert_called_once()
+
+
+@patch("functions.bunq_money_flow.src.secret_loader.ApiContext")
+@patch("functions.bunq_money_flow.src.secret_loader.SecretManagerServiceClient")
+class TestApiContextSecretLoader:
+    @staticmethod
+    def _secret_version(name, data):
+        response = MagicMock()
+        response.name = name
+        response.payload.data = data
+        response.payload.data_crc32c = int(google_crc32c.Checksum(data).hexdigest(), 16)
+        return response
+
+    @staticmethod
+    def _latest_version(name):
+        version = MagicMock()
+        version.name = name
+        return version
+
+    def test_when_loaded_twice_expect_single_secret_manager_call(
+        self, client_class, api_context
+    ):
+        client = client_class.return_value
+        client.access_secret_version = Mock(
+            return_value=self._secret_version("versions/3", b'{"session": 1}')
+        )
+        client.get_secret_version = Mock(
+            return_value=self._latest_version("versions/3")
+        )
+        loader = ApiContextSecretLoader("project", "secret", "1")
+
+        loader.load()
+        loader.load()
+
+        client.access_secret_version.assert_called_once()
+        api_context.from_json.assert_has_calls(
+            [call('{"session": 1}'), call('{"session": 1}')]
+        )
+
+    def test_when_newer_version_saved_elsewhere_expect_latest_version_loaded(
+        self, client_class, api_context, tmp_path
+    ):
+        client = client_class.return_value
+        client.access_secret_version = Mock(
+            return_value=self._secret_version("versions/3", b'{"session": 1}')
+        )
+        cache_path = str(tmp_path / "api_context.json")
+        ApiContextSecretLoader("project", "secret", "1", cache_path=cache_path).load()
+        client.access_secret_version.return_value = self._secret_version(
+            "versions/4", b'{"session": 2}'
+        )
+        client.get_secret_version = Mock(
+            return_value=self._latest_version("versions/4")
+        )
+
+        loader = ApiContextSecretLoader("project", "secret", "1", cache_path=cache_path)
+        loader.load()
+        loader.load()
+
+        assert client.access_secret_version.call_count == 2
+        api_context.from_json.assert_has_calls(
+            [call('{"session": 1}'), call('{"session": 2}'), call('{"session": 2}')]
+        )
+
+    def test_when_cache_file_is_corrupt_expect_secret_manager_call(
+        self, client_class, api_context, tmp_path
+    ):
+        client = client_class.return_value
+        client.access_secret_version = Mock(
+            return_value=self._secret_version("versions/3", b'{"session": 1}')
+        )
+        client.get_secret_version = Mock(
+            return_value=self._latest_version("versions/3")
+        )
+        cache_path = str(tmp_path / "api_context.json")
+        ApiContextSecretLoader("project", "secret", "1", cache_path=cache_path).load()
+        with open(cache_path) as file:
+            content = file.read()
+        with open(cache_path, "w") as file:
+            file.write(content.replace("1}", "2}"))
+
+        ApiContextSecretLoader("project", "secret", "1", cache_path=cache_path).load()
+        ApiContextSecretLoader("project", "secret", "1", cache_path=cache_path).load()
+
+        assert client.access_secret_version.call_count == 2
+
+    def test_when_saved_expect_new_version_added_before_cleanup(
+        self, client_class, api_context
+    ):
+        client = client_class.return_value
+        client.add_secret_version = Mock(return_value=MagicMock())
+        client.add_secret_version.return_value.name = "versions/4"
+        versions = [MagicMock(), MagicMock(), MagicMock()]
+        for version, name in zip(versions, ["versions/1", "versions/3", "versions/4"]):
+            version.name = name
+        client.list_secret_versions = Mock(return_value=versions)
+        client.parse_secret_version_path = lambda name: {
+            "secret_version": name.split("/")[-1]
+        }
+        loader = ApiContextSecretLoader("project", "secret", "1")
+        context = MagicMock()
+        context.to_json = Mock(return_value='{"session": 2}')
+
+        loader.save(context)
+        loader.wait_for_cleanup()
+
+        assert client.method_calls[0][0] == "secret_path"
+        assert client.method_calls[1][0] == "add_secret_version"
+        client.destroy_secret_version.assert_called_once_with(
+            request={"name": "versions/3"}
+        )
+
+        client.get_secret_version = Mock(
+            return_value=self._latest_version("versions/4")
+        )
+        loader.load()
+        client.access_secret_version.assert_not_called()
+
+
+@patch("bunq.sdk.security.security.is_valid_response_body", is_valid_response_body)
+class TestBunqStandIn:
+    def setup_method(self):
+        self.state = BunqState()
+        self.state.add_account("NL76BUNQ2063655000", "100.00")
+        self.state.add_account("NL76BUNQ2063655073", "0.00")
+
+    def _bunq(self, stand_in):
+        bunq_ = BunqClient(
+            api_key="sandbox_key",
+            environment_type="sandbox",
+            device_description="stand-in",
+            api_context_loader=MagicMock(load=Mock(return_value=None)),
+            rate_limiter=RateLimiter(sleep_=Mock()),
+            base_url=stand_in.base_url,
+        )
+        bunq_.connect()
+        return bunq_
+
+    def test_when_running_flows_expect_transfers_on_stand_in(self):
+        store_ = MagicMock()
+        store_.get_flows = Mock(
+            return_value=[
+                Transfer(
+                    value=Decimal(value),
+                    strategy_type="fixed",
+                    **default_payment_kwargs,
+                )
+                for value in ["10.00", "15.50"]
+            ]
+        )
+        with BunqStandIn(bunq_config(rate_limits={}), state=self.state) as stand_in:
+            ledger = BalanceLedger(self._bunq(stand_in))
+            FlowProcessor(
+                client_adapter=BankClientAdapter(ledger, batch_payments=True),
+                store=store_,
+            ).run()
+
+            assert ledger.reconcile() == {}
+
+        balances = {
+            account.iban: account.balance for account in self.state.accounts.values()
+        }
+        assert balances == {
+            "NL76BUNQ2063655000": Decimal("74.50"),
+            "NL76BUNQ2063655073": Decimal("25.50"),
+        }
+        assert len(self.state.payment_batches) == 1
+
+    def test_when_window_full_expect_requests_throttled_until_oldest_expires(self):
+        config = bunq_config(rate_limits={"GET": 2}, rate_limit_period=0.4)
+        stand_in = BunqStandIn(config, state=self.state)
+        try:
+            outcomes = [stand_in.outcome("GET") for _ in range(3)]
+            # A refilling bucket would have a token again by now
+            sleep(0.25)
+            outcomes.append(stand_in.outcome("GET"))
+            sleep(0.2)
+            outcomes.append(stand_in.outcome("GET"))
+        finally:
+            stand_in.server_close()
+
+        assert outcomes == [None, None, 429, 429, None]
+
+    def test_when_rate_limited_expect_payment_retried(self):
+        config = bunq_config(rate_limits={"POST": 4}, rate_limit_period=0.3)
+        with BunqStandIn(config, state=self.state) as stand_in:
+            bunq_ = self._bunq(stand_in)
+            bunq_.rate_limiter = RateLimiter({"POST": 100}, period=0.3)
+            bunq_.backoff = BackoffPolicy(base_delay=0.01)
+            results = [
+                bunq_.make_payment(amount=Decimal("1.00"), **default_payment_kwargs)
+                for _ in range(3)
+            ]
+
+        # Connecting takes three of the four POST requests, so the stand-in
+        # throttles the payments while the client limiter lets them through
+        assert results == [True, True, True]
+        assert len(self.state.payments) == 3
+        assert (
+            bunq_.metrics.requests.value(
+                client="bunq", endpoint="payment", method="POST", status="429"
+            )
+            >= 1
+        )
+
+
+class TestCashflowSimulator:
+    documents = [
+        {
+            "description": "rent",
+            "value": "300.00",
+            "strategy_type": "fixed",
+            "priority": 1,
+            "source_iban": "NL00MAIN",
+            "target_iban": "NL00RENT",
+            "target_iban_name": "landlord",
+        },
+        {
+            "description": "buffer",
+            "value": "250.00",
+            "strategy_type": "top_up",
+            "priority": 2,
+            "source_iban": "NL00MAIN",
+            "target_iban": "NL00BUFF",
+            "target_iban_name": "buffer",
+        },
+        {
+            "description": "savings",
+            "value": "50",
+            "strategy_type": "percentage",
+            "priority": 3,
+            "source_iban": "NL00MAIN",
+            "target_iban": "NL00SAVE",
+            "target_iban_name": "savings",
+        },
+    ]
+
+    def test_when_simulating_expect_flows_run_between_income_and_spending(self):
+        assumptions = Assumptions(
+            opening_balances={"NL00BUFF": Money(100_00), "NL00SAVE": Money(0)},
+            income=(MonthlyAmount(account="NL00MAIN", mean=Money(1000_00)),),
+            spending=(MonthlyAmount(account="NL00BUFF", mean=Money(100_00)),),
+        )
+
+        trajectories = simulate(self.documents, assumptions, months=2, workers=1)
+
+        # Payments to the landlord leave the simulation
+        assert trajectories.accounts == ("NL00BUFF", "NL00SAVE", "NL00MAIN")
+        assert trajectories.trajectory(0, "NL00MAIN") == [
+            Money(0),
+            Money(275_00),
+            Money(437_50),
+        ]
+        assert trajectories.trajectory(0, "NL00BUFF") == [
+            Money(100_00),
+            Money(150_00),
+            Money(150_00),
+        ]
+        assert trajectories.balance(0, 2, "NL00SAVE") == Money(712_50)
+
+    def test_when_simulating_in_processes_expect_same_scenarios(self):
+        assumptions = Assumptions(
+            opening_balances={},
+            income=(
+                MonthlyAmount(
+                    account="NL00MAIN", mean=Money(1000_00), stddev=Money(200_00)
+                ),
+            ),
+            one_offs=(
+                OneOffExpense(
+                    account="NL00BUFF",
+                    probability=0.5,
+                    minimum=Money(50_00),
+                    maximum=Money(400_00),
+                ),
+            ),
+        )
+
+        in_process = simulate(
+            self.documents, assumptions, months=6, scenarios=8, seed=3, workers=1
+        )
+        pooled = simulate(
+            self.documents, assumptions, months=6, scenarios=8, seed=3, workers=2
+        )
+
+        assert pooled.scenarios == in_process.scenarios
+        assert len(set(map(tuple, in_process.scenarios))) == 8
+        summary = list(in_process.summary())
+        # The savings account has no opening balance and is not simulated
+        assert in_process.accounts == ("NL00MAIN", "NL00BUFF")
+        assert len(summary) == 7 * 2
+        assert summary[-1]["month"] == 6
+        assert summary[-1]["p5"] <= summary[-1]["p50"] <= summary[-1]["p95"]
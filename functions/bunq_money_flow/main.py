@@ -1,20 +1,17 @@
+import json
 import logging
 import os
+from typing import TYPE_CHECKING
 
-from bunq.sdk.security import security
 from dotenv import load_dotenv
-from firebase_admin import firestore, initialize_app
 from firebase_functions import scheduler_fn
 from firebase_functions.params import StringParam
 
-from lib.flow_processor import FlowProcessor
-from src import (
-    ApiContextSecretLoader,
-    BunqClient,
-    TransferFlows,
-    BankClientAdapter,
-)
-from src.security_monkey_patch import is_valid_response_body
+from lib.client_registry import clients
+from lib.metrics import default_registry
+
+if TYPE_CHECKING:
+    from src import BunqClient
 
 load_dotenv()
 
@@ -30,10 +27,8 @@ BUNQ_CONFIG_SECRET_PERMANENT_VERSION = StringParam(
 )
 REGION = StringParam("REGION")
 
-initialize_app()
-
-# Monkey patching the bunq sdk to use the custom is_valid_response_body function
-security.is_valid_response_body = is_valid_response_body
+# In-memory filesystem of the instance, lets a reconnect skip Secret Manager
+API_CONTEXT_CACHE_PATH = "/tmp/bunq_api_context.json"
 
 
 @scheduler_fn.on_schedule(
@@ -43,11 +38,47 @@ security.is_valid_response_body = is_valid_response_body
     ingress="ALLOW_INTERNAL_ONLY",
 )
 def bunq_monthly_sorter(_event: scheduler_fn.ScheduledEvent):
+    # Heavy dependencies are imported here instead of at module level, so
+    # loading the module to discover the function stays cheap.
+    from firebase_admin import firestore, initialize_app
+
+    from lib.flow_processor import FlowProcessor
+    from src import BalanceLedger, BankClientAdapter, TransferFlows
+
     logging.basicConfig(level=logging.INFO)
     api_key = os.environ.get(BUNQ_API_KEY_SECRET_NAME.value)
-    client = firestore.client()
+    clients.get("firebase_app", initialize_app)
+    client = clients.get("firestore", firestore.client)
     store_ = TransferFlows(client=client)
 
+    bunq_ = clients.get(
+        ("bunq", api_key),
+        lambda: _connect_bunq_client(api_key),
+        expires_at=lambda bunq_client: bunq_client.session_expires_at,
+    )
+    bunq_.reset()
+    ledger = BalanceLedger(bunq_)
+
+    processor = FlowProcessor(
+        client_adapter=BankClientAdapter(ledger, batch_payments=True), store=store_
+    )
+    processor.run()
+    ledger.reconcile()
+    bunq_.api_context_loader.wait_for_cleanup()
+
+    logging.info(f"Client metrics: {json.dumps(default_registry.dump())}")
+    default_registry.reset()
+
+
+def _connect_bunq_client(api_key: str) -> "BunqClient":
+    from bunq.sdk.security import security
+
+    from src import ApiContextSecretLoader, BunqClient
+    from src.security_monkey_patch import is_valid_response_body
+
+    # Monkey patching the bunq sdk to use the custom is_valid_response_body function
+    security.is_valid_response_body = is_valid_response_body
+
     bunq_ = BunqClient(
         api_key=api_key,
         environment_type=ENVIRONMENT,
@@ -56,9 +87,8 @@ def bunq_monthly_sorter(_event: scheduler_fn.ScheduledEvent):
             PROJECT_ID,
             BUNQ_CONFIG_SECRET_NAME.value,
             BUNQ_CONFIG_SECRET_PERMANENT_VERSION.value,
+            cache_path=API_CONTEXT_CACHE_PATH,
         ),
     )
     bunq_.connect()
-
-    processor = FlowProcessor(client_adapter=BankClientAdapter(bunq_), store=store_)
-    processor.run()
+    return bunq_
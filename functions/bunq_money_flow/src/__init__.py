@@ -1,4 +1,35 @@
-from .bunq_lib import BunqClient
-from .money_flow import BankClientAdapter
-from .secret_loader import ApiContextSecretLoader
-from .transfer_flows import TransferFlows
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .bunq_lib import BunqClient
+    from .ledger import BalanceLedger
+    from .money_flow import BankClientAdapter
+    from .secret_loader import ApiContextSecretLoader
+    from .transfer_flows import TransferFlows
+
+# The bunq SDK and Secret Manager are slow to import, submodules are only loaded
+# once one of their names is accessed.
+_LAZY_ATTRIBUTES = {
+    "BunqClient": ".bunq_lib",
+    "BalanceLedger": ".ledger",
+    "BankClientAdapter": ".money_flow",
+    "ApiContextSecretLoader": ".secret_loader",
+    "TransferFlows": ".transfer_flows",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
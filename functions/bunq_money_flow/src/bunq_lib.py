@@ -1,15 +1,22 @@
 import logging
 import warnings
 from decimal import Decimal
-from time import sleep
-from typing import Protocol, Optional
+from itertools import groupby
+from time import sleep, monotonic, perf_counter
+from typing import Protocol, Optional, List, Callable, TypeVar, Dict, Union
 
+from aenum import extend_enum
 from bunq.sdk.context.api_context import ApiContext
 from bunq.sdk.context.api_environment_type import ApiEnvironmentType
 from bunq.sdk.context.bunq_context import BunqContext
+from bunq.sdk.exception.api_exception import ApiException
+from bunq.sdk.exception.too_many_requests_exception import (
+    TooManyRequestsException,
+)
 from bunq.sdk.model.generated.endpoint import (
     MonetaryAccount,
     Payment,
+    PaymentBatch,
     MonetaryAccountBank,
     MonetaryAccountSavings,
     MonetaryAccountJoint,
@@ -19,12 +26,72 @@ from bunq.sdk.model.generated.endpoint import (
     MonetaryAccountLight,
 )
 from bunq.sdk.model.generated.object_ import Amount, Pointer
+from requests.exceptions import ConnectionError, ConnectTimeout
+from urllib3.exceptions import NewConnectionError
 
-from .types import BankClient
+from lib.metrics import ClientMetrics, MetricsRegistry
+from .rate_limiter import BackoffPolicy, RateLimiter, default_rate_limiter
+from .types import BankClient, PaymentRequest, PaymentResult
 
 warnings.filterwarnings("ignore", message=r".*bunq SDK beta.*")
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Upper bound on the payments submitted in a single PaymentBatch request
+_MAX_PAYMENTS_PER_BATCH = 100
+# Largest page bunq returns, so all accounts of a user arrive in one request
+_MAX_ACCOUNTS_PER_PAGE = 200
+
+MonetaryAccountType = Union[
+    MonetaryAccountBank,
+    MonetaryAccountLight,
+    MonetaryAccountSavings,
+    MonetaryAccountJoint,
+    MonetaryAccountExternalSavings,
+    MonetaryAccountExternal,
+    MonetaryAccountInvestment,
+]
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return _status_code(error) == 429
+
+
+def _was_not_sent(error: Exception) -> bool:
+    # The connection could not be made, so the request never reached bunq
+    if isinstance(error, ConnectTimeout):
+        return True
+
+    if isinstance(error, ConnectionError) and error.args:
+        reason = getattr(error.args[0], "reason", error.args[0])
+        return isinstance(reason, NewConnectionError)
+
+    return False
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    if isinstance(error, TooManyRequestsException):
+        return 429
+
+    if isinstance(error, ApiException):
+        return error.response_code
+
+    return None
+
+
+def _environment_for(base_url: str) -> ApiEnvironmentType:
+    # The SDK only knows production and sandbox, other hosts such as a local
+    # stand-in are added as extra members, so api contexts keep serializing.
+    uri_base = base_url.rstrip("/") + "/v1/"
+    for environment in ApiEnvironmentType:
+        if environment.uri_base == uri_base:
+            return environment
+
+    name = f"CUSTOM_{len(ApiEnvironmentType)}"
+    extend_enum(ApiEnvironmentType, name, uri_base)
+    return ApiEnvironmentType[name]
+
 
 class ApiContextLoader(Protocol):
     def save(self, api_context: ApiContext):
@@ -41,18 +108,37 @@ class BunqClient(BankClient):
         environment_type,
         device_description,
         api_context_loader: ApiContextLoader,
+        *,
+        payment_batch_size: int = _MAX_PAYMENTS_PER_BATCH,
+        rate_limiter: RateLimiter = default_rate_limiter,
+        backoff: BackoffPolicy = BackoffPolicy(),
+        accounts_ttl: Optional[float] = None,
+        metrics_registry: Optional[MetricsRegistry] = None,
+        base_url: Optional[str] = None,
     ):
         self.api_key = api_key
-        self.environment_type = (
-            ApiEnvironmentType.PRODUCTION
-            if environment_type == "production"
-            else ApiEnvironmentType.SANDBOX
-        )
+        if base_url is not None:
+            self.environment_type = _environment_for(base_url)
+        elif environment_type == "production":
+            self.environment_type = ApiEnvironmentType.PRODUCTION
+        else:
+            self.environment_type = ApiEnvironmentType.SANDBOX
         self.device_description = device_description
         self.api_context_loader = api_context_loader
+        self.rate_limiter = rate_limiter
+        self.backoff = backoff
+        self.payment_batch_size = max(
+            1, min(payment_batch_size, _MAX_PAYMENTS_PER_BATCH)
+        )
+
+        self.accounts_ttl = accounts_ttl
+        self.metrics = ClientMetrics("bunq", metrics_registry)
 
         self.is_connected = False
-        self._memoized_accounts = None
+        self.api_context: Optional[ApiContext] = None
+        self._accounts_by_iban: Optional[Dict[str, MonetaryAccountType]] = None
+        self._accounts_by_id: Optional[Dict[int, MonetaryAccountType]] = None
+        self._accounts_loaded_at: Optional[float] = None
 
     def connect(self):
         api_context = self.api_context_loader.load()
@@ -70,8 +156,20 @@ class BunqClient(BankClient):
             self.api_context_loader.save(api_context)
 
         BunqContext.load_api_context(api_context)
+        self.api_context = api_context
         self.is_connected = True
 
+    @property
+    def session_expires_at(self) -> Optional[float]:
+        if self.api_context is None or self.api_context.session_context is None:
+            return None
+
+        return self.api_context.session_context.expiry_time.timestamp()
+
+    def reset(self):
+        # Drops the state of the previous run, the session stays connected
+        self.invalidate_accounts()
+
     def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
         if not self.is_connected:
             raise Exception("Not connected. Please call connect first")
@@ -82,6 +180,16 @@ class BunqClient(BankClient):
 
         return Decimal(account.balance.value)
 
+    def get_balances(self) -> Dict[str, Decimal]:
+        if not self.is_connected:
+            raise Exception("Not connected. Please call connect first")
+
+        self._ensure_accounts()
+        return {
+            iban: Decimal(account.balance.value)
+            for iban, account in self._accounts_by_iban.items()
+        }
+
     def make_payment(
         self,
         *,
@@ -90,35 +198,132 @@ class BunqClient(BankClient):
         target_iban: str,
         target_iban_name: str,
         source_iban: str,
-    ) -> None:
+    ) -> bool:
         if not self.is_connected:
             raise Exception("Not connected. Please call connect first")
 
-        max_retries = 5
-        retry_delay = 10
-        retry_count = 0
         account_id = self._get_account_id(iban=source_iban)
 
-        while retry_count < max_retries:
+        def create_payment():
+            logger.info(
+                f"Making payment of {amount} to {target_iban} ({target_iban_name})"
+            )
+            Payment.create(
+                amount=Amount("{:.2f}".format(amount), "EUR"),
+                counterparty_alias=Pointer("IBAN", target_iban, name=target_iban_name),
+                description=description,
+                monetary_account_id=account_id,
+            )
+
+        try:
+            self._with_retries(create_payment, endpoint="payment")
+            return True
+        except Exception:
+            return False
+
+    def make_payments(self, payments: List[PaymentRequest]) -> List[PaymentResult]:
+        if not self.is_connected:
+            raise Exception("Not connected. Please call connect first")
+
+        results = []
+        for source_iban, group in groupby(payments, key=lambda x: x.source_iban):
+            group = list(group)
+            account_id = self._get_account_id(iban=source_iban)
+            if account_id is None:
+                results.extend(
+                    PaymentResult(
+                        payment=payment,
+                        success=False,
+                        error=f"Unknown source account {source_iban}",
+                    )
+                    for payment in group
+                )
+                continue
+
+            for start in range(0, len(group), self.payment_batch_size):
+                chunk = group[start : start + self.payment_batch_size]
+                results.extend(self._make_payment_batch(account_id, chunk))
+
+        return results
+
+    def _make_payment_batch(
+        self, account_id: int, payments: List[PaymentRequest]
+    ) -> List[PaymentResult]:
+        def create_batch():
+            logger.info(
+                f"Making batch of {len(payments)} payments from {payments[0].source_iban}"
+            )
+            return PaymentBatch.create(
+                payments=[
+                    Payment(
+                        amount=Amount("{:.2f}".format(payment.amount), "EUR"),
+                        counterparty_alias=Pointer(
+                            "IBAN", payment.target_iban, name=payment.target_iban_name
+                        ),
+                        description=payment.description,
+                    )
+                    for payment in payments
+                ],
+                monetary_account_id=account_id,
+            ).value
+
+        error = None
+        batch_id = None
+        try:
+            batch_id = self._with_retries(create_batch, endpoint="payment-batch")
+        except Exception as e:
+            error = str(e)
+
+        # A batch is accepted or rejected as a whole, so every payment in it
+        # shares the outcome of the request.
+        return [
+            PaymentResult(
+                payment=payment,
+                success=error is None,
+                error=error,
+                batch_id=batch_id,
+            )
+            for payment in payments
+        ]
+
+    def _with_retries(
+        self, action: Callable[[], T], *, method: str = "POST", endpoint: str
+    ) -> T:
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.acquire(method)
+            start = perf_counter()
             try:
-                logger.info(
-                    f"Making payment of {amount} to {target_iban} ({target_iban_name})"
+                result = action()
+            except Exception as e:
+                self.metrics.observe(
+                    endpoint, method, _status_code(e), perf_counter() - start
                 )
-                Payment.create(
-                    amount=Amount("{:.2f}".format(amount), "EUR"),
-                    counterparty_alias=Pointer(
-                        "IBAN", target_iban, name=target_iban_name
-                    ),
-                    description=description,
-                    monetary_account_id=account_id,
+                logger.error(f"Request failed: {e}")
+                # A POST that failed in any other way may have been executed,
+                # retrying it could make the payments twice
+                retryable = method == "GET" or _is_rate_limited(e) or _was_not_sent(e)
+                if not retryable or attempt >= self.backoff.max_attempts:
+                    raise
+
+                self.metrics.retry(endpoint)
+
+                delay = self.backoff.delay(attempt)
+                if _is_rate_limited(e):
+                    # Nothing fits in the current window anymore, wait for the next one
+                    self.rate_limiter.penalize(method)
+                    delay = max(delay, self.rate_limiter.period)
+
+                logger.info(
+                    f"Retrying in {delay:.1f}s... ({attempt}/{self.backoff.max_attempts})"
                 )
-                sleep(2)
-                break
-            except Exception as e:
-                retry_count += 1
-                logger.error(f"Payment failed: {e}")
-                logger.info(f"Retrying... ({retry_count}/{max_retries})")
-                sleep(retry_delay)
+                sleep(delay)
+                continue
+
+            # The SDK does not expose the raw response, sizes are not recorded
+            self.metrics.observe(endpoint, method, 200, perf_counter() - start)
+            return result
 
     def _get_account_id(self, *, iban: str) -> Optional[int]:
         account = self._get_account(iban=iban)
@@ -127,29 +332,55 @@ class BunqClient(BankClient):
 
         return account.id_
 
-    def _get_account(
-        self, *, iban: str
-    ) -> Optional[
-        MonetaryAccountBank
-        | MonetaryAccountLight
-        | MonetaryAccountSavings
-        | MonetaryAccountJoint
-        | MonetaryAccountExternalSavings
-        | MonetaryAccountExternal
-        | MonetaryAccountInvestment
-    ]:
-        if not self._memoized_accounts:
-            self._memoized_accounts = MonetaryAccount.list().value
-
-        accounts = self._memoized_accounts
+    def invalidate_accounts(self):
+        self._accounts_by_iban = None
+        self._accounts_by_id = None
+        self._accounts_loaded_at = None
+
+    def _load_accounts(self):
+        accounts = self._with_retries(
+            lambda: MonetaryAccount.list(
+                params={"count": _MAX_ACCOUNTS_PER_PAGE}
+            ).value,
+            method="GET",
+            endpoint="monetary-account",
+        )
+
+        accounts_by_iban: Dict[str, MonetaryAccountType] = {}
+        accounts_by_id: Dict[int, MonetaryAccountType] = {}
         for account in accounts:
             if account.is_all_field_none():
                 continue
 
             referenced_object = account.get_referenced_object()
+            accounts_by_id[referenced_object.id_] = referenced_object
             for alias in referenced_object.alias:
-                if alias.type_ == "IBAN" and alias.value == iban:
-                    return referenced_object
+                if alias.type_ == "IBAN":
+                    accounts_by_iban[alias.value] = referenced_object
 
-        else:
+        self._accounts_by_iban = accounts_by_iban
+        self._accounts_by_id = accounts_by_id
+        self._accounts_loaded_at = monotonic()
+
+    def _ensure_accounts(self):
+        expired = (
+            self.accounts_ttl is not None
+            and self._accounts_loaded_at is not None
+            and monotonic() - self._accounts_loaded_at > self.accounts_ttl
+        )
+        if self._accounts_by_iban is None or expired:
+            self._load_accounts()
+
+    def _get_account(self, *, iban: str) -> Optional[MonetaryAccountType]:
+        self._ensure_accounts()
+
+        account = self._accounts_by_iban.get(iban)
+        if account is None:
             logger.error(f"Could not retrieve balance of account with iban {iban}")
+
+        return account
+
+    def _get_account_by_id(self, account_id: int) -> Optional[MonetaryAccountType]:
+        self._ensure_accounts()
+
+        return self._accounts_by_id.get(account_id)
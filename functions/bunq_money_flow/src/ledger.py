@@ -0,0 +1,117 @@
+import logging
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from .types import BankClient, PaymentRequest, PaymentResult
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceLedger(BankClient):
+    # The balances of all accounts are read from the client at once, on the
+    # first read; every transfer executed through the ledger is kept as a delta
+    # on top of that snapshot. Balances the client refetches later already
+    # include those transfers, so they are only read again once invalidated.
+    def __init__(self, bank_client: BankClient):
+        self.bank_client = bank_client
+        self._snapshot: Optional[Dict[str, Decimal]] = None
+        self._deltas: Dict[str, Decimal] = defaultdict(Decimal)
+        self._lock = threading.RLock()
+
+    @property
+    def balances(self) -> Dict[str, Decimal]:
+        with self._lock:
+            return {iban: self._projected(iban) for iban in self._snapshot or {}}
+
+    def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
+        with self._lock:
+            self._take_snapshot()
+            return self._projected(iban)
+
+    def get_balances(self) -> Dict[str, Decimal]:
+        with self._lock:
+            self._take_snapshot()
+            return self.balances
+
+    def make_payment(
+        self,
+        *,
+        amount: Decimal,
+        description: str,
+        target_iban: str,
+        target_iban_name: str,
+        source_iban: str,
+    ) -> bool:
+        self._take_snapshot()
+        success = self.bank_client.make_payment(
+            amount=amount,
+            description=description,
+            target_iban=target_iban,
+            target_iban_name=target_iban_name,
+            source_iban=source_iban,
+        )
+        if success:
+            self._apply(source_iban, target_iban, amount)
+
+        return success
+
+    def make_payments(self, payments: List[PaymentRequest]) -> List[PaymentResult]:
+        self._take_snapshot()
+        results = self.bank_client.make_payments(payments)
+        for result in results:
+            if result.success:
+                self._apply(
+                    result.payment.source_iban,
+                    result.payment.target_iban,
+                    result.payment.amount,
+                )
+
+        return results
+
+    def invalidate_accounts(self):
+        with self._lock:
+            self._snapshot = None
+            self._deltas.clear()
+
+        self.bank_client.invalidate_accounts()
+
+    def reconcile(self) -> Dict[str, Decimal]:
+        projected = self.balances
+        self.invalidate_accounts()
+
+        differences = {}
+        for iban, projected_balance in projected.items():
+            if projected_balance is None:
+                continue
+
+            actual_balance = self.get_balance_by_iban(iban=iban)
+            if actual_balance is None or actual_balance == projected_balance:
+                continue
+
+            difference = actual_balance - projected_balance
+            logger.warning(
+                f"Balance of {iban} is {actual_balance}, expected {projected_balance} ({difference:+})"
+            )
+            differences[iban] = difference
+
+        return differences
+
+    def _take_snapshot(self):
+        # Before the first transfer, so the snapshot never includes one
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = dict(self.bank_client.get_balances())
+
+    def _projected(self, iban: str) -> Optional[Decimal]:
+        balance = self._snapshot.get(iban)
+        if balance is None:
+            return None
+
+        return balance + self._deltas.get(iban, Decimal(0))
+
+    def _apply(self, source_iban: str, target_iban: str, amount: Decimal):
+        with self._lock:
+            self._deltas[source_iban] -= amount
+            self._deltas[target_iban] += amount
@@ -1,32 +1,97 @@
+import logging
+import threading
 from decimal import Decimal
+from typing import Dict, List, Optional
 
 from lib.flow_processor import ClientAdapter
+from lib.money import Money, round_down
 from .strategies import top_up_strategy
 from .transfer_flows import Transfer
-from .types import BankClient
+from .types import BankClient, PaymentRequest, PaymentResult
+
+logger = logging.getLogger(__name__)
 
 
 class BankClientAdapter(ClientAdapter):
-    def __init__(self, bank_client: BankClient):
+    max_concurrency = 3
+
+    def __init__(self, bank_client: BankClient, *, batch_payments: bool = False):
         self.bank_client = bank_client
+        self.batch_payments = batch_payments
+        # Sources are processed by up to max_concurrency threads, the queued
+        # payments of all of them are read for every top up.
+        self._pending_payments: Dict[str, List[PaymentRequest]] = {}
+        self._lock = threading.Lock()
 
     @property
     def strategies(self):
+        return self.strategies_for(self)
+
+    def strategies_for(self, balances):
         return {
-            "top_up": lambda flow, remainder: top_up_strategy(
-                flow, remainder, self.bank_client
-            )
+            "top_up": lambda flow, remainder: top_up_strategy(flow, remainder, balances)
         }
 
-    def handle_processed_flow(self, flow: Transfer, amount: Decimal) -> None:
-        if flow.target_iban != flow.source_iban:
-            self.bank_client.make_payment(
-                amount=amount,
-                description=flow.description,
-                target_iban=flow.target_iban,
-                target_iban_name=flow.target_iban_name,
-                source_iban=flow.source_iban,
-            )
-
-    def get_balance(self, source: str) -> Decimal:
-        return self.bank_client.get_balance_by_iban(iban=source)
+    def handle_processed_flow(self, flow: Transfer, amount: Money) -> None:
+        if flow.target_iban == flow.source_iban:
+            return
+
+        payment = PaymentRequest(
+            amount=amount.to_decimal(),
+            description=flow.description,
+            target_iban=flow.target_iban,
+            target_iban_name=flow.target_iban_name,
+            source_iban=flow.source_iban,
+        )
+        if self.batch_payments:
+            with self._lock:
+                self._pending_payments.setdefault(flow.source_iban, []).append(payment)
+            return
+
+        self.bank_client.make_payment(
+            amount=payment.amount,
+            description=payment.description,
+            target_iban=payment.target_iban,
+            target_iban_name=payment.target_iban_name,
+            source_iban=payment.source_iban,
+        )
+
+    def flush(self, source: str) -> List[PaymentResult]:
+        with self._lock:
+            payments = self._pending_payments.pop(source, [])
+        if not payments:
+            return []
+
+        results = self.bank_client.make_payments(payments)
+        for result in results:
+            if not result.success:
+                logger.error(
+                    f"Payment of {result.payment.amount} to {result.payment.target_iban} failed: {result.error}"
+                )
+
+        return results
+
+    def get_balance(self, source: str) -> Money:
+        return round_down(self.bank_client.get_balance_by_iban(iban=source))
+
+    def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
+        # Queued payments have not reached the bank yet, but a top up of one of
+        # their targets has to take them into account already.
+        balance = self.bank_client.get_balance_by_iban(iban=iban)
+        if balance is None:
+            return None
+
+        with self._lock:
+            pending = [
+                payment
+                for payments in self._pending_payments.values()
+                for payment in payments
+            ]
+
+        for payment in pending:
+            if payment.target_iban == iban:
+                balance += payment.amount
+            if payment.source_iban == iban:
+                balance -= payment.amount
+
+        return balance
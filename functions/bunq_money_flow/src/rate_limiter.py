@@ -0,0 +1,125 @@
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic, sleep
+from typing import Callable, Deque, Dict, Optional
+
+# bunq allows 3 GET, 5 POST and 2 PUT requests within any 3 consecutive seconds
+BUNQ_RATE_LIMIT_PERIOD = 3.0
+BUNQ_RATE_LIMITS = {
+    "GET": 3,
+    "POST": 5,
+    "PUT": 2,
+}
+
+
+class SlidingWindow:
+    # A log of the times the last calls were let through. A call may go once
+    # the oldest of the last capacity calls is period old, so no window of
+    # period seconds ever holds more than capacity calls. Calls that have to
+    # wait are logged at the time they are allowed to go.
+    def __init__(
+        self,
+        capacity: int,
+        period: float,
+        *,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.capacity = capacity
+        self.period = period
+        self.clock = clock
+        self.calls: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self.calls and now - self.calls[0] >= self.period:
+            self.calls.popleft()
+
+    def reserve(self) -> float:
+        # Logs a call and returns how long the caller has to wait before it
+        # may actually be made.
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            at = now
+            if len(self.calls) >= self.capacity:
+                at = max(now, self.calls[-self.capacity] + self.period)
+
+            self.calls.append(at)
+            return at - now
+
+    def try_acquire(self) -> bool:
+        # Logs a call only when it may be made right away
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            if len(self.calls) >= self.capacity:
+                return False
+
+            self.calls.append(now)
+            return True
+
+    def drain(self):
+        # Fills the window, the next call waits a full period
+        with self._lock:
+            now = self.clock()
+            latest = max(now, self.calls[-1]) if self.calls else now
+            self.calls.clear()
+            self.calls.extend([latest] * self.capacity)
+
+    def available(self) -> int:
+        with self._lock:
+            self._expire(self.clock())
+            return max(0, self.capacity - len(self.calls))
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Optional[Dict[str, int]] = None,
+        period: float = BUNQ_RATE_LIMIT_PERIOD,
+        *,
+        clock: Callable[[], float] = monotonic,
+        sleep_: Callable[[float], None] = sleep,
+    ):
+        self.period = period
+        self.sleep = sleep_
+        self.windows = {
+            method: SlidingWindow(capacity, period, clock=clock)
+            for method, capacity in (limits or BUNQ_RATE_LIMITS).items()
+        }
+
+    def acquire(self, method: str) -> float:
+        window = self.windows.get(method.upper())
+        if window is None:
+            return 0.0
+
+        wait = window.reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+        return wait
+
+    def penalize(self, method: str):
+        window = self.windows.get(method.upper())
+        if window is not None:
+            window.drain()
+
+    def state(self) -> Dict[str, int]:
+        return {method: window.available() for method, window in self.windows.items()}
+
+
+@dataclass(frozen=True)
+class BackoffPolicy:
+    max_attempts: int = 5
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+
+    def delay(self, attempt: int, *, rng: Callable[[], float] = random.random) -> float:
+        # Exponential backoff with full jitter, attempt counts from 1
+        ceiling = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return ceiling * rng()
+
+
+default_rate_limiter = RateLimiter()
@@ -1,34 +1,88 @@
+import json
 import logging
-from typing import Optional
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Optional, List
 
 import google_crc32c
 from bunq.sdk.context.api_context import ApiContext
 from google.cloud.secretmanager_v1 import SecretManagerServiceClient
 
 
+def _checksum(data: bytes) -> int:
+    crc32c = google_crc32c.Checksum()
+    crc32c.update(data)
+    return int(crc32c.hexdigest(), 16)
+
+
+@dataclass(frozen=True)
+class _CachedApiContext:
+    version: str
+    payload: str
+    crc32c: int
+
+    @property
+    def is_valid(self) -> bool:
+        return _checksum(self.payload.encode("UTF-8")) == self.crc32c
+
+
 class ApiContextSecretLoader:
-    def __init__(self, project_id: str, secret_name: str, permanent_version: str):
+    def __init__(
+        self,
+        project_id: str,
+        secret_name: str,
+        permanent_version: str,
+        *,
+        cache_path: Optional[str] = None,
+        cleanup_workers: int = 4,
+    ):
         self.project_id = project_id
         self.secret_name = secret_name
         self.client = SecretManagerServiceClient()
         self.permanent_version = permanent_version
+        self.cache_path = cache_path
+        self.cleanup_workers = cleanup_workers
+
+        self._cached: Optional[_CachedApiContext] = None
+        self._cleanup_thread: Optional[threading.Thread] = None
 
     def _get_secret_version(self, secret_name):
         return self.client.parse_secret_version_path(secret_name).get("secret_version")
 
-    def _delete_previous_versions(self, parent):
+    def _stale_versions(self, parent, current_version: str) -> List[str]:
+        names = []
         for version in self.client.list_secret_versions(
             request={"parent": parent, "filter": "state:ENABLED"}
         ):
+            if version.name == current_version:
+                continue
+
             if self._get_secret_version(version.name) == self.permanent_version:
                 logging.info(f"Skipping deletion of permanent version: {version.name}")
                 continue
 
-            try:
-                logging.info(f"Destroying secret version: {version.name}")
-                self.client.destroy_secret_version(request={"name": version.name})
-            except Exception as e:
-                logging.error(e)
+            names.append(version.name)
+
+        return names
+
+    def _destroy_version(self, name: str):
+        try:
+            logging.info(f"Destroying secret version: {name}")
+            self.client.destroy_secret_version(request={"name": name})
+        except Exception as e:
+            logging.error(e)
+
+    def _delete_previous_versions(self, parent, current_version: str):
+        try:
+            names = self._stale_versions(parent, current_version)
+        except Exception as e:
+            logging.error(e)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.cleanup_workers) as executor:
+            list(executor.map(self._destroy_version, names))
 
     def save(self, api_context: ApiContext):
         logging.info("Saving api context")
@@ -36,35 +90,110 @@ class ApiContextSecretLoader:
         parent = self.client.secret_path(self.project_id, self.secret_name)
 
         payload_bytes = json_string.encode("UTF-8")
-        crc32c = google_crc32c.Checksum()
-        crc32c.update(payload_bytes)
+        crc32c = _checksum(payload_bytes)
 
-        self._delete_previous_versions(parent)
-        self.client.add_secret_version(
+        # The new version is added first, so a failing cleanup can never leave
+        # the secret without an enabled version.
+        version = self.client.add_secret_version(
             request={
                 "parent": parent,
-                "payload": {
-                    "data": payload_bytes,
-                    "data_crc32c": int(crc32c.hexdigest(), 16),
-                },
+                "payload": {"data": payload_bytes, "data_crc32c": crc32c},
             }
         )
+        self._store(_CachedApiContext(version.name, json_string, crc32c))
+        self._schedule_cleanup(parent, version.name)
 
     def load(self) -> Optional[ApiContext]:
+        name = self.client.secret_version_path(
+            self.project_id, self.secret_name, "latest"
+        )
+        cached = self._cached or self._read_cache_file()
+        if cached is not None and cached.is_valid and self._is_latest(name, cached):
+            logging.info(f"Using cached api context of {cached.version}")
+            self._cached = cached
+            return ApiContext.from_json(cached.payload)
+
         try:
-            name = self.client.secret_version_path(
-                self.project_id, self.secret_name, "latest"
-            )
             response = self.client.access_secret_version(request={"name": name})
 
-            crc32c = google_crc32c.Checksum()
-            crc32c.update(response.payload.data)
-            if response.payload.data_crc32c != int(crc32c.hexdigest(), 16):
+            if response.payload.data_crc32c != _checksum(response.payload.data):
                 return None
 
             payload = response.payload.data.decode("UTF-8")
+            self._store(
+                _CachedApiContext(response.name, payload, response.payload.data_crc32c)
+            )
             return ApiContext.from_json(payload)
 
         except Exception as e:
             logging.error(e)
             return None
+
+    def _is_latest(self, name: str, cached: _CachedApiContext) -> bool:
+        # Another instance may have saved a newer api context. Reading the
+        # metadata of the latest version is cheaper than accessing its payload.
+        try:
+            latest = self.client.get_secret_version(request={"name": name})
+        except Exception as e:
+            # The payload could not be accessed either, the cache is still valid
+            logging.error(e)
+            return True
+
+        if latest.name != cached.version:
+            logging.info(f"Cached api context of {cached.version} is outdated")
+            return False
+
+        return True
+
+    def invalidate(self):
+        self._cached = None
+        if self.cache_path is not None:
+            try:
+                os.remove(self.cache_path)
+            except FileNotFoundError:
+                pass
+
+    def wait_for_cleanup(self, timeout: Optional[float] = None):
+        # Cloud Functions throttle the CPU once the handler returned, call this
+        # before returning so the cleanup is not cut short.
+        thread = self._cleanup_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _schedule_cleanup(self, parent, current_version: str):
+        # Cleanups are chained, so two of them never list and destroy the
+        # same versions at the same time.
+        previous = self._cleanup_thread
+
+        def cleanup():
+            if previous is not None:
+                previous.join()
+
+            self._delete_previous_versions(parent, current_version)
+
+        self._cleanup_thread = threading.Thread(target=cleanup, daemon=True)
+        self._cleanup_thread.start()
+
+    def _store(self, cached: _CachedApiContext):
+        self._cached = cached
+        if self.cache_path is None:
+            return
+
+        temporary_path = f"{self.cache_path}.tmp"
+        try:
+            with open(temporary_path, "w") as file:
+                json.dump(asdict(cached), file)
+
+            os.replace(temporary_path, self.cache_path)
+        except OSError as e:
+            logging.error(e)
+
+    def _read_cache_file(self) -> Optional[_CachedApiContext]:
+        if self.cache_path is None:
+            return None
+
+        try:
+            with open(self.cache_path) as file:
+                return _CachedApiContext(**json.load(file))
+        except (OSError, ValueError, TypeError):
+            return None
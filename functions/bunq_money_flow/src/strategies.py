@@ -1,24 +1,24 @@
 import logging
-from decimal import Decimal
 
 from lib.common_strategies import (
     _check_maximum_amount,
     _check_minimum_amount,
     _check_remainder,
 )
+from lib.money import Money
 from .transfer_flows import Transfer
 from .types import BankClient
 
 
 def top_up_strategy(
-    transfer: Transfer, remainder: Decimal, bank_client: BankClient
-) -> Decimal:
+    transfer: Transfer, remainder: Money, bank_client: BankClient
+) -> Money:
     logging.info(f"Attempting to top up {transfer.description} to {transfer.value}.")
     balance = bank_client.get_balance_by_iban(iban=transfer.target_iban)
-    amount = transfer.value - balance
+    amount = transfer.value - Money.of(balance, transfer.currency)
     if amount < 0:
         logging.info(f"\t Skipping transfer. Balance is already sufficient.")
-        return Decimal(0)
+        return Money(0, transfer.currency)
 
     amount = _check_remainder(amount, remainder=remainder)
     amount = _check_minimum_amount(amount, minimum_amount=transfer.minimum_amount)
@@ -10,6 +10,10 @@ class Transfer(Flow):
     target_iban_name: str
     source_iban: str
 
+    @property
+    def target(self):
+        return self.target_iban
+
     @property
     def target_label(self):
         return self.target_iban_name
@@ -25,6 +29,8 @@ class Transfer(Flow):
 
 class TransferFlows(FireStore):
     COLLECTION = "transfer_flows"
+    SOURCE_FIELD = "source_iban"
+    TARGET_FIELD = "target_iban"
 
     def create_type(self, **kwargs) -> Transfer:
         return Transfer(**kwargs)
@@ -1,5 +1,23 @@
+from dataclasses import dataclass
 from decimal import Decimal
-from typing import Optional, Protocol
+from typing import Dict, Optional, Protocol, List
+
+
+@dataclass(frozen=True)
+class PaymentRequest:
+    amount: Decimal
+    description: str
+    target_iban: str
+    target_iban_name: str
+    source_iban: str
+
+
+@dataclass(frozen=True)
+class PaymentResult:
+    payment: PaymentRequest
+    success: bool
+    error: Optional[str] = None
+    batch_id: Optional[int] = None
 
 
 class BankClient(Protocol):
@@ -11,8 +29,17 @@ class BankClient(Protocol):
         target_iban: str,
         target_iban_name: str,
         source_iban: str,
-    ) -> None:
+    ) -> bool:
+        ...
+
+    def make_payments(self, payments: List[PaymentRequest]) -> List[PaymentResult]:
         ...
 
     def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
         ...
+
+    def get_balances(self) -> Dict[str, Decimal]:
+        ...
+
+    def invalidate_accounts(self) -> None:
+        ...
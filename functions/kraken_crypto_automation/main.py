@@ -1,15 +1,13 @@
+import json
 import logging
 import os
 
 from dotenv import load_dotenv
-from firebase_admin import initialize_app, firestore
 from firebase_functions import scheduler_fn
 from firebase_functions.params import StringParam
 
-from lib.flow_processor import FlowProcessor
-from src.kraken_client import KrakenClient
-from src.kraken_client_adapter import KrakenClientAdapter
-from src.order_flows import OrderFlows
+from lib.client_registry import clients
+from lib.metrics import default_registry
 
 load_dotenv()
 
@@ -21,7 +19,8 @@ REGION = StringParam("REGION")
 KRAKEN_API_KEY_SECRET_NAME = StringParam("KRAKEN_API_KEY_SECRET_NAME")
 KRAKEN_PRIVATE_KEY_SECRET_NAME = StringParam("KRAKEN_PRIVATE_KEY_SECRET_NAME")
 
-initialize_app()
+# The only writable location of a Cloud Function, kept for the instance lifetime
+ASSET_PAIRS_CATALOG_PATH = "/tmp/kraken_asset_pairs.json"
 
 
 @scheduler_fn.on_schedule(
@@ -31,13 +30,33 @@ initialize_app()
     ingress="ALLOW_INTERNAL_ONLY",
 )
 def monthly_sorter(_event: scheduler_fn.ScheduledEvent):
+    # Heavy dependencies are imported on first invocation, see bunq_money_flow
+    from firebase_admin import firestore, initialize_app
+
+    from lib.flow_processor import FlowProcessor
+    from src.kraken_client import KrakenClient
+    from src.kraken_client_adapter import KrakenClientAdapter
+    from src.order_flows import OrderFlows
+
     logging.basicConfig(level=logging.INFO)
     api_key = os.environ.get(KRAKEN_API_KEY_SECRET_NAME.value)
     private_key = os.environ.get(KRAKEN_PRIVATE_KEY_SECRET_NAME.value)
-    client = firestore.client()
+    clients.get("firebase_app", initialize_app)
+    client = clients.get("firestore", firestore.client)
     store = OrderFlows(client=client)
 
-    kraken = KrakenClient(api_key=api_key, private_key=private_key)
+    kraken = clients.get(
+        ("kraken", api_key),
+        lambda: KrakenClient(
+            api_key=api_key,
+            private_key=private_key,
+            catalog_path=ASSET_PAIRS_CATALOG_PATH,
+        ),
+    )
+    kraken.reset()
 
     processor = FlowProcessor(client_adapter=KrakenClientAdapter(kraken), store=store)
     processor.run()
+
+    logging.info(f"Client metrics: {json.dumps(default_registry.dump())}")
+    default_registry.reset()
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_DOWN
+from time import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bump when the row layout below changes, older files are then ignored
+_CATALOG_VERSION = 1
+
+
+@dataclass(frozen=True)
+class AssetPair:
+    name: str
+    altname: str
+    pair_decimals: int
+    lot_decimals: int
+    ordermin: Decimal
+    costmin: Optional[Decimal] = None
+    status: str = "online"
+
+    @classmethod
+    def from_kraken(cls, name: str, info: Dict) -> "AssetPair":
+        costmin = info.get("costmin")
+        return cls(
+            name=name,
+            altname=info.get("altname", name),
+            pair_decimals=int(info.get("pair_decimals", 0)),
+            lot_decimals=int(info.get("lot_decimals", 8)),
+            ordermin=Decimal(info.get("ordermin", "0")),
+            costmin=Decimal(costmin) if costmin is not None else None,
+            status=info.get("status", "online"),
+        )
+
+    @classmethod
+    def from_row(cls, altname: str, row: list) -> "AssetPair":
+        name, pair_decimals, lot_decimals, ordermin, costmin, status = row
+        return cls(
+            name=name,
+            altname=altname,
+            pair_decimals=pair_decimals,
+            lot_decimals=lot_decimals,
+            ordermin=Decimal(ordermin),
+            costmin=Decimal(costmin) if costmin is not None else None,
+            status=status,
+        )
+
+    def to_row(self) -> list:
+        return [
+            self.name,
+            self.pair_decimals,
+            self.lot_decimals,
+            str(self.ordermin),
+            str(self.costmin) if self.costmin is not None else None,
+            self.status,
+        ]
+
+    def validate(
+        self, volume: Decimal, price: Decimal
+    ) -> Tuple[Optional[Decimal], Optional[Decimal], Optional[str]]:
+        if self.status != "online":
+            return None, None, f"{self.altname} is {self.status}"
+
+        price = price.quantize(Decimal(1).scaleb(-self.pair_decimals))
+        volume = volume.quantize(
+            Decimal(1).scaleb(-self.lot_decimals), rounding=ROUND_DOWN
+        )
+        if volume < self.ordermin:
+            return None, None, f"Volume {volume} is below minimum {self.ordermin}"
+
+        if self.costmin is not None and volume * price < self.costmin:
+            return None, None, f"Cost {volume * price} is below minimum {self.costmin}"
+
+        return volume, price, None
+
+
+class AssetPairCatalog:
+    def __init__(
+        self,
+        fetch: Callable[[], Dict[str, Dict]],
+        path: Optional[str] = None,
+        *,
+        ttl: float = 24 * 60 * 60,
+        retry_after: float = 5 * 60,
+        clock: Callable[[], float] = time,
+    ):
+        self.fetch = fetch
+        self.path = path
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.clock = clock
+        self.pairs: Dict[str, AssetPair] = {}
+        self.fetched_at: Optional[float] = None
+        self.failed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    @property
+    def is_stale(self) -> bool:
+        return self.fetched_at is None or self.clock() - self.fetched_at > self.ttl
+
+    @property
+    def is_backing_off(self) -> bool:
+        # A failed refresh is not retried for every pair that is looked up
+        return (
+            self.failed_at is not None
+            and self.clock() - self.failed_at < self.retry_after
+        )
+
+    def get(self, pair: str) -> Optional[AssetPair]:
+        if self.is_backing_off:
+            return self.pairs.get(pair)
+
+        if not self.pairs:
+            if not self.load():
+                self.refresh()
+        elif self.is_stale:
+            # Pair metadata rarely changes, a stale entry is good enough while
+            # the catalog is refreshed.
+            self.refresh_in_background()
+
+        return self.pairs.get(pair)
+
+    def load(self) -> bool:
+        if self.path is None:
+            return False
+
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if data.get("version") != _CATALOG_VERSION:
+            return False
+
+        with self._lock:
+            self.pairs = {
+                altname: AssetPair.from_row(altname, row)
+                for altname, row in data.get("pairs", {}).items()
+            }
+            self.fetched_at = data.get("fetched_at")
+
+        return not self.is_stale
+
+    def refresh(self):
+        try:
+            result = self.fetch()
+        except Exception as e:
+            logger.error(f"\t Refreshing asset pairs failed: {e}")
+            self.failed_at = self.clock()
+            return
+
+        pairs = {}
+        for name, info in result.items():
+            pair = AssetPair.from_kraken(name, info)
+            pairs[pair.altname] = pair
+
+        with self._lock:
+            self.pairs = pairs
+            self.fetched_at = self.clock()
+            self.failed_at = None
+
+        self._save()
+
+    def refresh_in_background(self) -> threading.Thread:
+        with self._lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(
+                    target=self.refresh, daemon=True
+                )
+                self._refresh_thread.start()
+
+            return self._refresh_thread
+
+    def _save(self):
+        if self.path is None:
+            return
+
+        with self._lock:
+            data = {
+                "version": _CATALOG_VERSION,
+                "fetched_at": self.fetched_at,
+                "pairs": {
+                    altname: pair.to_row() for altname, pair in self.pairs.items()
+                },
+            }
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(data, file, separators=(",", ":"))
+
+        os.replace(temporary_path, self.path)
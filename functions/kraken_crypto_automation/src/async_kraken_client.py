@@ -0,0 +1,41 @@
+import asyncio
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from .kraken_client import KrakenClient
+
+
+class AsyncKrakenClient:
+    # Runs the blocking client calls in worker threads, sharing its pooled
+    # session and nonce generator. Only the public calls overlap: the client
+    # sends one private call at a time so the nonces reach Kraken in order,
+    # which is why orders are not placed through here.
+    def __init__(self, kraken: KrakenClient, *, max_concurrency: int = 4):
+        self.kraken = kraken
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+
+        return self._semaphore
+
+    async def _call(self, function, *args, **kwargs):
+        async with self._get_semaphore():
+            return await asyncio.to_thread(function, *args, **kwargs)
+
+    async def get_balance(self, source: str) -> Optional[Decimal]:
+        return await self._call(self.kraken.get_balance, source)
+
+    async def get_price(self, pair: str) -> Optional[str]:
+        return await self._call(self.kraken.get_price, pair)
+
+    async def get_pair_information(self, pair: str) -> Optional[Dict]:
+        return await self._call(self.kraken.get_pair_information, pair)
+
+    async def prefetch(self, pairs: Iterable[str]):
+        return await self._call(self.kraken.prefetch, list(pairs))
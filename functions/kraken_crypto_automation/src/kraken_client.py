@@ -1,19 +1,33 @@
 import base64
 import hashlib
 import hmac
+import json
 import logging
+import threading
 import urllib.parse
+from contextlib import nullcontext
+from dataclasses import dataclass, field
 from decimal import Decimal
-from time import time
-from typing import Optional, Dict
+from time import time, perf_counter
+from typing import Optional, Dict, Tuple, Iterable, Callable, List
 
 import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.util.retry import Retry
+
+from lib.metrics import ClientMetrics, MetricsRegistry
+from .asset_pairs import AssetPair, AssetPairCatalog
 
 logger = logging.getLogger(__name__)
 
+# Kraken accepts between 2 and 15 orders for a single pair in one AddOrderBatch
+_MIN_ORDERS_PER_BATCH = 2
+_MAX_ORDERS_PER_BATCH = 15
+
 
-def get_kraken_signature(urlpath, data, secret):
-    postdata = urllib.parse.urlencode(data)
+def get_kraken_signature(urlpath, data, secret, *, postdata=None):
+    if not isinstance(postdata, str):
+        postdata = urllib.parse.urlencode(data)
     encoded = (str(data["nonce"]) + postdata).encode()
     message = urlpath.encode() + hashlib.sha256(encoded).digest()
 
@@ -22,6 +36,43 @@ def get_kraken_signature(urlpath, data, secret):
     return sigdigest.decode()
 
 
+@dataclass(frozen=True)
+class OrderResult:
+    pair: str
+    amount: Decimal
+    txid: Optional[str] = None
+    price: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+class NonceGenerator:
+    # Kraken rejects a nonce that is not larger than the previous one of the
+    # same API key, so two calls in the same millisecond must not share one.
+    def __init__(self, clock: Callable[[], float] = time):
+        self.clock = clock
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self._lock:
+            self.last = max(int(self.clock() * 1000), self.last + 1)
+            return self.last
+
+
+default_nonce_generator = NonceGenerator()
+
+
+@dataclass
+class MarketSnapshot:
+    # Both keyed by the pair's altname, as used in the order flows
+    prices: Dict[str, str] = field(default_factory=dict)
+    pairs: Dict[str, Dict] = field(default_factory=dict)
+
+
 class KrakenClient:
     _BASE_URL = "https://api.kraken.com"
     _BASE_PATH_PRIVATE = "/0/private"
@@ -32,13 +83,70 @@ class KrakenClient:
     }
 
     _ADD_ORDER_PATH = "/AddOrder"
+    _ADD_ORDER_BATCH_PATH = "/AddOrderBatch"
     _GET_BALANCE_PATH = "/Balance"
 
-    def __init__(self, api_key, private_key, environment="development"):
+    def __init__(
+        self,
+        api_key,
+        private_key,
+        environment="development",
+        *,
+        base_url: str = _BASE_URL,
+        transport: Optional[BaseAdapter] = None,
+        pool_size: int = 10,
+        timeout: Tuple[float, float] = (3.05, 10),
+        max_retries: int = 3,
+        nonce: NonceGenerator = default_nonce_generator,
+        catalog_path: Optional[str] = None,
+        catalog_ttl: float = 24 * 60 * 60,
+        metrics_registry: Optional[MetricsRegistry] = None,
+    ):
         self.api_key = api_key
         self.private_key = private_key
         self.environment = environment
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.nonce = nonce
+        self._private_lock = threading.Lock()
         self.balances: Optional[Dict[str, Decimal]] = None
+        self.market = MarketSnapshot()
+        self.metrics = ClientMetrics("kraken", metrics_registry)
+        self.catalog = (
+            AssetPairCatalog(
+                self.get_all_pairs_information, catalog_path, ttl=catalog_ttl
+            )
+            if catalog_path is not None
+            else None
+        )
+
+        self.session = requests.Session()
+        self.session.mount(
+            self.base_url,
+            transport or self._create_transport(pool_size, max_retries),
+        )
+
+    @staticmethod
+    def _create_transport(pool_size: int, max_retries: int) -> BaseAdapter:
+        # Only the public GET endpoints are idempotent, a retried private POST
+        # could place the same order twice.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+        )
+        return HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, max_retries=retry
+        )
+
+    def close(self):
+        self.session.close()
+
+    def reset(self):
+        # Drops the state of the previous run, the pooled session is kept
+        self.balances = None
+        self.market = MarketSnapshot()
 
     def _request(
         self,
@@ -49,6 +157,7 @@ class KrakenClient:
         headers=None,
         payload=None,
         base_path=_BASE_PATH_PRIVATE,
+        json_body=False,
     ):
         if payload is None:
             payload = {}
@@ -59,15 +168,52 @@ class KrakenClient:
         if params is None:
             params = {}
 
-        payload.update({"nonce": int(time() * 1000)})
-        full_url = self._BASE_URL + base_path + url
-        signature = get_kraken_signature(base_path + url, payload, self.private_key)
-        full_headers = {**headers, "API-Key": self.api_key, "API-Sign": signature}
+        # Kraken rejects a nonce lower than one it has already seen, so a private
+        # call holds the lock from drawing its nonce until it is answered
+        private = base_path == self._BASE_PATH_PRIVATE
+        with self._private_lock if private else nullcontext():
+            payload.update({"nonce": self.nonce()})
+            full_url = self.base_url + base_path + url
+            body = payload
+            if json_body:
+                # Kraken signs the exact body, which has to be JSON for nested orders
+                body = json.dumps(payload)
+                headers = {**headers, "Content-Type": "application/json"}
 
-        response = requests.request(
-            method, full_url, headers=full_headers, data=payload, params=params
-        )
-        return response
+            signature = get_kraken_signature(
+                base_path + url, payload, self.private_key, postdata=body
+            )
+            full_headers = {**headers, "API-Key": self.api_key, "API-Sign": signature}
+
+            start = perf_counter()
+            try:
+                response = self.session.request(
+                    method,
+                    full_url,
+                    headers=full_headers,
+                    data=body,
+                    params=params,
+                    timeout=self.timeout,
+                )
+            except requests.RequestException:
+                self.metrics.observe(url, method, None, perf_counter() - start)
+                raise
+
+            self.metrics.observe(
+                url,
+                method,
+                response.status_code,
+                perf_counter() - start,
+                sent=len(response.request.body or ""),
+                received=len(response.content),
+            )
+
+            # Retries of idempotent requests happen inside the transport
+            retries = getattr(response.raw, "retries", None)
+            if retries is not None:
+                self.metrics.retry(url, len(retries.history))
+
+            return response
 
     def _get_balances(self):
         response = self._request(method="POST", url=self._GET_BALANCE_PATH).json()
@@ -105,7 +251,7 @@ class KrakenClient:
         json = response.json()
         error = json.get("error", [])
         if len(error) > 0:
-            logger.error("\t " + error)
+            logger.error(f"\t {error}")
             return None
 
         result = json.get("result", {})
@@ -115,39 +261,218 @@ class KrakenClient:
 
         return first_item
 
-    def add_limit_order(self, pair: str, amount: Decimal, *, type="buy") -> None:
-        last_closed_price = self.get_price(pair)
+    def get_all_pairs_information(self) -> Dict[str, Dict]:
+        response = self._request(
+            method="GET", url="/AssetPairs", base_path=self._BASE_PATH_PUBLIC
+        )
+        json = response.json()
+        error = json.get("error", [])
+        if len(error) > 0:
+            raise Exception(", ".join(error))
+
+        return json.get("result", {})
+
+    def get_pairs_information(self, pairs: Iterable[str]) -> Dict[str, Dict]:
+        pairs = set(pairs)
+        if not pairs:
+            return {}
+
+        response = self._request(
+            method="GET",
+            url="/AssetPairs",
+            base_path=self._BASE_PATH_PUBLIC,
+            params={"pair": ",".join(sorted(pairs))},
+        )
+        json = response.json()
+        error = json.get("error", [])
+        if len(error) > 0:
+            logger.error(f"\t {error}")
+            return {}
+
+        # Results are keyed by Kraken's internal pair name, the flows use the altname
+        return {
+            info["altname"]: {**info, "name": name}
+            for name, info in json.get("result", {}).items()
+            if info.get("altname") in pairs
+        }
+
+    def get_prices(self, pairs: Iterable[str]) -> Dict[str, str]:
+        pairs = set(pairs)
+        if not pairs:
+            return {}
+
+        response = self._request(
+            method="GET",
+            url="/Ticker",
+            base_path=self._BASE_PATH_PUBLIC,
+            params={"pair": ",".join(sorted(pairs))},
+        )
+        json = response.json()
+        error = json.get("error", [])
+        if len(error) > 0:
+            logger.error(f"\t {error}")
+            return {}
+
+        altnames = {
+            info["name"]: altname for altname, info in self.market.pairs.items()
+        }
+        if self.catalog is not None:
+            altnames.update(
+                (asset_pair.name, asset_pair.altname)
+                for asset_pair in map(self.catalog.get, pairs)
+                if asset_pair is not None
+            )
+        prices = {}
+        for name, ticker in json.get("result", {}).items():
+            altname = name if name in pairs else altnames.get(name)
+            if altname is not None:
+                prices[altname] = ticker.get("c", [None])[0]
+
+        return prices
+
+    def prefetch(self, pairs: Iterable[str]):
+        pairs = set(pairs)
+        if self.catalog is None:
+            missing_pairs = pairs - self.market.pairs.keys()
+            self.market.pairs.update(self.get_pairs_information(missing_pairs))
+
+        missing_prices = pairs - self.market.prices.keys()
+        self.market.prices.update(self.get_prices(missing_prices))
+
+    def _asset_pair(self, pair: str) -> Optional[AssetPair]:
+        if self.catalog is not None:
+            asset_pair = self.catalog.get(pair)
+            if asset_pair is not None:
+                return asset_pair
+
+        # Newly listed pairs and a catalog that could not be fetched
+        pair_info = self.market.pairs.get(pair) or self.get_pair_information(pair)
+        if pair_info is None:
+            return None
+
+        return AssetPair.from_kraken(pair_info.get("name", pair), pair_info)
+
+    def _limit_order(self, pair: str, amount: Decimal, type: str) -> Optional[Dict]:
+        last_closed_price = self.market.prices.get(pair) or self.get_price(pair)
         if last_closed_price is None:
             logger.error(f"\t Price for {pair} not found. Skipping order creation")
             return None
 
-        pair_info = self.get_pair_information(pair)
-        if pair_info is None:
+        asset_pair = self._asset_pair(pair)
+        if asset_pair is None:
             logger.error(
                 f"\t Pair information for {pair} not found. Skipping order creation"
             )
             return None
 
-        pair_decimals = pair_info.get("pair_decimals")
         modifier = "1.02" if type == "buy" else "0.98"
         price = Decimal(last_closed_price) * Decimal(modifier)
-        volume = amount / price
+        volume, price, error = asset_pair.validate(amount / price, price)
+        if error is not None:
+            logger.error(f"\t {error}. Skipping order creation")
+            return None
+
+        return {
+            "ordertype": "limit",
+            "type": type,
+            "volume": str(volume),
+            "price": str(price),
+        }
+
+    def add_limit_order(
+        self, pair: str, amount: Decimal, *, type="buy"
+    ) -> Optional[OrderResult]:
+        order = self._limit_order(pair, amount, type)
+        if order is None:
+            return None
 
         response = self._request(
             self._ADD_ORDER_PATH,
             method="POST",
-            payload={
-                "ordertype": "limit",
-                "type": type,
-                "volume": volume,
-                "pair": pair,
-                "price": f"{price:.{pair_decimals}f}",
-            },
+            payload={**order, "pair": pair},
         )
         json_response = response.json()
         error = json_response.get("error")
 
         if len(error) > 0:
-            logger.error("\t " + error)
-        else:
-            logger.info(f"\t Order created successfully for {pair} at {price}")
+            logger.error(f"\t {error}")
+            return OrderResult(pair=pair, amount=amount, error=", ".join(error))
+
+        logger.info(f"\t Order created successfully for {pair} at {order['price']}")
+        txids = json_response.get("result", {}).get("txid", [])
+        return OrderResult(
+            pair=pair, amount=amount, txid=next(iter(txids), None), price=order["price"]
+        )
+
+    def add_limit_orders(
+        self, pair: str, amounts: List[Decimal], *, type="buy"
+    ) -> List[Optional[OrderResult]]:
+        results = []
+        for start in range(0, len(amounts), _MAX_ORDERS_PER_BATCH):
+            chunk = amounts[start : start + _MAX_ORDERS_PER_BATCH]
+            if len(chunk) < _MIN_ORDERS_PER_BATCH:
+                results.extend(
+                    self.add_limit_order(pair, amount, type=type) for amount in chunk
+                )
+                continue
+
+            batch_results = self._add_order_batch(pair, chunk, type)
+            if batch_results is None:
+                logger.info(f"\t Batch rejected for {pair}, placing single orders")
+                batch_results = [
+                    self.add_limit_order(pair, amount, type=type) for amount in chunk
+                ]
+
+            results.extend(batch_results)
+
+        return results
+
+    def _add_order_batch(
+        self, pair: str, amounts: List[Decimal], type: str
+    ) -> Optional[List[Optional[OrderResult]]]:
+        orders = [self._limit_order(pair, amount, type) for amount in amounts]
+        valid_orders = [
+            (amount, order) for amount, order in zip(amounts, orders) if order
+        ]
+        if len(valid_orders) < _MIN_ORDERS_PER_BATCH:
+            return None
+
+        response = self._request(
+            self._ADD_ORDER_BATCH_PATH,
+            method="POST",
+            payload={"pair": pair, "orders": [order for _, order in valid_orders]},
+            json_body=True,
+        )
+        json_response = response.json()
+        error = json_response.get("error")
+        if len(error) > 0:
+            logger.error(f"\t {error}")
+            return None
+
+        order_results = iter(json_response.get("result", {}).get("orders", []))
+        results = []
+        for amount, order in zip(amounts, orders):
+            if order is None:
+                results.append(None)
+                continue
+
+            result = next(order_results, {})
+            if result.get("error"):
+                logger.error(f"\t {result['error']}")
+                results.append(
+                    OrderResult(pair=pair, amount=amount, error=result["error"])
+                )
+            else:
+                logger.info(
+                    f"\t Order created successfully for {pair} at {order['price']}"
+                )
+                results.append(
+                    OrderResult(
+                        pair=pair,
+                        amount=amount,
+                        txid=result.get("txid"),
+                        price=order["price"],
+                    )
+                )
+
+        return results
@@ -1,21 +1,72 @@
 from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 
 from lib.flow_processor import ClientAdapter
-from .kraken_client import KrakenClient
+from lib.money import Money, round_down
+from .kraken_client import KrakenClient, OrderResult
 from .order_flows import Order
 
 
 class KrakenClientAdapter(ClientAdapter):
-    def __init__(self, kraken: KrakenClient):
+    # Overlapping private calls can reach Kraken out of order, which it only
+    # accepts for API keys with a nonce window
+    max_concurrency = 1
+
+    def __init__(self, kraken: KrakenClient, *, batch_orders: bool = False):
         self.kraken = kraken
+        self.batch_orders = batch_orders
+        self._pending_orders: Dict[str, List[Tuple[str, Decimal]]] = {}
+
+    def handle_processed_flow(self, flow: Order, amount: Money) -> None:
+        if flow.source_currency == flow.pair:
+            return
+
+        amount = amount.to_decimal()
 
-    def handle_processed_flow(self, flow: Order, amount: Decimal) -> None:
-        if flow.source_currency != flow.pair:
-            self.kraken.add_limit_order(
-                pair=flow.pair,
-                amount=amount,
-                type="buy",
+        if self.batch_orders:
+            self._pending_orders.setdefault(flow.source_currency, []).append(
+                (flow.pair, amount)
             )
+            return
+
+        self.kraken.add_limit_order(
+            pair=flow.pair,
+            amount=amount,
+            type="buy",
+        )
+
+    def flush(self, source: str) -> List[Optional[OrderResult]]:
+        orders = self._pending_orders.pop(source, [])
+        if not self.batch_orders:
+            return self._place_orders(orders)
+
+        amounts_per_pair: Dict[str, List[Decimal]] = {}
+        for pair, amount in orders:
+            amounts_per_pair.setdefault(pair, []).append(amount)
+
+        results = []
+        single_orders = []
+        for pair, amounts in amounts_per_pair.items():
+            if len(amounts) > 1:
+                results.extend(self.kraken.add_limit_orders(pair, amounts, type="buy"))
+            else:
+                single_orders.append((pair, amounts[0]))
+
+        results.extend(self._place_orders(single_orders))
+        return results
+
+    def _place_orders(
+        self, orders: List[Tuple[str, Decimal]]
+    ) -> List[Optional[OrderResult]]:
+        return [
+            self.kraken.add_limit_order(pair=pair, amount=amount, type="buy")
+            for pair, amount in orders
+        ]
+
+    def prepare(self, source: str, flows: List[Order]) -> None:
+        self.kraken.prefetch(
+            flow.pair for flow in flows if flow.source_currency != flow.pair
+        )
 
-    def get_balance(self, source: str) -> Decimal:
-        return self.kraken.get_balance(source)
+    def get_balance(self, source: str) -> Money:
+        return round_down(self.kraken.get_balance(source), source)
@@ -15,10 +15,18 @@ class Order(Flow):
     def source(self):
         return self.source_currency
 
+    @property
+    def currency(self) -> str:
+        return self.source_currency
+
     @property
     def action_label(self):
         return self.type
 
+    @property
+    def target(self):
+        return self.pair
+
     @property
     def target_label(self):
         return self.pair
@@ -26,6 +34,11 @@ class Order(Flow):
 
 class OrderFlows(FireStore):
     COLLECTION = "crypto_order_flows"
+    SOURCE_FIELD = "source_currency"
+    TARGET_FIELD = "pair"
 
     def create_type(self, **kwargs) -> Order:
         return Order(**kwargs)
+
+    def currency(self, source: str) -> str:
+        return source
@@ -0,0 +1,654 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from decimal import Decimal
+from unittest.mock import MagicMock, Mock, call
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from requests import Response
+from requests.adapters import BaseAdapter
+
+from functions.kraken_crypto_automation.src.asset_pairs import (
+    AssetPair,
+    AssetPairCatalog,
+)
+from functions.kraken_crypto_automation.src.async_kraken_client import (
+    AsyncKrakenClient,
+)
+from functions.kraken_crypto_automation.src.kraken_client import (
+    KrakenClient,
+    NonceGenerator,
+)
+from functions.kraken_crypto_automation.src.kraken_client_adapter import (
+    KrakenClientAdapter,
+)
+from functions.kraken_crypto_automation.src.order_flows import Order, OrderFlows
+from lib.flow_processor import FlowProcessor
+from lib.metrics import MetricsRegistry
+from lib.money import Money
+from simulations import Schedule, backtest_pair, load_candles, plan_orders, sweep
+from stand_ins import KrakenStandIn, KrakenState, StandInConfig
+
+PRIVATE_KEY = "a3Jha2VuIHByaXZhdGUga2V5"
+
+
+class FakeTransport(BaseAdapter):
+    def __init__(self, responses):
+        super().__init__()
+        self.responses = responses
+        self.requests = []
+        self.bodies = []
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        self.requests.append((request.method, url.path, parse_qs(url.query)))
+        self.bodies.append(request.body)
+
+        response = Response()
+        response.status_code = 200
+        response.request = request
+        response._content = json.dumps(self.responses[url.path]).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+class TestKrakenClient:
+    def setup_method(self):
+        self.transport = FakeTransport(
+            {
+                "/0/private/Balance": {"error": [], "result": {"ZEUR": "100.50"}},
+                "/0/public/Ticker": {
+                    "error": [],
+                    "result": {"XXBTZEUR": {"c": ["50000.0", "0.1"]}},
+                },
+            }
+        )
+        self.registry = MetricsRegistry()
+        self.kraken = KrakenClient(
+            api_key="key",
+            private_key=PRIVATE_KEY,
+            base_url="http://localhost:8080",
+            transport=self.transport,
+            metrics_registry=self.registry,
+        )
+
+    def test_when_requesting_expect_injected_transport_used(self):
+        assert self.kraken.get_balance("ZEUR") == Decimal("100.50")
+        assert self.kraken.get_price("XBTEUR") == "50000.0"
+
+        assert self.transport.requests == [
+            ("POST", "/0/private/Balance", {}),
+            ("GET", "/0/public/Ticker", {"pair": ["XBTEUR"]}),
+        ]
+
+    def test_when_requesting_twice_expect_single_session(self):
+        session = self.kraken.session
+
+        self.kraken.get_price("XBTEUR")
+        self.kraken.get_price("XBTEUR")
+
+        assert self.kraken.session is session
+        assert session.get_adapter("http://localhost:8080/0/public") is self.transport
+
+    def test_when_requesting_expect_metrics_per_endpoint(self):
+        self.kraken.get_balance("ZEUR")
+        self.kraken.get_price("XBTEUR")
+        self.kraken.get_price("XBTEUR")
+
+        metrics = self.registry.dump()
+        requests = {
+            (x["labels"]["endpoint"], x["labels"]["status"]): x["value"]
+            for x in metrics["client_requests_total"]
+        }
+        assert requests == {("/Balance", "2xx"): 1, ("/Ticker", "2xx"): 2}
+        latency = {
+            x["labels"]["endpoint"]: x["count"]
+            for x in metrics["client_request_duration_seconds"]
+        }
+        assert latency == {"/Balance": 1, "/Ticker": 2}
+        received = {
+            x["labels"]["endpoint"]: x["value"]
+            for x in metrics["client_received_bytes_total"]
+        }
+        assert received["/Ticker"] == 2 * len(
+            json.dumps(self.transport.responses["/0/public/Ticker"])
+        )
+        assert metrics["client_sent_bytes_total"][0]["labels"]["endpoint"] == "/Balance"
+
+
+class TestMarketPrefetch:
+    def setup_method(self):
+        self.transport = FakeTransport(
+            {
+                "/0/private/Balance": {"error": [], "result": {"ZEUR": "100.00"}},
+                "/0/private/AddOrder": {"error": [], "result": {"txid": ["T1"]}},
+                "/0/public/AssetPairs": {
+                    "error": [],
+                    "result": {
+                        "XXBTZEUR": {"altname": "XBTEUR", "pair_decimals": 1},
+                        "DOTEUR": {"altname": "DOTEUR", "pair_decimals": 4},
+                    },
+                },
+                "/0/public/Ticker": {
+                    "error": [],
+                    "result": {
+                        "XXBTZEUR": {"c": ["50000.0", "0.1"]},
+                        "DOTEUR": {"c": ["5.0000", "10"]},
+                    },
+                },
+            }
+        )
+        self.kraken = KrakenClient(
+            api_key="key",
+            private_key=PRIVATE_KEY,
+            base_url="http://localhost:8080",
+            transport=self.transport,
+        )
+
+    def test_when_prefetching_expect_one_request_per_endpoint(self):
+        self.kraken.prefetch(["XBTEUR", "DOTEUR"])
+
+        assert self.kraken.market.prices == {"XBTEUR": "50000.0", "DOTEUR": "5.0000"}
+        assert self.kraken.market.pairs["XBTEUR"]["pair_decimals"] == 1
+        assert self.transport.requests == [
+            ("GET", "/0/public/AssetPairs", {"pair": ["DOTEUR,XBTEUR"]}),
+            ("GET", "/0/public/Ticker", {"pair": ["DOTEUR,XBTEUR"]}),
+        ]
+
+    def test_when_running_orders_expect_snapshot_used(self):
+        store = MagicMock()
+        store.get_flows = Mock(
+            return_value=[
+                Order(
+                    description=f"buy {pair}",
+                    value=Decimal("40.00"),
+                    strategy_type="fixed",
+                    source_currency="ZEUR",
+                    pair=pair,
+                )
+                for pair in ["XBTEUR", "DOTEUR"]
+            ]
+        )
+
+        FlowProcessor(KrakenClientAdapter(self.kraken), store=store).run()
+
+        paths = [path for _, path, _ in self.transport.requests]
+        assert paths == [
+            "/0/public/AssetPairs",
+            "/0/public/Ticker",
+            "/0/private/Balance",
+            "/0/private/AddOrder",
+            "/0/private/AddOrder",
+        ]
+
+
+class TestNonceGenerator:
+    def test_when_called_in_same_millisecond_expect_increasing_nonces(self):
+        nonce = NonceGenerator(clock=lambda: 1700000000.0)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            nonces = list(executor.map(lambda _: nonce(), range(1000)))
+
+        assert len(set(nonces)) == 1000
+        assert max(nonces) == 1700000000000 + 999
+
+    def test_when_clock_moves_forward_expect_clock_used(self):
+        now = [1.0]
+        nonce = NonceGenerator(clock=lambda: now[0])
+
+        first = nonce()
+        now[0] = 2.0
+
+        assert (first, nonce()) == (1000, 2000)
+
+
+class TestAsyncKrakenClient:
+    def test_when_getting_prices_expect_public_calls_overlap(self):
+        kraken = MagicMock()
+        threads = set()
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_price(pair):
+            threads.add(threading.get_ident())
+            barrier.wait()
+            return "1.0"
+
+        kraken.get_price = Mock(side_effect=get_price)
+        async_kraken = AsyncKrakenClient(kraken, max_concurrency=2)
+
+        async def get_prices():
+            return await asyncio.gather(
+                async_kraken.get_price("XBTEUR"), async_kraken.get_price("DOTEUR")
+            )
+
+        assert asyncio.run(get_prices()) == ["1.0", "1.0"]
+        assert len(threads) == 2
+
+
+class TestOrderBatch:
+    def setup_method(self):
+        self.responses = {
+            "/0/private/Balance": {"error": [], "result": {"ZEUR": "100.00"}},
+            "/0/private/AddOrder": {"error": [], "result": {"txid": ["SINGLE"]}},
+            "/0/private/AddOrderBatch": {
+                "error": [],
+                "result": {
+                    "orders": [
+                        {"txid": "BATCH-1"},
+                        {"error": "EOrder:Insufficient funds"},
+                    ]
+                },
+            },
+            "/0/public/AssetPairs": {
+                "error": [],
+                "result": {
+                    "XXBTZEUR": {"altname": "XBTEUR", "pair_decimals": 1},
+                    "DOTEUR": {"altname": "DOTEUR", "pair_decimals": 4},
+                },
+            },
+            "/0/public/Ticker": {
+                "error": [],
+                "result": {
+                    "XXBTZEUR": {"c": ["50000.0", "0.1"]},
+                    "DOTEUR": {"c": ["5.0000", "10"]},
+                },
+            },
+        }
+        self.transport = FakeTransport(self.responses)
+        self.kraken = KrakenClient(
+            api_key="key",
+            private_key=PRIVATE_KEY,
+            base_url="http://localhost:8080",
+            transport=self.transport,
+        )
+        self.kraken.prefetch(["XBTEUR", "DOTEUR"])
+        self.transport.requests.clear()
+        self.transport.bodies.clear()
+        self.adapter = KrakenClientAdapter(self.kraken, batch_orders=True)
+        for pair, value in [
+            ("XBTEUR", "10.00"),
+            ("DOTEUR", "5.00"),
+            ("XBTEUR", "20.00"),
+        ]:
+            self.adapter.handle_processed_flow(
+                Order(
+                    description=f"buy {pair}",
+                    value=Decimal(value),
+                    strategy_type="fixed",
+                    source_currency="ZEUR",
+                    pair=pair,
+                ),
+                Money.of(value, "ZEUR"),
+            )
+
+    def test_when_pair_has_several_orders_expect_single_batch(self):
+        results = self.adapter.flush("ZEUR")
+
+        paths = [path for _, path, _ in self.transport.requests]
+        assert paths == ["/0/private/AddOrderBatch", "/0/private/AddOrder"]
+        batch = json.loads(self.transport.bodies[0])
+        assert batch["pair"] == "XBTEUR"
+        assert [order["price"] for order in batch["orders"]] == ["51000.0"] * 2
+        assert [(result.txid, result.success) for result in results] == [
+            ("BATCH-1", True),
+            (None, False),
+            ("SINGLE", True),
+        ]
+
+    def test_when_batch_rejected_expect_single_orders(self):
+        self.responses["/0/private/AddOrderBatch"] = {
+            "error": ["EGeneral:Invalid arguments"]
+        }
+
+        results = self.adapter.flush("ZEUR")
+
+        paths = [path for _, path, _ in self.transport.requests]
+        assert paths == ["/0/private/AddOrderBatch"] + ["/0/private/AddOrder"] * 3
+        assert all(result.success for result in results)
+
+
+class TestAssetPairCatalog:
+    def setup_method(self):
+        self.now = 1000.0
+        self.fetch = Mock(
+            return_value={
+                "XXBTZEUR": {
+                    "altname": "XBTEUR",
+                    "pair_decimals": 1,
+                    "lot_decimals": 8,
+                    "ordermin": "0.0001",
+                    "costmin": "0.5",
+                    "status": "online",
+                }
+            }
+        )
+
+    def _catalog(self, path):
+        return AssetPairCatalog(self.fetch, path, ttl=60, clock=lambda: self.now)
+
+    def test_when_catalog_persisted_expect_loaded_without_fetch(self, tmp_path):
+        path = str(tmp_path / "asset_pairs.json")
+        self._catalog(path).refresh()
+        self.fetch.reset_mock()
+
+        pair = self._catalog(path).get("XBTEUR")
+
+        assert pair == AssetPair(
+            name="XXBTZEUR",
+            altname="XBTEUR",
+            pair_decimals=1,
+            lot_decimals=8,
+            ordermin=Decimal("0.0001"),
+            costmin=Decimal("0.5"),
+        )
+        self.fetch.assert_not_called()
+
+    def test_when_catalog_stale_expect_background_refresh(self, tmp_path):
+        catalog = self._catalog(str(tmp_path / "asset_pairs.json"))
+        catalog.refresh()
+        self.now += 61
+
+        assert catalog.get("XBTEUR") is not None
+        catalog.refresh_in_background().join()
+
+        assert self.fetch.call_count == 2
+        assert not catalog.is_stale
+
+    def test_when_refresh_fails_expect_no_refetch_until_retry_after(self):
+        self.fetch.side_effect = [Exception("EService:Unavailable"), {}]
+        catalog = AssetPairCatalog(
+            self.fetch, ttl=60, retry_after=30, clock=lambda: self.now
+        )
+
+        assert catalog.get("XBTEUR") is None
+        assert catalog.get("ETHEUR") is None
+        self.now += 31
+        catalog.get("XBTEUR")
+
+        assert self.fetch.call_count == 2
+        assert catalog.failed_at is None
+
+    def test_when_pair_not_in_catalog_expect_market_snapshot_used(self, tmp_path):
+        kraken = KrakenClient(
+            api_key="key",
+            private_key=PRIVATE_KEY,
+            catalog_path=str(tmp_path / "asset_pairs.json"),
+        )
+        kraken.catalog.fetch = Mock(side_effect=Exception("EService:Unavailable"))
+        kraken.market.pairs["XBTEUR"] = {
+            "name": "XXBTZEUR",
+            **self.fetch.return_value["XXBTZEUR"],
+        }
+
+        pairs = [kraken._asset_pair("XBTEUR") for _ in range(3)]
+
+        assert [pair.name for pair in pairs] == ["XXBTZEUR"] * 3
+        kraken.catalog.fetch.assert_called_once()
+
+    def test_when_volume_below_minimum_expect_validation_error(self):
+        pair = AssetPair.from_kraken("XXBTZEUR", self.fetch.return_value["XXBTZEUR"])
+
+        volume, price, error = pair.validate(Decimal("0.00001"), Decimal("51000.04"))
+
+        assert (volume, price) == (None, None)
+        assert error == "Volume 0.00001000 is below minimum 0.0001"
+
+    def test_when_order_valid_expect_rounded_to_pair_precision(self):
+        pair = AssetPair.from_kraken("XXBTZEUR", self.fetch.return_value["XXBTZEUR"])
+
+        volume, price, error = pair.validate(
+            Decimal("0.000196078431372549"), Decimal("51000.04")
+        )
+
+        assert (volume, price, error) == (
+            Decimal("0.00019607"),
+            Decimal("51000.0"),
+            None,
+        )
+
+
+class TestOrderFlows:
+    def test_when_loading_table_expect_amounts_in_source_currency(self):
+        client = MagicMock()
+        query = client.collection.return_value
+        query.order_by.return_value = query
+        query.stream = Mock(
+            return_value=[
+                Mock(
+                    to_dict=Mock(
+                        return_value=dict(
+                            description="buy XBTEUR",
+                            value="40.00",
+                            strategy_type="fixed",
+                            minimum="5",
+                            priority=1,
+                            source_currency="ZEUR",
+                            pair="XBTEUR",
+                            type="buy",
+                        )
+                    )
+                )
+            ]
+        )
+
+        [(source, [(_, [order])])] = OrderFlows(client).get_flow_table().grouped_flows()
+
+        assert source == "ZEUR"
+        assert order.pair == "XBTEUR"
+        assert order.type == "buy"
+        assert order.value == Money.of("40.00", "ZEUR")
+        assert order.minimum_amount == Money.of("5.00", "ZEUR")
+
+    def test_when_source_is_crypto_expect_amounts_not_rounded_to_cents(self):
+        kraken = MagicMock()
+        kraken.get_balance = Mock(return_value=Decimal("0.0149"))
+        store = MagicMock()
+        store.get_flows = Mock(
+            return_value=[
+                Order(
+                    description=f"buy {pair}",
+                    value=value,
+                    strategy_type=strategy_type,
+                    priority=priority,
+                    source_currency="XXBT",
+                    pair=pair,
+                )
+                for pair, value, strategy_type, priority in [
+                    ("ETHXBT", "0.005", "fixed", 1),
+                    ("DOTXBT", "50", "percentage", 2),
+                ]
+            ]
+        )
+
+        FlowProcessor(KrakenClientAdapter(kraken), store=store).run()
+
+        kraken.add_limit_order.assert_has_calls(
+            [
+                call(pair="ETHXBT", amount=Decimal("0.005"), type="buy"),
+                call(pair="DOTXBT", amount=Decimal("0.00495"), type="buy"),
+            ]
+        )
+
+
+class TestKrakenStandIn:
+    def _stand_in(self, config=None):
+        state = KrakenState(balances={"ZEUR": "100.0"})
+        state.add_pair("XXBTZEUR", "XBTEUR", "50000.0")
+        state.add_pair("XETHZEUR", "ETHEUR", "2500.00", pair_decimals=2)
+        return KrakenStandIn(config, state=state)
+
+    def _kraken(self, stand_in):
+        return KrakenClient(
+            api_key="key", private_key=PRIVATE_KEY, base_url=stand_in.base_url
+        )
+
+    def test_when_placing_orders_expect_orders_on_stand_in(self):
+        with self._stand_in() as stand_in:
+            kraken = self._kraken(stand_in)
+            kraken.prefetch(["XBTEUR", "ETHEUR"])
+
+            single = kraken.add_limit_order("XBTEUR", Decimal("51"))
+            batch = kraken.add_limit_orders("ETHEUR", [Decimal("10"), Decimal("20")])
+
+        assert single.success and single.price == "51000.0"
+        assert all(result.success for result in batch)
+        assert [order["pair"] for order in stand_in.state.orders] == [
+            "XBTEUR",
+            "ETHEUR",
+            "ETHEUR",
+        ]
+        assert stand_in.state.orders[0]["volume"] == "0.00100000"
+
+    def test_when_rate_limit_exceeded_expect_rejected(self):
+        config = StandInConfig(rate_limits={"POST": 2}, rate_limit_period=60)
+        with self._stand_in(config) as stand_in:
+            kraken = self._kraken(stand_in)
+            responses = [kraken._request("/Balance") for _ in range(3)]
+
+        assert [response.status_code for response in responses] == [200, 200, 429]
+        assert responses[2].json()["error"] == ["EAPI:Rate limit exceeded"]
+
+    def test_when_nonce_is_reused_expect_rejected(self):
+        with self._stand_in() as stand_in:
+            kraken = self._kraken(stand_in)
+            kraken.nonce = lambda: 1
+            first = kraken._request("/Balance").json()
+            second = kraken._request("/Balance").json()
+
+        assert first["error"] == []
+        assert second["error"] == ["EAPI:Invalid nonce"]
+
+    def test_when_orders_placed_concurrently_expect_nonces_in_order(self):
+        config = StandInConfig(jitter=0.02, seed=1)
+        with self._stand_in(config) as stand_in:
+            kraken = self._kraken(stand_in)
+            kraken.prefetch(["XBTEUR"])
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(
+                    executor.map(
+                        lambda _: kraken.add_limit_order("XBTEUR", Decimal("51")),
+                        range(8),
+                    )
+                )
+
+        assert [result.error for result in results] == [None] * 8
+        assert len(stand_in.state.orders) == 8
+
+
+class TestDcaBacktest:
+    # open, high, low, close of one minute candles
+    candles = [
+        (100, 101, 99, 100),
+        (100, 103, 100, 102),
+        (105, 106, 104, 105),
+        (104, 104, 101, 101),
+        (101, 102, 100, 101),
+    ]
+    asset_pair = AssetPair(
+        name="XXBTZEUR",
+        altname="XBTEUR",
+        pair_decimals=0,
+        lot_decimals=2,
+        ordermin=Decimal("0.05"),
+    )
+
+    def setup_method(self):
+        pytest.importorskip("numpy")
+
+    def _write_candles(self, path) -> str:
+        # Kraken's OHLCVT layout without a header
+        path.write_text(
+            "".join(
+                f"{60 * index},{open_},{high},{low},{close},1.0,1\n"
+                for index, (open_, high, low, close) in enumerate(self.candles)
+            )
+        )
+        return str(path)
+
+    def test_when_backtesting_expect_marketable_orders_taker_and_resting_orders_maker(
+        self, tmp_path
+    ):
+        candles = load_candles(self._write_candles(tmp_path / "XBTEUR_1.csv"))
+
+        result = backtest_pair(
+            candles, self.asset_pair, [Decimal("10.00")], Schedule(60), modifier=1.0
+        )
+
+        # The order of the second run rests at 102 while the market opens at
+        # 105 and only fills a candle later
+        # The first run has no last close yet
+        assert (result.orders, result.skipped, result.filled) == (4, 0, 4)
+        assert result.volume == pytest.approx(0.1 + 3 * 0.09)
+        taker_cost = 0.1 * 100 + 0.09 * 104 + 0.09 * 101
+        assert result.cost == pytest.approx(taker_cost + 0.09 * 102)
+        assert result.fees == pytest.approx(0.004 * taker_cost + 0.0025 * 0.09 * 102)
+        assert result.value == pytest.approx(0.37 * 101)
+
+        expired = backtest_pair(
+            candles,
+            self.asset_pair,
+            [Decimal("10.00")],
+            Schedule(60),
+            modifier=1.0,
+            expiry=60,
+        )
+        assert (expired.filled, expired.expired) == (3, 1)
+
+        skipped = backtest_pair(
+            candles, self.asset_pair, [Decimal("4.00")], Schedule(60), modifier=1.0
+        )
+        assert (skipped.skipped, skipped.filled, skipped.volume) == (4, 0, 0.0)
+
+    def test_when_sweeping_expect_orders_planned_by_the_order_flows(self, tmp_path):
+        documents = [
+            {
+                "description": "bitcoin",
+                "value": "10.00",
+                "strategy_type": "fixed",
+                "priority": 1,
+                "source_currency": "ZEUR",
+                "pair": "XBTEUR",
+            },
+            {
+                "description": "ether",
+                "value": "50",
+                "strategy_type": "percentage",
+                "priority": 2,
+                "source_currency": "ZEUR",
+                "pair": "ETHEUR",
+            },
+        ]
+        assert plan_orders(documents, {"ZEUR": Money(30_00, "ZEUR")}) == {
+            "XBTEUR": [Decimal("10.00")],
+            "ETHEUR": [Decimal("10.00")],
+        }
+
+        path = self._write_candles(tmp_path / "candles.csv")
+        arguments = (
+            documents,
+            # 30 per run of a two minute schedule
+            {"ZEUR": Decimal(30 * 720)},
+            {"XBTEUR": path, "ETHEUR": path},
+            {
+                "XBTEUR": self.asset_pair,
+                "ETHEUR": replace(self.asset_pair, altname="ETHEUR"),
+            },
+        )
+        options = {"modifiers": [1.0, 1.02], "schedules": [Schedule.parse("2m")]}
+
+        in_process = sweep(*arguments, workers=1, **options)
+        pooled = sweep(*arguments, workers=2, **options)
+
+        assert pooled == in_process
+        assert [(result.pair, result.modifier) for result in in_process] == [
+            ("XBTEUR", 1.0),
+            ("ETHEUR", 1.0),
+            ("XBTEUR", 1.02),
+            ("ETHEUR", 1.02),
+        ]
+        assert in_process[0].orders == 2
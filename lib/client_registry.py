@@ -0,0 +1,66 @@
+import logging
+import threading
+from dataclasses import dataclass
+from time import time
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _RegistryEntry:
+    client: Any
+    expires_at: Optional[float]
+
+
+class ClientRegistry:
+    # Module level instances survive between invocations of a warm Cloud
+    # Function instance, so connected clients can be reused until they expire.
+    def __init__(
+        self,
+        *,
+        refresh_margin: float = 5 * 60,
+        clock: Callable[[], float] = time,
+    ):
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._entries: Dict[Hashable, _RegistryEntry] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        key: Hashable,
+        factory: Callable[[], T],
+        *,
+        expires_at: Callable[[T], Optional[float]] = lambda _: None,
+    ) -> T:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_expiring(entry):
+                return entry.client
+
+            client = factory()
+            logger.info(f"Created new {type(client).__name__}")
+            self._entries[key] = _RegistryEntry(
+                client=client, expires_at=expires_at(client)
+            )
+            return client
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _is_expiring(self, entry: _RegistryEntry) -> bool:
+        if entry.expires_at is None:
+            return False
+
+        return entry.expires_at - self.clock() < self.refresh_margin
+
+
+clients = ClientRegistry()
@@ -1,24 +1,52 @@
 import logging
 from abc import abstractmethod
 from dataclasses import dataclass
+from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, Union
+
+from .money import DEFAULT_CURRENCY, Money
 
 
 @dataclass(kw_only=True)
 class Flow:
     description: str
-    value: Decimal
+    # A percentage for percentage flows, an amount of money for all others
+    value: Union[Money, Decimal]
     strategy_type: str
-    minimum_amount: Optional[Decimal] = None
-    maximum_amount: Optional[Decimal] = None
+    minimum_amount: Optional[Money] = None
+    maximum_amount: Optional[Money] = None
     priority: Optional[int] = 1
+    enabled: bool = True
+    due_date: Optional[datetime] = None
+
+    def __post_init__(self):
+        if self.strategy_type == "percentage":
+            if not isinstance(self.value, Decimal):
+                self.value = Decimal(str(self.value))
+        else:
+            self.value = Money.of(self.value, self.currency)
+
+        if self.minimum_amount is not None:
+            self.minimum_amount = Money.of(self.minimum_amount, self.currency)
+
+        if self.maximum_amount is not None:
+            self.maximum_amount = Money.of(self.maximum_amount, self.currency)
+
+    @property
+    def currency(self) -> str:
+        return DEFAULT_CURRENCY
 
     @property
     @abstractmethod
     def source(self):
         ...
 
+    @property
+    @abstractmethod
+    def target(self):
+        ...
+
     @property
     @abstractmethod
     def target_label(self):
@@ -30,21 +58,17 @@ class Flow:
         ...
 
 
-def _check_minimum_amount(
-    amount: Decimal, *, minimum_amount: Optional[Decimal]
-) -> Decimal:
+def _check_minimum_amount(amount: Money, *, minimum_amount: Optional[Money]) -> Money:
     if amount > (minimum_amount if minimum_amount else 0):
         return amount
     else:
         logging.info(
             f"\t Amount {amount} is less than minimum amount {minimum_amount}. Skipping."
         )
-        return Decimal(0)
+        return Money(0, amount.currency)
 
 
-def _check_maximum_amount(
-    amount: Decimal, *, maximum_amount: Optional[Decimal]
-) -> Decimal:
+def _check_maximum_amount(amount: Money, *, maximum_amount: Optional[Money]) -> Money:
     if maximum_amount is not None and amount > maximum_amount:
         logging.info(
             f"\t Amount {amount} exceeds maximum amount {maximum_amount}. Using maximum amount."
@@ -54,7 +78,7 @@ def _check_maximum_amount(
         return amount
 
 
-def _check_remainder(amount: Decimal, *, remainder: Decimal) -> Decimal:
+def _check_remainder(amount: Money, *, remainder: Money) -> Money:
     if amount < remainder:
         return amount
     else:
@@ -64,7 +88,7 @@ def _check_remainder(amount: Decimal, *, remainder: Decimal) -> Decimal:
         return remainder
 
 
-def fixed_strategy(flow: Flow, remainder: Decimal) -> Decimal:
+def fixed_strategy(flow: Flow, remainder: Money) -> Money:
     logging.info(
         f"Attempting to {flow.action_label} {flow.value} to {flow.description}."
     )
@@ -78,11 +102,11 @@ def fixed_strategy(flow: Flow, remainder: Decimal) -> Decimal:
     return amount
 
 
-def percentage_strategy(flow: Flow, remainder: Decimal) -> Decimal:
+def percentage_strategy(flow: Flow, remainder: Money) -> Money:
     logging.info(
         f"Attempting to {flow.action_label} {flow.value}% to {flow.description}."
     )
-    amount = round(remainder * (flow.value / 100), 2)
+    amount = remainder.percentage(flow.value)
     amount = _check_minimum_amount(amount, minimum_amount=flow.minimum_amount)
     amount = _check_maximum_amount(amount, maximum_amount=flow.maximum_amount)
     if amount > 0:
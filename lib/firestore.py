@@ -1,14 +1,21 @@
 from abc import abstractmethod
-from decimal import Decimal
-from typing import Optional, Union, TypeVar, List
+from datetime import datetime
+from typing import Optional, TypeVar, Iterator
 
-from google.cloud.firestore import Client
+from google.cloud.firestore import Client, FieldFilter
+
+from .flow_table import FlowTable
+from .money import DEFAULT_CURRENCY
 
 T = TypeVar("T")
 
 
 class FireStore:
     COLLECTION: str
+    SOURCE_FIELD: str
+    TARGET_FIELD: str
+    ENABLED_FIELD = "enabled"
+    DUE_DATE_FIELD = "due_date"
 
     def __init__(self, client: Client):
         self.client = client
@@ -17,26 +24,87 @@ class FireStore:
     def create_type(self, **kwargs) -> T:
         ...
 
-    def get_flows(self) -> List[T]:
-        data = self.client.collection(self.COLLECTION).stream()
+    def currency(self, source: str) -> str:
+        # The currency the amounts of the flows of a source are in
+        return DEFAULT_CURRENCY
 
-        def transform_data(doc) -> T:
-            kwargs: dict = doc.to_dict()
-            value = kwargs.pop("value")
+    def _query(
+        self,
+        *,
+        enabled: Optional[bool] = None,
+        source: Optional[str] = None,
+        due_before: Optional[datetime] = None,
+        ordered: bool = True,
+    ):
+        # Every combination used here is backed by a composite index in
+        # firestore.indexes.json. Documents missing a filtered or ordered field
+        # are not returned by Firestore, so only the source is ordered on the
+        # server. The flows of a source are sorted by priority when processed.
+        query = self.client.collection(self.COLLECTION)
+        if enabled is not None:
+            query = query.where(filter=FieldFilter(self.ENABLED_FIELD, "==", enabled))
+
+        if source is not None:
+            query = query.where(filter=FieldFilter(self.SOURCE_FIELD, "==", source))
+
+        if due_before is not None:
+            query = query.where(
+                filter=FieldFilter(self.DUE_DATE_FIELD, "<=", due_before)
+            )
+
+        if ordered:
+            query = query.order_by(self.SOURCE_FIELD)
 
-            minimum_amount: Optional[Union[str, Decimal]] = kwargs.pop("minimum", None)
-            maximum_amount: Optional[Union[str, Decimal]] = kwargs.pop("maximum", None)
-            if minimum_amount is not None:
-                minimum_amount = Decimal(minimum_amount)
+        return query
 
-            if maximum_amount is not None:
-                maximum_amount = Decimal(maximum_amount)
+    def get_flows(
+        self,
+        *,
+        enabled: Optional[bool] = None,
+        source: Optional[str] = None,
+        due_before: Optional[datetime] = None,
+        ordered: bool = True,
+    ) -> Iterator[T]:
+        data = self._query(
+            enabled=enabled, source=source, due_before=due_before, ordered=ordered
+        ).stream()
 
+        def transform_data(doc) -> T:
+            # Flow turns the stored strings and numbers into Money itself
+            kwargs: dict = doc.to_dict()
+            minimum_amount = kwargs.pop("minimum", None)
+            maximum_amount = kwargs.pop("maximum", None)
             return self.create_type(
+                **kwargs, minimum_amount=minimum_amount, maximum_amount=maximum_amount
+            )
+
+        return map(transform_data, data)
+
+    def get_flow_table(
+        self,
+        *,
+        enabled: Optional[bool] = None,
+        source: Optional[str] = None,
+        due_before: Optional[datetime] = None,
+        ordered: bool = True,
+    ) -> FlowTable:
+        table = FlowTable(
+            self.create_type,
+            source_field=self.SOURCE_FIELD,
+            target_field=self.TARGET_FIELD,
+            currency=self.currency,
+        )
+        data = self._query(
+            enabled=enabled, source=source, due_before=due_before, ordered=ordered
+        ).stream()
+        for doc in data:
+            kwargs: dict = doc.to_dict()
+            table.append(
+                source=kwargs.pop(self.SOURCE_FIELD),
+                target=kwargs.pop(self.TARGET_FIELD),
+                minimum_amount=kwargs.pop("minimum", None),
+                maximum_amount=kwargs.pop("maximum", None),
                 **kwargs,
-                value=Decimal(value),
-                minimum_amount=minimum_amount,
-                maximum_amount=maximum_amount,
             )
 
-        return list(map(transform_data, data))
+        return table
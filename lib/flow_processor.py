@@ -1,28 +1,181 @@
+import contextvars
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from copy import copy
+from dataclasses import dataclass
 from decimal import Decimal
 from itertools import groupby
-from typing import Optional, Protocol, Dict, Callable
+from typing import (
+    Any,
+    Deque,
+    Optional,
+    Protocol,
+    Dict,
+    Callable,
+    List,
+    Tuple,
+    Iterable,
+    Iterator,
+    Mapping,
+    TypeVar,
+)
 
 from .common_strategies import Flow, default_strategies
 from .firestore import FireStore
+from .flow_table import PriorityGroup
+from .money import Money
+from .tracing import Tracer, null_tracer
+
+T = TypeVar("T")
 
 
 class ClientAdapter(Protocol):
+    # Upper bound on the number of sources the provider can safely handle at once
+    max_concurrency: int = 1
+
     @property
-    def strategies(self) -> Dict[str, Callable[[Flow, Decimal], Decimal]]:
+    def strategies(self) -> Dict[str, Callable[[Flow, Money], Money]]:
+        ...
+
+    def strategies_for(
+        self, balances: "PlannedBalances"
+    ) -> Dict[str, Callable[[Flow, Money], Money]]:
+        # The strategies plan() evaluates with. Strategies that read balances
+        # from the provider read them from the plan instead.
+        return self.strategies
+
+    def handle_processed_flow(self, flow: Flow, amount: Money) -> None:
+        ...
+
+    def prepare(self, source: str, flows: List[Flow]) -> None:
         ...
 
-    def handle_processed_flow(self, flow: Flow, amount: Decimal) -> None:
+    def get_balance(self, source: str) -> Money:
         ...
 
-    def get_balance(self, source: str) -> Decimal:
+    def flush(self, source: str) -> Any:
         ...
 
 
+class _BufferingFilter(logging.Filter):
+    def __init__(self, handler: logging.Handler, local: threading.local):
+        super().__init__()
+        self.handler = handler
+        self.local = local
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        records = getattr(self.local, "records", None)
+        if records is None:
+            return True
+
+        records.append((self.handler, record))
+        return False
+
+
+# Holds back the log records emitted by worker threads, so they can be replayed
+# source by source once that source has been processed.
+class _SourceLogBuffer:
+    def __init__(self):
+        self._local = threading.local()
+        self._filters: List[_BufferingFilter] = []
+
+    def __enter__(self):
+        for handler in logging.getLogger().handlers:
+            filter_ = _BufferingFilter(handler, self._local)
+            handler.addFilter(filter_)
+            self._filters.append(filter_)
+
+        return self
+
+    def __exit__(self, *_):
+        for filter_ in self._filters:
+            filter_.handler.removeFilter(filter_)
+
+        self._filters.clear()
+
+    @contextmanager
+    def capture(self):
+        records = []
+        self._local.records = records
+        try:
+            yield records
+        finally:
+            del self._local.records
+
+    @staticmethod
+    def replay(records):
+        for handler, record in records:
+            handler.handle(record)
+
+
+@dataclass(frozen=True)
+class PlannedFlow:
+    source: str
+    target: str
+    amount: Money
+    flow: Flow
+
+
+@dataclass(frozen=True)
+class ExecutionPlan:
+    entries: Tuple[PlannedFlow, ...] = ()
+
+    def __iter__(self) -> Iterator[PlannedFlow]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def total(self) -> Money:
+        # All entries of a plan are expected to share one currency
+        if not self.entries:
+            return Money(0)
+
+        return sum((entry.amount for entry in self.entries[1:]), self.entries[0].amount)
+
+    def by_source(self) -> List[Tuple[str, Tuple[PlannedFlow, ...]]]:
+        return [
+            (source, tuple(group))
+            for source, group in groupby(self.entries, key=lambda x: x.source)
+        ]
+
+
+class PlannedBalances:
+    # The balances plan() runs against: the given snapshot with every amount
+    # planned so far moved from its source to its target, like the payments of
+    # a run would. Accounts missing from the snapshot have no known balance.
+    def __init__(self, balances: Mapping[str, Money]):
+        self.balances: Dict[str, Money] = dict(balances)
+
+    def get_balance(self, source: str) -> Money:
+        return self.balances[source]
+
+    def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
+        balance = self.balances.get(iban)
+        return None if balance is None else balance.to_decimal()
+
+    def apply(self, entry: PlannedFlow):
+        if entry.source in self.balances:
+            self.balances[entry.source] -= entry.amount
+        if entry.target in self.balances:
+            self.balances[entry.target] += entry.amount
+
+
 class FlowProcessor:
     def __init__(
         self,
         client_adapter: ClientAdapter,
         store: FireStore,
+        *,
+        max_workers: Optional[int] = None,
+        flow_filters: Optional[Dict[str, Any]] = None,
+        tracer: Tracer = null_tracer,
+        flow_table: bool = False,
+        vectorized: bool = False,
     ):
         self.client_adapter = client_adapter
         self.store = store
@@ -30,40 +183,332 @@ class FlowProcessor:
             **default_strategies,
             **(client_adapter.strategies if client_adapter.strategies else {}),
         }
+        self.max_workers = max_workers
+        self.flow_filters = flow_filters or {}
+        self.tracer = tracer
+        # Loads the flows as a FlowTable, which is grouped by source and
+        # priority up front instead of per run
+        self.flow_table = flow_table
+        # Evaluates the fixed and percentage flows of a priority group at once
+        # with NumPy, unless the adapter brings its own strategy for them
+        self.engine = None
+        self.vectorized_types = frozenset()
+        if vectorized:
+            from .vectorized_strategies import VectorizedEngine
+
+            self.engine = VectorizedEngine()
+            self.vectorized_types = frozenset(
+                strategy_type
+                for strategy_type in self.engine.strategy_types
+                if self.strategies.get(strategy_type)
+                is default_strategies[strategy_type]
+            )
+
+    @property
+    def concurrency(self) -> int:
+        if not self.max_workers:
+            return 1
+
+        provider_limit = getattr(self.client_adapter, "max_concurrency", 1) or 1
+        return max(1, min(self.max_workers, provider_limit))
 
     def run(self):
-        flows_all = self.store.get_flows()
-        flows_by_source = groupby(flows_all, key=lambda x: x.source)
-
-        for source, group in flows_by_source:
-            remainder = self.client_adapter.get_balance(source=source)
-            flows_per_source = list(group)
-            flows_per_source.sort(key=lambda x: x.priority)
-            grouped_flows = groupby(flows_per_source, key=lambda x: x.priority)
-
-            for _, group_ in grouped_flows:
-                flows = list(group_)
-                for flow in filter(lambda a: a.strategy_type != "percentage", flows):
-                    remainder = self._process_flow(flow, remainder)
-
-                original_remainder = remainder
-                for flow in filter(lambda a: a.strategy_type == "percentage", flows):
-                    remainder = self._process_flow(
-                        flow,
-                        remainder,
-                        original_remainder=original_remainder,
-                    )
+        with self.tracer.span("run"):
+            if self.flow_table:
+                table = self.store.get_flow_table(**self.flow_filters)
+                self._for_each_source(
+                    table.grouped_flows(enabled=True),
+                    self._run_groups,
+                    lambda groups: (
+                        flow.target for _, flows in groups for flow in flows
+                    ),
+                )
+                return
 
-    def _process_flow(
+            flows_all = self.store.get_flows(**self.flow_filters)
+            flows_enabled = filter(lambda x: x.enabled, flows_all)
+            flows_by_source = (
+                (source, list(group))
+                for source, group in groupby(flows_enabled, key=lambda x: x.source)
+            )
+
+            self._for_each_source(
+                flows_by_source,
+                self._run_source,
+                lambda flows: (flow.target for flow in flows),
+            )
+
+    def plan(
+        self, flows: Iterable[Flow], balances: Mapping[str, Money]
+    ) -> ExecutionPlan:
+        # Evaluated on a copy that reads balances from the plan, so planning
+        # never calls the provider and sees its own transfers
+        planned = PlannedBalances(balances)
+        planner = copy(self)
+        planner.strategies = {
+            **default_strategies,
+            **(self.client_adapter.strategies_for(planned) or {}),
+        }
+
+        entries = []
+
+        def handle(entry: PlannedFlow):
+            entries.append(entry)
+            planned.apply(entry)
+
+        for source, group in groupby(flows, key=lambda x: x.source):
+            planner._plan_source(list(group), planned.get_balance(source), handle)
+
+        return ExecutionPlan(entries=tuple(entries))
+
+    def execute(self, plan: ExecutionPlan):
+        with self.tracer.span("execute", flows=len(plan)):
+            self._for_each_source(
+                plan.by_source(),
+                self._execute_source,
+                lambda entries: (entry.target for entry in entries),
+            )
+
+    def _run_source(self, source: str, flows: List[Flow]):
+        self._run_groups(source, self._priority_groups(flows))
+
+    def _run_groups(self, source: str, groups: List[PriorityGroup]):
+        flows = [flow for _, group in groups for flow in group]
+        with self.tracer.span("source", source=source, flows=len(flows)):
+            self._call_adapter("prepare", source, flows)
+            remainder = self._call_adapter("get_balance", source=source)
+            self._plan_groups(groups, remainder, self._handle_entry)
+            self._call_adapter("flush", source)
+
+    def _execute_source(self, source: str, entries: Iterable[PlannedFlow]):
+        with self.tracer.span("source", source=source):
+            for entry in entries:
+                self._handle_entry(entry)
+
+            self._call_adapter("flush", source)
+
+    def _handle_entry(self, entry: PlannedFlow):
+        self._call_adapter(
+            "handle_processed_flow", amount=entry.amount, flow=entry.flow
+        )
+
+    def _call_adapter(self, method: str, *args, **kwargs):
+        with self.tracer.span("adapter", method=method):
+            return getattr(self.client_adapter, method)(*args, **kwargs)
+
+    def _for_each_source(
         self,
-        flow: Flow,
-        remainder: Decimal,
-        *,
-        original_remainder: Optional[Decimal] = None,
+        items: Iterable[Tuple[str, T]],
+        handle: Callable[[str, T], None],
+        targets: Callable[[T], Iterable[str]],
+    ):
+        if self.concurrency == 1:
+            for source, item in items:
+                handle(source, item)
+            return
+
+        with _SourceLogBuffer() as log_buffer, ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+
+            def process(source: str, item: T, previous: List[Future]):
+                for future in previous:
+                    future.result()
+
+                with log_buffer.capture() as records:
+                    handle(source, item)
+
+                return records
+
+            # Groups are submitted while the input is still being consumed, the
+            # number of groups in flight is bounded to keep memory flat.
+            max_pending = 2 * self.concurrency
+            pending: Deque[Future] = deque()
+            # Groups that touch the same account, as source or as target, see
+            # each other's payments in balances and top ups. They run in the
+            # order of the input, like they would serially. A source can also
+            # show up in more than one group when the store does not return
+            # the flows ordered by source.
+            last_per_account: Dict[str, Future] = {}
+            for source, item in items:
+                if len(pending) >= max_pending:
+                    log_buffer.replay(pending.popleft().result())
+
+                accounts = {source, *targets(item)}
+                previous = {
+                    last_per_account[account]
+                    for account in accounts
+                    if account in last_per_account
+                }
+
+                # Worker threads run in a copy of the current context, so their
+                # spans end up below the span of the run.
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    process,
+                    source,
+                    item,
+                    list(previous),
+                )
+                for account in accounts:
+                    last_per_account[account] = future
+                pending.append(future)
+
+            while pending:
+                log_buffer.replay(pending.popleft().result())
+
+    def _plan_source(
+        self,
+        flows_per_source: List[Flow],
+        remainder: Money,
+        handle: Callable[[PlannedFlow], None],
+    ):
+        self._plan_groups(self._priority_groups(flows_per_source), remainder, handle)
+
+    @staticmethod
+    def _priority_groups(flows: List[Flow]) -> List[PriorityGroup]:
+        flows = sorted(flows, key=lambda x: x.priority)
+        return [
+            (priority, list(group))
+            for priority, group in groupby(flows, key=lambda x: x.priority)
+        ]
+
+    def _plan_groups(
+        self,
+        groups: Iterable[PriorityGroup],
+        remainder: Money,
+        handle: Callable[[PlannedFlow], None],
     ):
+        # Entries are handed to handle as soon as they are evaluated, so a
+        # handler that executes them right away has its side effects visible
+        # to later flows.
+        for priority, flows in groups:
+            with self.tracer.span("priority_group", priority=priority):
+                if self.engine is not None:
+                    remainder = self._plan_group_vectorized(flows, remainder, handle)
+                    continue
+
+                remainder = self._plan_in_order(
+                    [flow for flow in flows if flow.strategy_type != "percentage"],
+                    remainder,
+                    handle,
+                )
+                remainder = self._plan_shares(
+                    [flow for flow in flows if flow.strategy_type == "percentage"],
+                    remainder,
+                    handle,
+                )
+
+    def _plan_in_order(
+        self, flows: List[Flow], remainder: Money, handle: Callable[[PlannedFlow], None]
+    ) -> Money:
+        for flow in flows:
+            remainder -= self._process_flow(flow, remainder, handle)
+
+        return remainder
+
+    def _plan_shares(
+        self, flows: List[Flow], remainder: Money, handle: Callable[[PlannedFlow], None]
+    ) -> Money:
+        # Percentages are taken from what was left before the first of them
+        original_remainder = remainder
+        for flow in flows:
+            remainder -= self._process_flow(
+                flow, original_remainder if original_remainder else remainder, handle
+            )
+
+        return remainder
+
+    def _plan_group_vectorized(
+        self, flows: List[Flow], remainder: Money, handle: Callable[[PlannedFlow], None]
+    ) -> Money:
+        # Keeps the order of the scalar path: runs of consecutive fixed flows
+        # are evaluated at once in between the flows of other strategies
+        run: List[Flow] = []
+        for flow in flows:
+            if flow.strategy_type == "percentage":
+                continue
+
+            if flow.strategy_type in self.vectorized_types:
+                run.append(flow)
+                continue
+
+            remainder = self._plan_run(run, remainder, handle)
+            run = []
+            remainder -= self._process_flow(flow, remainder, handle)
+
+        remainder = self._plan_run(run, remainder, handle)
+
+        percentages = [flow for flow in flows if flow.strategy_type == "percentage"]
+        if not percentages:
+            return remainder
+
+        amounts = None
+        if "percentage" in self.vectorized_types:
+            with self.tracer.span(
+                "vectorized", strategy="percentage", flows=len(percentages)
+            ):
+                amounts = self.engine.percentage_amounts(percentages, remainder)
+
+        if amounts is None:
+            return self._plan_shares(percentages, remainder, handle)
+
+        return self._handle_amounts(percentages, amounts, remainder, handle)
+
+    def _plan_run(
+        self, flows: List[Flow], remainder: Money, handle: Callable[[PlannedFlow], None]
+    ) -> Money:
+        if not flows:
+            return remainder
+
+        with self.tracer.span("vectorized", strategy="fixed", flows=len(flows)):
+            amounts = self.engine.fixed_amounts(flows, remainder)
+
+        if amounts is None:
+            return self._plan_in_order(flows, remainder, handle)
+
+        return self._handle_amounts(flows, amounts, remainder, handle)
+
+    def _handle_amounts(
+        self,
+        flows: List[Flow],
+        amounts,
+        remainder: Money,
+        handle: Callable[[PlannedFlow], None],
+    ) -> Money:
+        total = 0
+        for flow, units in zip(flows, amounts.tolist()):
+            total += units
+            if units > 0:
+                amount = Money(units, remainder.currency)
+                logging.info(
+                    f"\t Need to {flow.action_label} {amount} to {flow.target_label}."
+                )
+                handle(self._planned_flow(flow, amount))
+
+        return remainder - Money(total, remainder.currency)
+
+    def _process_flow(
+        self, flow: Flow, remainder: Money, handle: Callable[[PlannedFlow], None]
+    ) -> Money:
+        with self.tracer.span(
+            "flow", strategy=flow.strategy_type, target=flow.target
+        ) as span:
+            with self.tracer.span("strategy", strategy=flow.strategy_type):
+                amount = self._evaluate_flow(flow, remainder)
+
+            span.set("amount", amount)
+            if amount > 0:
+                handle(self._planned_flow(flow, amount))
+
+        return amount
+
+    def _evaluate_flow(self, flow: Flow, remainder: Money) -> Money:
         strategy = self.strategies.get(flow.strategy_type)
-        amount = strategy(flow, original_remainder if original_remainder else remainder)
-        if amount > 0:
-            self.client_adapter.handle_processed_flow(amount=amount, flow=flow)
+        return strategy(flow, remainder)
 
-        return remainder - amount
+    @staticmethod
+    def _planned_flow(flow: Flow, amount: Money) -> PlannedFlow:
+        return PlannedFlow(
+            source=flow.source, target=flow.target, amount=amount, flow=flow
+        )
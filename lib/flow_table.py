@@ -0,0 +1,212 @@
+from array import array
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .common_strategies import Flow
+from .money import DEFAULT_CURRENCY, Money
+
+# Percentages are stored as integers with this many decimal places
+PERCENT_DECIMALS = 6
+
+_PERCENT_SCALE = Decimal(10**PERCENT_DECIMALS)
+
+# Stands in for a missing minimum or maximum amount
+_MISSING = -(2**63)
+
+PriorityGroup = Tuple[int, List[Flow]]
+
+
+class _Interned:
+    # Maps repeated strings to small integer ids
+    __slots__ = ("values", "ids")
+
+    def __init__(self):
+        self.values: List[Any] = []
+        self.ids: Dict[Any, int] = {}
+
+    def id_of(self, value) -> int:
+        id_ = self.ids.get(value)
+        if id_ is None:
+            id_ = self.ids[value] = len(self.values)
+            self.values.append(value)
+
+        return id_
+
+
+class FlowTable:
+    # Flows stored column by column. Only the fields the processor groups and
+    # evaluates on get their own array, everything else is kept as one tuple
+    # per row. Rows become Flow instances again when they are processed.
+    def __init__(
+        self,
+        factory: Callable[..., Flow],
+        *,
+        source_field: str,
+        target_field: str,
+        currency: Callable[[str], str] = lambda _: DEFAULT_CURRENCY,
+    ):
+        self.factory = factory
+        self.source_field = source_field
+        self.target_field = target_field
+        self.currency = currency
+
+        self.source_ids = array("I")
+        self.target_ids = array("I")
+        self.strategy_codes = array("B")
+        self.priorities = array("q")
+        # Minor units, or percentages scaled by PERCENT_DECIMALS
+        self.values = array("q")
+        self.minimums = array("q")
+        self.maximums = array("q")
+        self.enabled = array("b")
+        self.layout_ids = array("I")
+        self.extras: List[tuple] = []
+        # Percentages with more decimals than the values column holds, by row.
+        # They are handed to the flow as they are, like the scalar path does.
+        self.exact_percentages: Dict[int, Decimal] = {}
+
+        self._sources = _Interned()
+        self._targets = _Interned()
+        self._strategy_types = _Interned()
+        self._layouts = _Interned()  # the field names of the extras of a row
+        self._currencies: List[str] = []
+
+        self._order: Optional[array] = None
+        self._group_starts = array("I")  # positions in _order
+        self._source_groups = array("I")  # indexes into _group_starts
+
+    def __len__(self) -> int:
+        return len(self.source_ids)
+
+    def append(
+        self,
+        *,
+        source: str,
+        target: str,
+        strategy_type: str,
+        value,
+        minimum_amount=None,
+        maximum_amount=None,
+        priority: Optional[int] = 1,
+        enabled: bool = True,
+        **extra,
+    ):
+        source_id = self._sources.id_of(source)
+        if source_id == len(self._currencies):
+            self._currencies.append(self.currency(source))
+
+        currency = self._currencies[source_id]
+        if strategy_type == "percentage":
+            percentage = Decimal(str(value))
+            scaled = percentage.scaleb(PERCENT_DECIMALS)
+            if scaled != scaled.to_integral_value():
+                self.exact_percentages[len(self)] = percentage
+            value = int(scaled)
+        else:
+            value = Money.of(value, currency).minor_units
+
+        self.source_ids.append(source_id)
+        self.target_ids.append(self._targets.id_of(target))
+        self.strategy_codes.append(self._strategy_types.id_of(strategy_type))
+        self.priorities.append(1 if priority is None else priority)
+        self.values.append(value)
+        self.minimums.append(self._minor_units(minimum_amount, currency))
+        self.maximums.append(self._minor_units(maximum_amount, currency))
+        self.enabled.append(enabled)
+        self.layout_ids.append(self._layouts.id_of(tuple(extra)))
+        self.extras.append(tuple(extra.values()))
+        self._order = None
+
+    @staticmethod
+    def _minor_units(amount, currency: str) -> int:
+        if amount is None:
+            return _MISSING
+
+        return Money.of(amount, currency).minor_units
+
+    def flow(self, row: int) -> Flow:
+        source_id = self.source_ids[row]
+        currency = self._currencies[source_id]
+        strategy_type = self._strategy_types.values[self.strategy_codes[row]]
+        minimum, maximum = self.minimums[row], self.maximums[row]
+
+        kwargs = dict(zip(self._layouts.values[self.layout_ids[row]], self.extras[row]))
+        kwargs[self.source_field] = self._sources.values[source_id]
+        kwargs[self.target_field] = self._targets.values[self.target_ids[row]]
+        kwargs["strategy_type"] = strategy_type
+        if row in self.exact_percentages:
+            kwargs["value"] = self.exact_percentages[row]
+        elif strategy_type == "percentage":
+            kwargs["value"] = Decimal(self.values[row]) / _PERCENT_SCALE
+        else:
+            kwargs["value"] = Money(self.values[row], currency)
+        kwargs["minimum_amount"] = (
+            None if minimum == _MISSING else Money(minimum, currency)
+        )
+        kwargs["maximum_amount"] = (
+            None if maximum == _MISSING else Money(maximum, currency)
+        )
+        kwargs["priority"] = self.priorities[row]
+        kwargs["enabled"] = self.enabled[row] == 1
+        return self.factory(**kwargs)
+
+    def _index(self):
+        # Orders the rows by source and priority once and records where every
+        # source and every priority group within it starts
+        sources, source_ids = self._sources.values, self.source_ids
+        keys = [
+            (sources[source_id], priority)
+            for source_id, priority in zip(source_ids, self.priorities)
+        ]
+        order = array("I", range(len(keys)))
+        if any(keys[i] > keys[i + 1] for i in range(len(keys) - 1)):
+            order = array("I", sorted(order, key=keys.__getitem__))
+
+        group_starts = array("I")
+        source_groups = array("I")
+        previous = None
+        for position, row in enumerate(order):
+            key = keys[row]
+            if key == previous:
+                continue
+
+            if previous is None or key[0] != previous[0]:
+                source_groups.append(len(group_starts))
+            group_starts.append(position)
+            previous = key
+
+        source_groups.append(len(group_starts))
+        group_starts.append(len(order))
+
+        self._order = order
+        self._group_starts = group_starts
+        self._source_groups = source_groups
+
+    def grouped_flows(
+        self, *, enabled: Optional[bool] = None
+    ) -> Iterator[Tuple[str, List[PriorityGroup]]]:
+        # Yields every source with its flows per priority, lowest first. Flows
+        # are only created for the source that is being yielded.
+        if self._order is None:
+            self._index()
+
+        order, group_starts, source_groups = (
+            self._order,
+            self._group_starts,
+            self._source_groups,
+        )
+        for index in range(len(source_groups) - 1):
+            groups = []
+            for group in range(source_groups[index], source_groups[index + 1]):
+                rows = order[group_starts[group] : group_starts[group + 1]]
+                flows = [
+                    self.flow(row)
+                    for row in rows
+                    if enabled is None or bool(self.enabled[row]) == enabled
+                ]
+                if flows:
+                    groups.append((self.priorities[rows[0]], flows))
+
+            if groups:
+                first_row = order[group_starts[source_groups[index]]]
+                yield self._sources.values[self.source_ids[first_row]], groups
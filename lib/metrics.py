@@ -0,0 +1,312 @@
+import bisect
+import threading
+from abc import abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Request latencies in seconds, from a pooled keep-alive call to a timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric:
+    type_: str
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, **extra: str) -> str:
+        pairs = list(zip(self.labelnames, values)) + list(extra.items())
+        if not pairs:
+            return ""
+
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter(_Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def dump(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in self._values.items()
+            ]
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [
+                f"{self.name}{self._format_labels(key)} {value}"
+                for key, value in self._values.items()
+            ]
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    type_ = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._label_values(labels)
+        # Values above the last bucket only end up in the implicit +Inf bucket
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets) + 1)
+
+            series.bucket_counts[index] += 1
+            series.sum += value
+            series.count += 1
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            series = self._series.get(self._label_values(labels))
+            return series.count if series else 0
+
+    def dump(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "count": series.count,
+                    "sum": series.sum,
+                    "buckets": dict(
+                        zip(
+                            [*map(str, self.buckets), "+Inf"],
+                            _cumulative(series.bucket_counts),
+                        )
+                    ),
+                }
+                for key, series in self._series.items()
+            ]
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in self._series.items():
+                bounds = [*map(str, self.buckets), "+Inf"]
+                for bound, count in zip(bounds, _cumulative(series.bucket_counts)):
+                    labels = self._format_labels(key, le=bound)
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+
+                labels = self._format_labels(key)
+                lines.append(f"{self.name}_sum{labels} {series.sum}")
+                lines.append(f"{self.name}_count{labels} {series.count}")
+
+        return lines
+
+
+def _cumulative(counts: List[int]) -> List[int]:
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+
+    return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get_or_create(
+            Histogram, name, documentation, labelnames, buckets=buckets
+        )
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(
+                    name, documentation, labelnames, **kwargs
+                )
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"{name} is already registered differently")
+
+            return metric
+
+    def dump(self) -> Dict[str, List[Dict]]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return {metric.name: metric.dump() for metric in metrics}
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        # Clients keep references to their metrics, so only the values go
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        for metric in metrics:
+            metric.reset()
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("UTF-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def status_label(status_code: Optional[int]) -> str:
+    # Rate limiting gets its own label, everything else is grouped per class
+    if status_code is None:
+        return "error"
+
+    if status_code == 429:
+        return "429"
+
+    return f"{status_code // 100}xx"
+
+
+class ClientMetrics:
+    # The metrics every HTTP client records, labelled with the client name
+    def __init__(self, client: str, registry: Optional[MetricsRegistry] = None):
+        registry = registry or default_registry
+        self.client = client
+        self.requests = registry.counter(
+            "client_requests_total",
+            "Requests per endpoint and response status",
+            ("client", "endpoint", "method", "status"),
+        )
+        self.latency = registry.histogram(
+            "client_request_duration_seconds",
+            "Request latency per endpoint",
+            ("client", "endpoint", "method"),
+        )
+        self.retries = registry.counter(
+            "client_retries_total",
+            "Retried requests per endpoint",
+            ("client", "endpoint"),
+        )
+        self.bytes_sent = registry.counter(
+            "client_sent_bytes_total", "Request body bytes", ("client", "endpoint")
+        )
+        self.bytes_received = registry.counter(
+            "client_received_bytes_total",
+            "Response body bytes",
+            ("client", "endpoint"),
+        )
+
+    def observe(
+        self,
+        endpoint: str,
+        method: str,
+        status_code: Optional[int],
+        duration: float,
+        *,
+        sent: int = 0,
+        received: int = 0,
+    ):
+        self.requests.inc(
+            client=self.client,
+            endpoint=endpoint,
+            method=method,
+            status=status_label(status_code),
+        )
+        self.latency.observe(
+            duration, client=self.client, endpoint=endpoint, method=method
+        )
+        if sent:
+            self.bytes_sent.inc(sent, client=self.client, endpoint=endpoint)
+        if received:
+            self.bytes_received.inc(received, client=self.client, endpoint=endpoint)
+
+    def retry(self, endpoint: str, count: int = 1):
+        if count:
+            self.retries.inc(count, client=self.client, endpoint=endpoint)
+
+
+default_registry = MetricsRegistry()
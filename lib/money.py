@@ -0,0 +1,237 @@
+from decimal import ROUND_DOWN, ROUND_HALF_EVEN, Decimal
+from typing import Dict, Tuple, Union
+
+DEFAULT_CURRENCY = "EUR"
+
+# Fiat currencies are kept in cents, also Kraken's Z-prefixed fiat assets.
+# Every other currency is a crypto asset, which Kraken keeps to 10 decimals.
+DECIMALS = 2
+CRYPTO_DECIMALS = 10
+_CURRENCY_DECIMALS = {
+    **{
+        currency: DECIMALS
+        for fiat in ("EUR", "USD", "GBP", "CHF", "CAD", "AUD")
+        for currency in (fiat, "Z" + fiat)
+    },
+    "JPY": 0,
+    "ZJPY": 0,
+}
+
+MoneyLike = Union["Money", Decimal, str, int, float]
+
+
+class Money:
+    # An immutable amount stored as an integer number of minor units, so it
+    # can never carry more decimal places than its currency has.
+    __slots__ = ("minor_units", "currency")
+
+    minor_units: int
+    currency: str
+
+    def __init__(self, minor_units: int, currency: str = DEFAULT_CURRENCY):
+        if minor_units.__class__ is not int:
+            raise TypeError(f"Minor units must be an int, got {minor_units!r}")
+
+        _set_minor_units(self, minor_units)
+        _set_currency(self, currency)
+
+    @classmethod
+    def of(
+        cls,
+        value: MoneyLike,
+        currency: str = DEFAULT_CURRENCY,
+        *,
+        rounding: str = ROUND_HALF_EVEN,
+    ) -> "Money":
+        if isinstance(value, Money):
+            if value.currency != currency:
+                raise ValueError(f"Expected {currency}, got {value.currency}")
+            return value
+
+        decimals, scale, quantum = _scale_of(currency)
+        if isinstance(value, int):
+            return _new(value * scale, currency)
+
+        if isinstance(value, float):
+            # The shortest repr is what was stored, not its binary expansion
+            value = repr(value)
+
+        units = Decimal(value).quantize(quantum, rounding=rounding).scaleb(decimals)
+        return _new(int(units), currency)
+
+    def to_decimal(self) -> Decimal:
+        return Decimal(self.minor_units).scaleb(-_scale_of(self.currency)[0])
+
+    def percentage(self, percent: Decimal) -> "Money":
+        # Exact: the percentage is applied as a fraction and only the result
+        # is rounded, half to even like Decimal's round()
+        numerator, denominator = percent.as_integer_ratio()
+        denominator *= 100
+        units, rest = divmod(self.minor_units * numerator, denominator)
+        if 2 * rest > denominator or (2 * rest == denominator and units % 2):
+            units += 1
+
+        return _new(units, self.currency)
+
+    def _units_of(self, other) -> int:
+        if other.__class__ is Money:
+            if other.currency != self.currency:
+                raise ValueError(
+                    f"Cannot combine {self.currency} with {other.currency}"
+                )
+            return other.minor_units
+
+        # A bare zero is a valid amount in every currency
+        if other.__class__ is int and other == 0:
+            return 0
+
+        return NotImplemented
+
+    # The operators below are on the hot path of every strategy, so the
+    # common case of two amounts in the same currency is handled inline
+
+    def __add__(self, other) -> "Money":
+        if other.__class__ is Money and other.currency == self.currency:
+            return _new(self.minor_units + other.minor_units, self.currency)
+
+        units = self._units_of(other)
+        if units is NotImplemented:
+            return NotImplemented
+
+        return _new(self.minor_units + units, self.currency)
+
+    __radd__ = __add__
+
+    def __sub__(self, other) -> "Money":
+        if other.__class__ is Money and other.currency == self.currency:
+            return _new(self.minor_units - other.minor_units, self.currency)
+
+        units = self._units_of(other)
+        if units is NotImplemented:
+            return NotImplemented
+
+        return _new(self.minor_units - units, self.currency)
+
+    def __neg__(self) -> "Money":
+        return _new(-self.minor_units, self.currency)
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not Money:
+            return NotImplemented
+
+        return self.minor_units == other.minor_units and self.currency == other.currency
+
+    def __lt__(self, other) -> bool:
+        if other.__class__ is Money and other.currency == self.currency:
+            return self.minor_units < other.minor_units
+
+        if other.__class__ is int and other == 0:
+            return self.minor_units < 0
+
+        units = self._units_of(other)
+        return units if units is NotImplemented else self.minor_units < units
+
+    def __le__(self, other) -> bool:
+        if other.__class__ is Money and other.currency == self.currency:
+            return self.minor_units <= other.minor_units
+
+        if other.__class__ is int and other == 0:
+            return self.minor_units <= 0
+
+        units = self._units_of(other)
+        return units if units is NotImplemented else self.minor_units <= units
+
+    def __gt__(self, other) -> bool:
+        if other.__class__ is Money and other.currency == self.currency:
+            return self.minor_units > other.minor_units
+
+        if other.__class__ is int and other == 0:
+            return self.minor_units > 0
+
+        units = self._units_of(other)
+        return units if units is NotImplemented else self.minor_units > units
+
+    def __ge__(self, other) -> bool:
+        if other.__class__ is Money and other.currency == self.currency:
+            return self.minor_units >= other.minor_units
+
+        if other.__class__ is int and other == 0:
+            return self.minor_units >= 0
+
+        units = self._units_of(other)
+        return units if units is NotImplemented else self.minor_units >= units
+
+    def __hash__(self) -> int:
+        return hash((self.minor_units, self.currency))
+
+    def __bool__(self) -> bool:
+        return self.minor_units != 0
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Money is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Money is immutable")
+
+    def __reduce__(self):
+        return Money, (self.minor_units, self.currency)
+
+    def __str__(self) -> str:
+        decimals, scale, _ = _scale_of(self.currency)
+        sign = "-" if self.minor_units < 0 else ""
+        units = abs(self.minor_units)
+        if not decimals:
+            return f"{sign}{units}"
+
+        return f"{sign}{units // scale}.{units % scale:0{decimals}d}"
+
+    def __format__(self, format_spec: str) -> str:
+        # Amounts end up in every log line of a strategy
+        if not format_spec:
+            return self.__str__()
+
+        return format(self.to_decimal(), format_spec)
+
+    def __repr__(self) -> str:
+        return f"Money('{self}', '{self.currency}')"
+
+
+# The slot descriptors set the fields without going through __setattr__
+_set_minor_units = Money.minor_units.__set__
+_set_currency = Money.currency.__set__
+
+
+_scales: Dict[str, Tuple[int, int, Decimal]] = {}
+
+
+def decimals_of(currency: str) -> int:
+    return _CURRENCY_DECIMALS.get(currency, CRYPTO_DECIMALS)
+
+
+def _scale_of(currency: str) -> Tuple[int, int, Decimal]:
+    # The number of decimals, the minor units per whole unit and the smallest
+    # amount of a currency
+    scale = _scales.get(currency)
+    if scale is None:
+        decimals = decimals_of(currency)
+        scale = _scales[currency] = (
+            decimals,
+            10**decimals,
+            Decimal(1).scaleb(-decimals),
+        )
+
+    return scale
+
+
+def _new(minor_units: int, currency: str) -> Money:
+    # Skips the type check of __init__ for units that are known to be an int
+    money = object.__new__(Money)
+    _set_minor_units(money, minor_units)
+    _set_currency(money, currency)
+    return money
+
+
+def round_down(value: MoneyLike, currency: str = DEFAULT_CURRENCY) -> Money:
+    # Balances are rounded towards zero, a flow never spends a fraction of a
+    # minor unit that is not there
+    return Money.of(value, currency, rounding=ROUND_DOWN)
@@ -0,0 +1,177 @@
+import itertools
+import json
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, asdict
+from time import perf_counter_ns, time_ns
+from typing import Any, Dict, Iterator, List, Optional, Protocol
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - optional dependency
+    otel_trace = None
+
+_span_ids = itertools.count(1)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    trace_id: int
+    start_time: int  # ns since epoch
+    duration: Optional[int] = None  # ns
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+
+class SpanSink(Protocol):
+    def on_start(self, span: Span) -> None:
+        ...
+
+    def on_end(self, span: Span) -> None:
+        ...
+
+
+class Tracer:
+    def __init__(self, sink: SpanSink):
+        self.sink = sink
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        parent = _current_span.get()
+        span_id = next(_span_ids)
+        span = Span(
+            name=name,
+            span_id=span_id,
+            parent_id=parent.span_id if parent else None,
+            trace_id=parent.trace_id if parent else span_id,
+            start_time=time_ns(),
+            attributes=attributes,
+        )
+        self.sink.on_start(span)
+
+        token = _current_span.set(span)
+        start = perf_counter_ns()
+        try:
+            yield span
+        except BaseException as e:
+            span.set("error", repr(e))
+            raise
+        finally:
+            span.duration = perf_counter_ns() - start
+            _current_span.reset(token)
+            self.sink.on_end(span)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def set(self, key: str, value: Any):
+        pass
+
+
+class NullTracer(Tracer):
+    # Hands out one shared span that records nothing, so an instrumented code
+    # path costs a method call per span when tracing is disabled.
+    _span = _NullSpan()
+
+    def __init__(self):
+        super().__init__(NullSink())
+
+    def span(self, name: str, **attributes) -> _NullSpan:
+        return self._span
+
+
+class NullSink(SpanSink):
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        pass
+
+
+class MemorySink(SpanSink):
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+
+class JsonLinesSink(SpanSink):
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span) -> None:
+        pass
+
+    def on_end(self, span: Span) -> None:
+        line = json.dumps(asdict(span), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetrySink(SpanSink):
+    # Forwards spans to an OpenTelemetry tracer, the exporter is whatever the
+    # OpenTelemetry SDK is configured with.
+    def __init__(self, tracer=None):
+        if otel_trace is None:
+            raise RuntimeError("OpenTelemetrySink requires opentelemetry-api")
+
+        self.tracer = tracer or otel_trace.get_tracer(__name__)
+        self._spans: Dict[int, Any] = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span) -> None:
+        with self._lock:
+            parent = self._spans.get(span.parent_id)
+
+        context = otel_trace.set_span_in_context(parent) if parent else None
+        otel_span = self.tracer.start_span(
+            span.name, context=context, start_time=span.start_time
+        )
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span: Span) -> None:
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+
+        if otel_span is None:
+            return
+
+        for key, value in span.attributes.items():
+            otel_span.set_attribute(key, _otel_value(value))
+
+        otel_span.end(end_time=span.start_time + span.duration)
+
+
+def _otel_value(value: Any):
+    if isinstance(value, (bool, int, float, str)):
+        return value
+
+    return str(value)
+
+
+null_tracer = NullTracer()
@@ -0,0 +1,168 @@
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from .common_strategies import Flow
+from .flow_table import PERCENT_DECIMALS
+from .money import Money
+
+_INT64_MAX = 2**63 - 1
+
+# Stands in for a missing maximum amount
+NO_MAXIMUM = _INT64_MAX
+
+# Percentages are applied as integers scaled by PERCENT_DECIMALS
+_PERCENT_DENOMINATOR = 100 * 10**PERCENT_DECIMALS
+
+# Every flow that gets less than its full value splits a run of fixed flows
+# in two. After this many splits the rest of the run is evaluated one by one.
+_MAX_SEGMENTS = 16
+
+
+def allocate_fixed(remainder: int, values, minimums, maximums):
+    # The amounts fixed_strategy gives a run of flows evaluated one after the
+    # other, each taking from what the previous ones left. All inputs are
+    # int64 arrays of minor units and must not be negative.
+    count = len(values)
+    amounts = np.zeros(count, dtype=np.int64)
+    # What a flow gets while the remainder is larger than its value
+    full = np.where(values > minimums, np.minimum(values, maximums), 0)
+
+    start = 0
+    segments = 0
+    while start < count and remainder > 0:
+        if segments == _MAX_SEGMENTS:
+            _allocate_fixed_one_by_one(
+                remainder, values, minimums, maximums, amounts, start
+            )
+            break
+
+        taken = np.cumsum(full[start:])
+        before = taken - full[start:]
+        short = np.flatnonzero(values[start:] >= remainder - before)
+        end = start + (int(short[0]) if len(short) else count - start)
+        amounts[start:end] = full[start:end]
+        if end > start:
+            remainder -= int(taken[end - start - 1])
+
+        if end == count:
+            break
+
+        # The flow that does not fit gets what is left
+        amount = remainder if remainder > minimums[end] else 0
+        amount = min(amount, int(maximums[end]))
+        amounts[end] = amount
+        remainder -= amount
+        start = end + 1
+        segments += 1
+
+    return amounts
+
+
+def _allocate_fixed_one_by_one(remainder, values, minimums, maximums, amounts, start):
+    for index in range(start, len(values)):
+        amount = int(values[index])
+        amount = amount if amount < remainder else remainder
+        amount = amount if amount > minimums[index] else 0
+        amount = min(amount, int(maximums[index]))
+        amounts[index] = amount
+        remainder -= amount
+
+
+def allocate_percentages(base: int, percents, minimums, maximums):
+    # The amounts percentage_strategy gives flows that all take their share of
+    # the same base, rounded half to even. Percents are scaled integers.
+    units, rest = np.divmod(base * percents, _PERCENT_DENOMINATOR)
+    units += (2 * rest > _PERCENT_DENOMINATOR) | (
+        (2 * rest == _PERCENT_DENOMINATOR) & (units % 2 == 1)
+    )
+    amounts = np.where(units > minimums, units, 0)
+    return np.minimum(amounts, maximums)
+
+
+class VectorizedEngine:
+    # Evaluates the fixed and percentage flows of a priority group with NumPy.
+    # Returns None whenever the result could differ from the scalar strategies,
+    # the caller evaluates those flows one by one instead.
+    strategy_types = ("fixed", "percentage")
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("VectorizedEngine requires numpy")
+
+    @staticmethod
+    def _limits(flows: List[Flow], currency: str) -> Optional[Tuple[list, list]]:
+        minimums, maximums = [], []
+        for flow in flows:
+            minimum, maximum = flow.minimum_amount, flow.maximum_amount
+            if minimum is None:
+                minimums.append(0)
+            elif minimum.currency != currency:
+                return None
+            else:
+                minimums.append(minimum.minor_units)
+
+            if maximum is None:
+                maximums.append(NO_MAXIMUM)
+            elif maximum.currency != currency:
+                return None
+            else:
+                maximums.append(maximum.minor_units)
+
+        return minimums, maximums
+
+    def fixed_amounts(self, flows: List[Flow], remainder: Money):
+        values = []
+        for flow in flows:
+            if flow.value.currency != remainder.currency:
+                return None
+            values.append(flow.value.minor_units)
+
+        limits = self._limits(flows, remainder.currency)
+        if limits is None:
+            return None
+
+        minimums, maximums = limits
+        if (
+            min(values) < 0
+            or min(minimums) < 0
+            or min(maximums) < 0
+            or abs(remainder.minor_units) > _INT64_MAX
+            or max(values) * len(values) > _INT64_MAX
+        ):
+            return None
+
+        return allocate_fixed(
+            remainder.minor_units,
+            np.array(values, dtype=np.int64),
+            np.array(minimums, dtype=np.int64),
+            np.array(maximums, dtype=np.int64),
+        )
+
+    def percentage_amounts(self, flows: List[Flow], base: Money):
+        percents = []
+        for flow in flows:
+            scaled = Decimal(flow.value).scaleb(PERCENT_DECIMALS)
+            if scaled != scaled.to_integral_value():
+                return None
+            percents.append(int(scaled))
+
+        limits = self._limits(flows, base.currency)
+        if limits is None:
+            return None
+
+        largest = max(abs(percent) for percent in percents)
+        if abs(base.minor_units) * largest > _INT64_MAX:
+            return None
+
+        minimums, maximums = limits
+        return allocate_percentages(
+            base.minor_units,
+            np.array(percents, dtype=np.int64),
+            np.array(minimums, dtype=np.int64),
+            np.array(maximums, dtype=np.int64),
+        )
@@ -0,0 +1,19 @@
+from .cashflow import (
+    Assumptions,
+    MonthlyAmount,
+    OneOffExpense,
+    SimulatedBank,
+    StaticFlows,
+    Trajectories,
+    simulate,
+)
+from .dca_backtest import (
+    BacktestResult,
+    Candles,
+    Schedule,
+    StaticOrderFlows,
+    backtest_pair,
+    load_candles,
+    plan_orders,
+    sweep,
+)
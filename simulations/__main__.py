@@ -0,0 +1,156 @@
+"""Runs a simulation and writes its results as CSV, for example:
+
+    python -m simulations cashflow config.json --months 36 --scenarios 5000
+    python -m simulations dca config.json --modifier 1.0 1.01 1.02 --schedule 1d 1w
+
+A cashflow config is a JSON object with the opening "balances" per IBAN and
+lists of monthly "income" and "spending" ({"account", "mean", "stddev"}) and
+"one_offs" ({"account", "probability", "minimum", "maximum"}).
+
+A dca config holds the "budgets" per source currency and day, the "candles"
+file and Kraken's asset pair information ("pairs") per pair.
+
+The flows are read from the "flows" list of documents in the config, or from
+Firestore when it has none.
+"""
+
+import argparse
+import json
+import logging
+import os
+from decimal import Decimal
+from time import perf_counter
+from typing import Dict, List
+
+from .cashflow import Assumptions, simulate
+from .dca_backtest import (
+    LIMIT_MODIFIER,
+    MAKER_FEE,
+    TAKER_FEE,
+    Schedule,
+    sweep,
+    write_results,
+)
+
+
+def _firestore_documents(collection: str) -> List[Dict]:
+    from dotenv import load_dotenv
+    from firebase_admin import credentials, firestore, initialize_app
+
+    load_dotenv()
+    initialize_app(credentials.Certificate(os.getenv("GOOGLE_FIRESTORE_CONFIG")))
+    documents = firestore.client().collection(collection).stream()
+    return [document.to_dict() for document in documents]
+
+
+def _documents(config: Dict, collection: str) -> List[Dict]:
+    documents = config.get("flows")
+    if documents is None:
+        documents = _firestore_documents(collection)
+
+    return [document for document in documents if document.get("enabled", True)]
+
+
+def _cashflow(args, config: Dict):
+    from functions.bunq_money_flow.src.transfer_flows import TransferFlows
+
+    start = perf_counter()
+    trajectories = simulate(
+        _documents(config, TransferFlows.COLLECTION),
+        Assumptions.from_dict(config),
+        months=args.months,
+        scenarios=args.scenarios,
+        seed=args.seed,
+        workers=args.workers,
+        vectorized=args.vectorized,
+    )
+    logging.warning(
+        f"Simulated {args.scenarios} scenarios of {args.months} months "
+        f"in {perf_counter() - start:.2f} s"
+    )
+
+    trajectories.write_summary(args.summary)
+    if args.trajectories:
+        trajectories.write_csv(args.trajectories)
+
+
+def _dca(args, config: Dict):
+    from functions.kraken_crypto_automation.src.asset_pairs import AssetPair
+    from functions.kraken_crypto_automation.src.order_flows import OrderFlows
+
+    start = perf_counter()
+    results = sweep(
+        _documents(config, OrderFlows.COLLECTION),
+        {source: Decimal(budget) for source, budget in config["budgets"].items()},
+        config["candles"],
+        {
+            pair: AssetPair.from_kraken(
+                info.get("name", pair), {"altname": pair, **info}
+            )
+            for pair, info in config["pairs"].items()
+        },
+        modifiers=args.modifier,
+        schedules=[Schedule.parse(schedule) for schedule in args.schedule],
+        workers=args.workers,
+        expiry=Schedule.parse(args.expiry).interval,
+        maker_fee=args.maker_fee,
+        taker_fee=args.taker_fee,
+    )
+    logging.warning(
+        f"Backtested {len(args.modifier) * len(args.schedule)} combinations "
+        f"in {perf_counter() - start:.2f} s"
+    )
+
+    write_results(args.output, results)
+    for result in results:
+        print(
+            f"{result.pair:<10} {result.modifier:6.3f} {result.schedule:>8}  "
+            f"{result.filled:>7}/{result.orders:<7} filled  "
+            f"{result.skipped:>7} skipped  "
+            f"{result.spent:12.2f} spent  "
+            + (f"{result.return_:+8.2%}" if result.return_ is not None else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="simulation", required=True)
+
+    cashflow = subparsers.add_parser("cashflow")
+    cashflow.add_argument("config")
+    cashflow.add_argument("--months", type=int, default=12)
+    cashflow.add_argument("--scenarios", type=int, default=1000)
+    cashflow.add_argument("--seed", type=int, default=0)
+    cashflow.add_argument("--workers", type=int, help="processes, all cores if unset")
+    cashflow.add_argument("--vectorized", action="store_true")
+    cashflow.add_argument("--summary", default="summary.csv")
+    cashflow.add_argument(
+        "--trajectories", help="also write the balance of every scenario here"
+    )
+
+    dca = subparsers.add_parser("dca")
+    dca.add_argument("config")
+    dca.add_argument("--modifier", type=float, nargs="+", default=[LIMIT_MODIFIER])
+    dca.add_argument(
+        "--schedule", nargs="+", default=["1d"], help="e.g. 12h, 1d or 1w@9h"
+    )
+    dca.add_argument("--expiry", default="1d", help="of orders that do not fill")
+    dca.add_argument("--maker-fee", type=float, default=MAKER_FEE)
+    dca.add_argument("--taker-fee", type=float, default=TAKER_FEE)
+    dca.add_argument("--workers", type=int, help="processes, all cores if unset")
+    dca.add_argument("--output", default="dca.csv")
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        config = json.load(file)
+
+    # Strategies log every flow of every run
+    logging.basicConfig(level=logging.WARNING)
+    if args.simulation == "cashflow":
+        _cashflow(args, config)
+    else:
+        _dca(args, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""Monthly cashflow simulation of the transfer flows.
+
+Every month of a scenario the income is booked, the flows are run through
+FlowProcessor with the bunq adapter on top of an in-memory bank, and the
+spending and one-off expenses of that month are booked. The balance of every
+account is recorded at the end of each month. Scenarios only differ in the
+random draws of income, spending and one-off expenses and are spread over a
+process pool.
+"""
+
+import csv
+import os
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from functions.bunq_money_flow.src.money_flow import BankClientAdapter
+from functions.bunq_money_flow.src.transfer_flows import TransferFlows
+from functions.bunq_money_flow.src.types import (
+    BankClient,
+    PaymentRequest,
+    PaymentResult,
+)
+from lib.flow_processor import FlowProcessor
+from lib.money import DECIMALS, Money
+from .documents import StaticDocuments
+
+
+@dataclass(frozen=True)
+class MonthlyAmount:
+    # Income or spending of an account, drawn from a normal distribution every
+    # month and never negative
+    account: str
+    mean: Money
+    stddev: Money = Money(0)
+
+
+@dataclass(frozen=True)
+class OneOffExpense:
+    # Spent with the given probability in every month, uniformly between
+    # minimum and maximum
+    account: str
+    probability: float
+    minimum: Money
+    maximum: Money
+
+
+@dataclass(frozen=True)
+class Assumptions:
+    opening_balances: Dict[str, Money]
+    income: Tuple[MonthlyAmount, ...] = ()
+    spending: Tuple[MonthlyAmount, ...] = ()
+    one_offs: Tuple[OneOffExpense, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Assumptions":
+        def monthly(item: Dict) -> MonthlyAmount:
+            return MonthlyAmount(
+                account=item["account"],
+                mean=Money.of(item["mean"]),
+                stddev=Money.of(item.get("stddev", 0)),
+            )
+
+        return cls(
+            opening_balances={
+                account: Money.of(balance)
+                for account, balance in data.get("balances", {}).items()
+            },
+            income=tuple(map(monthly, data.get("income", ()))),
+            spending=tuple(map(monthly, data.get("spending", ()))),
+            one_offs=tuple(
+                OneOffExpense(
+                    account=item["account"],
+                    probability=float(item["probability"]),
+                    minimum=Money.of(item["minimum"]),
+                    maximum=Money.of(item["maximum"]),
+                )
+                for item in data.get("one_offs", ())
+            ),
+        )
+
+
+class SimulatedBank(BankClient):
+    # Balances of the simulated accounts in cents. Payments to any other IBAN
+    # leave the simulation.
+    def __init__(self, balances: Dict[str, int]):
+        self.balances = dict(balances)
+
+    def get_balance_by_iban(self, *, iban: str) -> Optional[Decimal]:
+        units = self.balances.get(iban)
+        return None if units is None else Decimal(units).scaleb(-DECIMALS)
+
+    def get_balances(self) -> Dict[str, Decimal]:
+        return {
+            iban: Decimal(units).scaleb(-DECIMALS)
+            for iban, units in self.balances.items()
+        }
+
+    def make_payment(
+        self,
+        *,
+        amount: Decimal,
+        description: str,
+        target_iban: str,
+        target_iban_name: str,
+        source_iban: str,
+    ) -> bool:
+        # The adapter hands over whole cents
+        units = int(amount.scaleb(DECIMALS))
+        self.balances[source_iban] -= units
+        if target_iban in self.balances:
+            self.balances[target_iban] += units
+
+        return True
+
+    def make_payments(self, payments: List[PaymentRequest]) -> List[PaymentResult]:
+        for payment in payments:
+            self.make_payment(
+                amount=payment.amount,
+                description=payment.description,
+                target_iban=payment.target_iban,
+                target_iban_name=payment.target_iban_name,
+                source_iban=payment.source_iban,
+            )
+
+        return [PaymentResult(payment=payment, success=True) for payment in payments]
+
+    def invalidate_accounts(self):
+        pass
+
+
+class StaticFlows(StaticDocuments, TransferFlows):
+    pass
+
+
+@dataclass
+class Trajectories:
+    # The balance of every account at the start and at the end of every month,
+    # in cents. One flat array per scenario, month by month.
+    accounts: Tuple[str, ...]
+    months: int
+    scenarios: List[array] = field(default_factory=list)
+
+    def balance(self, scenario: int, month: int, account: str) -> Money:
+        index = month * len(self.accounts) + self.accounts.index(account)
+        return Money(self.scenarios[scenario][index])
+
+    def trajectory(self, scenario: int, account: str) -> List[Money]:
+        column = self.accounts.index(account)
+        return [
+            Money(units)
+            for units in self.scenarios[scenario][column :: len(self.accounts)]
+        ]
+
+    def summary(
+        self, percentiles: Sequence[int] = (5, 50, 95)
+    ) -> Iterator[Dict[str, object]]:
+        # Yields the distribution of every account per month over all scenarios
+        count = len(self.scenarios)
+        for month in range(self.months + 1):
+            for column, account in enumerate(self.accounts):
+                index = month * len(self.accounts) + column
+                values = sorted(scenario[index] for scenario in self.scenarios)
+                row = {"month": month, "account": account}
+                for percentile in percentiles:
+                    position = min(count - 1, percentile * count // 100)
+                    row[f"p{percentile}"] = Money(values[position])
+                row["mean"] = Money(sum(values) // count)
+                row["negative"] = sum(value < 0 for value in values) / count
+                yield row
+
+    def write_summary(self, path: str, percentiles: Sequence[int] = (5, 50, 95)):
+        with open(path, "w", newline="") as file:
+            writer = None
+            for row in self.summary(percentiles):
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def write_csv(self, path: str):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["scenario", "month", "account", "balance"])
+            for scenario, balances in enumerate(self.scenarios):
+                for index, units in enumerate(balances):
+                    month, column = divmod(index, len(self.accounts))
+                    writer.writerow(
+                        [scenario, month, self.accounts[column], Money(units)]
+                    )
+
+
+def accounts_of(documents: Sequence[Dict], assumptions: Assumptions) -> Tuple[str, ...]:
+    # Sources and top up targets need a balance, they are simulated even when
+    # they have no opening balance
+    accounts = dict.fromkeys(assumptions.opening_balances)
+    for document in documents:
+        accounts.setdefault(document["source_iban"])
+        if document.get("strategy_type") == "top_up":
+            accounts.setdefault(document["target_iban"])
+
+    for amount in (*assumptions.income, *assumptions.spending, *assumptions.one_offs):
+        accounts.setdefault(amount.account)
+
+    return tuple(accounts)
+
+
+def _draw(rng: random.Random, amount: MonthlyAmount) -> int:
+    if not amount.stddev:
+        return max(0, amount.mean.minor_units)
+
+    return max(0, round(rng.gauss(amount.mean.minor_units, amount.stddev.minor_units)))
+
+
+class _Simulation:
+    # Runs scenarios one after the other, reusing the processor and the bank
+    def __init__(
+        self,
+        documents: Sequence[Dict],
+        assumptions: Assumptions,
+        accounts: Tuple[str, ...],
+        *,
+        vectorized: bool = False,
+    ):
+        self.assumptions = assumptions
+        self.accounts = accounts
+        self.opening = {
+            account: assumptions.opening_balances.get(account, Money(0)).minor_units
+            for account in accounts
+        }
+        self.bank = SimulatedBank(self.opening)
+        self.processor = FlowProcessor(
+            BankClientAdapter(self.bank),
+            store=StaticFlows(documents),
+            vectorized=vectorized,
+        )
+
+    def run(self, months: int, rng: random.Random) -> array:
+        assumptions, balances = self.assumptions, self.bank.balances
+        balances.update(self.opening)
+        trajectory = array("q", (balances[account] for account in self.accounts))
+        for _ in range(months):
+            for income in assumptions.income:
+                balances[income.account] += _draw(rng, income)
+
+            self.processor.run()
+
+            for spending in assumptions.spending:
+                balances[spending.account] -= _draw(rng, spending)
+
+            for one_off in assumptions.one_offs:
+                if rng.random() < one_off.probability:
+                    balances[one_off.account] -= rng.randint(
+                        one_off.minimum.minor_units, one_off.maximum.minor_units
+                    )
+
+            trajectory.extend(balances[account] for account in self.accounts)
+
+        return trajectory
+
+
+def _simulate_batch(
+    documents: Sequence[Dict],
+    assumptions: Assumptions,
+    accounts: Tuple[str, ...],
+    months: int,
+    seed: int,
+    scenarios: range,
+    vectorized: bool,
+) -> List[array]:
+    simulation = _Simulation(documents, assumptions, accounts, vectorized=vectorized)
+    # Seeded per scenario, so the results do not depend on how the scenarios
+    # are spread over the workers
+    return [
+        simulation.run(months, random.Random(f"{seed}/{scenario}"))
+        for scenario in scenarios
+    ]
+
+
+def simulate(
+    documents: Sequence[Dict],
+    assumptions: Assumptions,
+    *,
+    months: int = 12,
+    scenarios: int = 1,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    vectorized: bool = False,
+) -> Trajectories:
+    accounts = accounts_of(documents, assumptions)
+    result = Trajectories(accounts=accounts, months=months)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        result.scenarios = _simulate_batch(
+            documents, assumptions, accounts, months, seed, range(scenarios), vectorized
+        )
+        return result
+
+    # A few batches per worker keep the workers busy until the end without
+    # loading the flows for every single scenario
+    size = max(1, scenarios // (4 * workers))
+    batches = [
+        range(start, min(start + size, scenarios))
+        for start in range(0, scenarios, size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                _simulate_batch,
+                documents,
+                assumptions,
+                accounts,
+                months,
+                seed,
+                batch,
+                vectorized,
+            )
+            for batch in batches
+        ]
+        for future in futures:
+            result.scenarios.extend(future.result())
+
+    return result
@@ -0,0 +1,380 @@
+"""Backtest of the crypto order flows on historical OHLC candles.
+
+On every run of a schedule the order flows are planned with FlowProcessor for
+the budget of that run, and every planned order is priced like
+KrakenClient._limit_order does: the last close times the limit modifier,
+rounded to the pair's decimals, with the volume rounded down to its lot
+decimals and orders below ordermin or costmin skipped. An order that is
+marketable when it is placed fills at the open of the next candle and pays the
+taker fee, any other order waits for a candle that trades at its limit until it
+expires and pays the maker fee. All runs of a pair are evaluated at once with
+NumPy.
+"""
+
+import csv
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from functools import lru_cache
+from itertools import product
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from functions.kraken_crypto_automation.src.asset_pairs import AssetPair
+from functions.kraken_crypto_automation.src.kraken_client_adapter import (
+    KrakenClientAdapter,
+)
+from functions.kraken_crypto_automation.src.order_flows import OrderFlows
+from lib.flow_processor import FlowProcessor
+from lib.money import Money, round_down
+from .documents import StaticDocuments
+
+# Kraken's fees for the lowest volume tier
+MAKER_FEE = 0.0025
+TAKER_FEE = 0.004
+
+LIMIT_MODIFIER = 1.02
+
+_DAY = 24 * 60 * 60
+_UNITS = {"m": 60, "h": 60 * 60, "d": _DAY, "w": 7 * _DAY}
+
+# The columns of Kraken's OHLCVT downloads, which have no header
+_KRAKEN_COLUMNS = ("timestamp", "open", "high", "low", "close", "volume", "trades")
+_COLUMNS = ("timestamp", "open", "high", "low", "close")
+
+
+class StaticOrderFlows(StaticDocuments, OrderFlows):
+    pass
+
+
+@dataclass(frozen=True)
+class Candles:
+    # One row per candle, ordered by the time the candle opens (unix seconds)
+    timestamps: "np.ndarray"
+    open: "np.ndarray"
+    high: "np.ndarray"
+    low: "np.ndarray"
+    close: "np.ndarray"
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("The DCA backtest requires numpy")
+
+
+def load_candles(path: str) -> Candles:
+    # Reads a Parquet file or a CSV file with a timestamp, open, high, low and
+    # close column. CSV files without a header are read as Kraken's OHLCVT
+    # downloads.
+    _require_numpy()
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as parquet
+        except ImportError:
+            raise RuntimeError("Reading Parquet files requires pyarrow")
+
+        table = parquet.read_table(path, columns=list(_COLUMNS))
+        columns = [table.column(name).to_numpy() for name in _COLUMNS]
+    else:
+        with open(path) as file:
+            first_line = file.readline().strip()
+
+        header = [name.strip().lower() for name in first_line.split(",")]
+        has_header = not re.fullmatch(r"[\d.eE+-]+", header[0])
+        names = header if has_header else _KRAKEN_COLUMNS
+        data = np.loadtxt(
+            path,
+            delimiter=",",
+            skiprows=1 if has_header else 0,
+            usecols=[names.index(name) for name in _COLUMNS],
+            dtype=np.float64,
+            ndmin=2,
+        )
+        columns = list(data.T)
+
+    timestamps = np.asarray(columns[0], dtype=np.int64)
+    if np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind="stable")
+        columns = [column[order] for column in columns]
+        timestamps = timestamps[order]
+
+    return Candles(
+        timestamps,
+        *(np.asarray(column, dtype=np.float64) for column in columns[1:]),
+    )
+
+
+@lru_cache(maxsize=None)
+def _cached_candles(path: str) -> Candles:
+    # Every worker process reads a file once for all the combinations it runs
+    return load_candles(path)
+
+
+@dataclass(frozen=True)
+class Schedule:
+    # Runs every interval seconds, offset seconds after midnight UTC
+    interval: int
+    offset: int = 0
+
+    @classmethod
+    def parse(cls, value: str) -> "Schedule":
+        # For example "1d", "12h" or "1w@9h" for every week at 09:00
+        interval, _, offset = value.partition("@")
+        return cls(_seconds(interval), _seconds(offset) if offset else 0)
+
+    def __str__(self) -> str:
+        text = _duration(self.interval)
+        return f"{text}@{_duration(self.offset)}" if self.offset else text
+
+    def run_times(self, start: int, end: int) -> "np.ndarray":
+        # Every run from start up to and including end
+        first = start + (self.offset - start) % self.interval
+        return np.arange(first, end + 1, self.interval, dtype=np.int64)
+
+
+def _seconds(value: str) -> int:
+    match = re.fullmatch(r"(\d+)([mhdw])", value.strip())
+    if match is None:
+        raise ValueError(f"Invalid duration {value!r}, expected e.g. 30m, 12h or 1d")
+
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def _duration(seconds: int) -> str:
+    for unit in ("w", "d", "h", "m"):
+        if seconds % _UNITS[unit] == 0:
+            return f"{seconds // _UNITS[unit]}{unit}"
+
+    return f"{seconds}s"
+
+
+@dataclass(frozen=True)
+class BacktestResult:
+    pair: str
+    modifier: float
+    schedule: str
+    orders: int
+    skipped: int  # below ordermin or costmin
+    filled: int
+    expired: int
+    volume: float
+    cost: float  # without fees
+    fees: float
+    value: float  # of the volume at the last close
+
+    @property
+    def spent(self) -> float:
+        return self.cost + self.fees
+
+    @property
+    def average_price(self) -> Optional[float]:
+        return self.cost / self.volume if self.volume else None
+
+    @property
+    def return_(self) -> Optional[float]:
+        return self.value / self.spent - 1 if self.spent else None
+
+
+def limit_prices(reference, modifier: float, pair_decimals: int):
+    # np.round rounds half to even, like Decimal.quantize in AssetPair.validate
+    return np.round(reference * modifier, pair_decimals)
+
+
+def order_volumes(amounts, prices, asset_pair: AssetPair):
+    # The volume is rounded down to the lot decimals. The small tolerance
+    # keeps a quotient like 12.999999999 that is exactly 13 in Decimal at 13.
+    scale = 10.0**asset_pair.lot_decimals
+    volumes = np.floor(amounts / prices * scale * (1 + 1e-12)) / scale
+    valid = volumes >= float(asset_pair.ordermin)
+    if asset_pair.costmin is not None:
+        valid &= volumes * prices >= float(asset_pair.costmin)
+
+    return volumes, valid
+
+
+def fill_orders(candles: Candles, placed, limits, deadlines):
+    # Returns the price every order filled at, NaN when it expired, and
+    # whether it was marketable when it was placed. Orders are placed at the
+    # open of candle placed.
+    fill_prices = np.full(len(placed), np.nan)
+    taker = candles.open[placed] <= limits
+    fill_prices[taker] = candles.open[placed[taker]]
+
+    # Resting orders are followed candle by candle, only the ones that are
+    # still open are looked at again
+    active = np.flatnonzero(~taker)
+    offset = 0
+    while active.size:
+        rows = placed[active] + offset
+        alive = rows < len(candles)
+        alive[alive] &= candles.timestamps[rows[alive]] < deadlines[active[alive]]
+        active, rows = active[alive], rows[alive]
+
+        hit = candles.low[rows] <= limits[active]
+        fill_prices[active[hit]] = limits[active[hit]]
+        active = active[~hit]
+        offset += 1
+
+    return fill_prices, taker
+
+
+def backtest_pair(
+    candles: Candles,
+    asset_pair: AssetPair,
+    amounts: Sequence[Decimal],
+    schedule: Schedule,
+    *,
+    modifier: float = LIMIT_MODIFIER,
+    expiry: int = _DAY,
+    maker_fee: float = MAKER_FEE,
+    taker_fee: float = TAKER_FEE,
+) -> BacktestResult:
+    # Places an order of every amount on every run of the schedule
+    _require_numpy()
+    run_times = schedule.run_times(
+        int(candles.timestamps[0]), int(candles.timestamps[-1])
+    )
+    # The first candle that opens at or after the run, the last close is the
+    # close of the candle before it
+    placed = np.searchsorted(candles.timestamps, run_times)
+    keep = (placed > 0) & (placed < len(candles))
+    placed, run_times = placed[keep], run_times[keep]
+
+    limits = limit_prices(candles.close[placed - 1], modifier, asset_pair.pair_decimals)
+    runs = len(placed)
+    placed = np.tile(placed, len(amounts))
+    limits = np.tile(limits, len(amounts))
+    deadlines = np.tile(run_times + expiry, len(amounts))
+    amounts = np.repeat(np.array([float(amount) for amount in amounts]), runs)
+
+    volumes, valid = order_volumes(amounts, limits, asset_pair)
+    fill_prices, taker = fill_orders(
+        candles, placed[valid], limits[valid], deadlines[valid]
+    )
+    volumes = volumes[valid]
+    filled = ~np.isnan(fill_prices)
+
+    costs = volumes[filled] * fill_prices[filled]
+    fees = costs * np.where(taker[filled], taker_fee, maker_fee)
+    volume = float(volumes[filled].sum())
+    return BacktestResult(
+        pair=asset_pair.altname,
+        modifier=modifier,
+        schedule=str(schedule),
+        orders=len(amounts),
+        skipped=int((~valid).sum()),
+        filled=int(filled.sum()),
+        expired=int((~filled).sum()),
+        volume=volume,
+        cost=float(costs.sum()),
+        fees=float(fees.sum()),
+        value=volume * float(candles.close[-1]),
+    )
+
+
+def plan_orders(
+    documents: Sequence[Dict], budgets: Dict[str, Money]
+) -> Dict[str, List[Decimal]]:
+    # The amounts the order flows spend per pair on a run with the given
+    # balance per source currency. plan() never calls the client.
+    processor = FlowProcessor(KrakenClientAdapter(kraken=None), store=None)
+    flows = [
+        flow
+        for flow in StaticOrderFlows(documents).get_flows()
+        if flow.source in budgets
+    ]
+    plan = processor.plan(flows, budgets)
+    orders: Dict[str, List[Decimal]] = {}
+    for entry in plan:
+        if entry.flow.source_currency != entry.flow.pair:
+            orders.setdefault(entry.target, []).append(entry.amount.to_decimal())
+
+    return orders
+
+
+def _backtest(
+    documents: Sequence[Dict],
+    daily_budgets: Dict[str, Decimal],
+    candle_paths: Dict[str, str],
+    asset_pairs: Dict[str, AssetPair],
+    modifier: float,
+    schedule: Schedule,
+    options: Dict,
+) -> List[BacktestResult]:
+    # The budget of a day is spread over the runs of that day, so schedules
+    # are compared on the same amount of money
+    budgets = {
+        source: round_down(budget * schedule.interval / _DAY, source)
+        for source, budget in daily_budgets.items()
+    }
+    results = []
+    for pair, amounts in plan_orders(documents, budgets).items():
+        candles = _cached_candles(candle_paths[pair])
+        results.append(
+            backtest_pair(
+                candles,
+                asset_pairs[pair],
+                amounts,
+                schedule,
+                modifier=modifier,
+                **options,
+            )
+        )
+
+    return results
+
+
+def sweep(
+    documents: Sequence[Dict],
+    daily_budgets: Dict[str, Decimal],
+    candle_paths: Dict[str, str],
+    asset_pairs: Dict[str, AssetPair],
+    *,
+    modifiers: Sequence[float] = (LIMIT_MODIFIER,),
+    schedules: Sequence[Schedule] = (Schedule(_DAY),),
+    workers: Optional[int] = None,
+    **options,
+) -> List[BacktestResult]:
+    # Backtests every combination of limit modifier and schedule, spread over
+    # a process pool. Options are passed on to backtest_pair.
+    _require_numpy()
+    combinations: List[Tuple[float, Schedule]] = list(product(modifiers, schedules))
+    arguments = (documents, daily_budgets, candle_paths, asset_pairs)
+    workers = min(workers or os.cpu_count() or 1, len(combinations))
+    if workers <= 1:
+        return [
+            result
+            for modifier, schedule in combinations
+            for result in _backtest(*arguments, modifier, schedule, options)
+        ]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_backtest, *arguments, modifier, schedule, options)
+            for modifier, schedule in combinations
+        ]
+        return [result for future in futures for result in future.result()]
+
+
+def write_results(path: str, results: Sequence[BacktestResult]):
+    with open(path, "w", newline="") as file:
+        writer = None
+        for result in results:
+            row = {
+                **asdict(result),
+                "average_price": result.average_price,
+                "return": result.return_,
+            }
+            if writer is None:
+                writer = csv.DictWriter(file, fieldnames=list(row))
+                writer.writeheader()
+            writer.writerow(row)
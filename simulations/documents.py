@@ -0,0 +1,35 @@
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+class _Document:
+    __slots__ = ("data",)
+
+    def __init__(self, data: Dict):
+        self.data = data
+
+    def to_dict(self) -> Dict:
+        return dict(self.data)
+
+
+class StaticDocuments:
+    # Mixed into a FireStore to serve flow documents from memory. They are
+    # converted into flows once, through the regular loading code, and handed
+    # out again on every run.
+    def __init__(self, documents: Sequence[Dict]):
+        super().__init__(client=None)
+        self.documents = documents
+        self._flows: Optional[List] = None
+
+    def _query(self, **_):
+        return self
+
+    def stream(self) -> Iterator[_Document]:
+        return map(_Document, self.documents)
+
+    def get_flows(self, **_) -> Iterator:
+        # Firestore returns the flows ordered by source, the processor sorts
+        # the flows of a source by priority itself
+        if self._flows is None:
+            self._flows = sorted(super().get_flows(), key=lambda x: x.source)
+
+        return iter(self._flows)
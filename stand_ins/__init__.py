@@ -0,0 +1,3 @@
+from .bunq import BunqStandIn, BunqState, bunq_config
+from .kraken import KrakenStandIn, KrakenState, kraken_config
+from .server import StandInConfig
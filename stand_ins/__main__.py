@@ -0,0 +1,69 @@
+"""Runs a stand-in server until interrupted, for example:
+
+    python -m stand_ins bunq --port 8081 --latency 80 --failure-rate 0.01
+    python -m stand_ins kraken --port 8082 --too-many-requests-rate 0.05
+"""
+
+import argparse
+import logging
+
+from .bunq import BunqStandIn, BunqState, bunq_config
+from .kraken import KrakenStandIn, KrakenState, kraken_config
+
+
+def _bunq(config, args) -> BunqStandIn:
+    state = BunqState()
+    for index in range(args.accounts):
+        state.add_account(f"NL00STND{index:010d}", args.balance)
+
+    return BunqStandIn(config(), state=state, host=args.host, port=args.port)
+
+
+def _kraken(config, args) -> KrakenStandIn:
+    state = KrakenState(balances={"ZEUR": args.balance, "XXBT": "0.0"})
+    state.add_pair("XXBTZEUR", "XBTEUR", "50000.0")
+    state.add_pair("XETHZEUR", "ETHEUR", "2500.00", pair_decimals=2, ordermin="0.002")
+    return KrakenStandIn(config(), state=state, host=args.host, port=args.port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("provider", choices=["bunq", "kraken"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--too-many-requests-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--no-rate-limits", action="store_true", help="do not enforce rate limits"
+    )
+    parser.add_argument("--accounts", type=int, default=10, help="bunq accounts")
+    parser.add_argument("--balance", default="1000.00")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    create_config = bunq_config if args.provider == "bunq" else kraken_config
+    options = {
+        "latency": args.latency / 1000,
+        "jitter": args.jitter / 1000,
+        "failure_rate": args.failure_rate,
+        "too_many_requests_rate": args.too_many_requests_rate,
+        "seed": args.seed,
+    }
+    if args.no_rate_limits:
+        options["rate_limits"] = {}
+
+    create_server = _bunq if args.provider == "bunq" else _kraken
+    server = create_server(lambda: create_config(**options), args)
+
+    logging.basicConfig(level=logging.INFO)
+    logging.info(f"{args.provider} stand-in listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import base64
+import json
+import secrets
+import threading
+from dataclasses import dataclass, field
+from decimal import Decimal
+from itertools import count
+from typing import Dict, List, Optional
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import RSA
+from Cryptodome.Signature import PKCS1_v1_5
+
+from functions.bunq_money_flow.src.rate_limiter import (
+    BUNQ_RATE_LIMIT_PERIOD,
+    BUNQ_RATE_LIMITS,
+)
+from .server import StandInConfig, StandInHandler, StandInServer, route
+
+# bunq sessions of API key users time out after a week of inactivity
+_SESSION_TIMEOUT = 7 * 24 * 60 * 60
+_USER_ID = 1
+
+
+@dataclass
+class BunqAccount:
+    id: int
+    iban: str
+    balance: Decimal
+    description: str = "Stand-in account"
+
+
+@dataclass
+class BunqState:
+    accounts: Dict[int, BunqAccount] = field(default_factory=dict)
+    payments: List[dict] = field(default_factory=list)
+    payment_batches: List[List[dict]] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    _ids: count = field(default_factory=lambda: count(1))
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def add_account(self, iban: str, balance: str) -> BunqAccount:
+        account = BunqAccount(id=self.next_id(), iban=iban, balance=Decimal(balance))
+        self.accounts[account.id] = account
+        return account
+
+    def transfer(self, account_id: int, payment: dict) -> Optional[str]:
+        account = self.accounts.get(account_id)
+        if account is None:
+            return f"Monetary account {account_id} not found"
+
+        amount = Decimal(payment["amount"]["value"])
+        if amount > account.balance:
+            return "Insufficient balance"
+
+        account.balance -= amount
+        target_iban = payment["counterparty_alias"]["value"]
+        for target in self.accounts.values():
+            if target.iban == target_iban:
+                target.balance += amount
+
+        return None
+
+
+def bunq_config(**kwargs) -> StandInConfig:
+    # Enforces the same limits as the real API unless told otherwise
+    kwargs.setdefault("rate_limits", dict(BUNQ_RATE_LIMITS))
+    kwargs.setdefault("rate_limit_period", BUNQ_RATE_LIMIT_PERIOD)
+    return StandInConfig(**kwargs)
+
+
+class BunqHandler(StandInHandler):
+    server: "BunqStandIn"
+
+    def sign(self, body: bytes) -> Dict[str, str]:
+        # The monkey patched SDK verifies the body signature only
+        digest = SHA256.new(body)
+        signature = PKCS1_v1_5.new(self.server.private_key).sign(digest)
+        return {"X-Bunq-Server-Signature": base64.b64encode(signature).decode()}
+
+    def not_found(self, description: str):
+        self._error(404, description)
+
+    def too_many_requests(self):
+        self._error(429, "Too many requests. You have reached the rate limit.")
+
+    def failure(self, status: int):
+        self._error(status, "Service unavailable.")
+
+    def _error(self, status: int, description: str):
+        self.send_json(
+            status,
+            {
+                "Error": [
+                    {
+                        "error_description": description,
+                        "error_description_translated": description,
+                    }
+                ]
+            },
+            headers={"X-Bunq-Client-Response-Id": secrets.token_hex(8)},
+        )
+
+    def _response(self, *objects: dict):
+        self.send_json(
+            200,
+            {"Response": list(objects)},
+            headers={"X-Bunq-Client-Response-Id": secrets.token_hex(8)},
+        )
+
+    def installation(self):
+        public_key = self.server.private_key.publickey().export_key().decode()
+        self._response(
+            {"Id": {"id": self.server.state.next_id()}},
+            {"Token": {"id": 1, "token": secrets.token_hex(32)}},
+            {"ServerPublicKey": {"server_public_key": public_key}},
+        )
+
+    def device_server(self):
+        self._response({"Id": {"id": self.server.state.next_id()}})
+
+    def session_server(self):
+        self._response(
+            {"Id": {"id": self.server.state.next_id()}},
+            {"Token": {"id": 1, "token": secrets.token_hex(32)}},
+            {
+                "UserPerson": {
+                    "id": _USER_ID,
+                    "display_name": "Stand-in",
+                    "session_timeout": _SESSION_TIMEOUT,
+                }
+            },
+        )
+
+    def list_monetary_accounts(self, _user_id: str):
+        with self.server.state.lock:
+            accounts = list(self.server.state.accounts.values())
+
+        self._response(
+            *(
+                {
+                    "MonetaryAccountBank": {
+                        "id": account.id,
+                        "description": account.description,
+                        "status": "ACTIVE",
+                        "balance": {
+                            "value": f"{account.balance:.2f}",
+                            "currency": "EUR",
+                        },
+                        "alias": [
+                            {"type": "IBAN", "value": account.iban, "name": "Stand-in"}
+                        ],
+                    }
+                }
+                for account in accounts
+            )
+        )
+
+    def create_payment(self, _user_id: str, account_id: str):
+        payment = json.loads(self.body)
+        with self.server.state.lock:
+            error = self.server.state.transfer(int(account_id), payment)
+            if error is None:
+                self.server.state.payments.append(payment)
+
+        if error is not None:
+            self._error(400, error)
+            return
+
+        self._response({"Id": {"id": self.server.state.next_id()}})
+
+    def create_payment_batch(self, _user_id: str, account_id: str):
+        payments = json.loads(self.body)["payments"]
+        with self.server.state.lock:
+            # A batch is rejected as a whole, like the real endpoint does
+            total = sum(Decimal(payment["amount"]["value"]) for payment in payments)
+            account = self.server.state.accounts.get(int(account_id))
+            error = None
+            if account is None or total > account.balance:
+                error = "Insufficient balance"
+            else:
+                for payment in payments:
+                    self.server.state.transfer(int(account_id), payment)
+
+                self.server.state.payment_batches.append(payments)
+
+        if error is not None:
+            self._error(400, error)
+            return
+
+        self._response({"Id": {"id": self.server.state.next_id()}})
+
+    routes = [
+        route("POST", r"/v1/installation", installation),
+        route("POST", r"/v1/device-server", device_server),
+        route("POST", r"/v1/session-server", session_server),
+        route("GET", r"/v1/user/(\d+)/monetary-account", list_monetary_accounts),
+        # Listed by the SDK to find the main account when a context is loaded
+        route("GET", r"/v1/user/(\d+)/monetary-account-bank", list_monetary_accounts),
+        route("POST", r"/v1/user/(\d+)/monetary-account/(\d+)/payment", create_payment),
+        route(
+            "POST",
+            r"/v1/user/(\d+)/monetary-account/(\d+)/payment-batch",
+            create_payment_batch,
+        ),
+    ]
+
+
+class BunqStandIn(StandInServer):
+    def __init__(
+        self,
+        config: Optional[StandInConfig] = None,
+        *,
+        state: Optional[BunqState] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        super().__init__(BunqHandler, config or bunq_config(), host=host, port=port)
+        self.state = state or BunqState()
+        self.private_key = RSA.generate(2048)
@@ -0,0 +1,204 @@
+import json
+import secrets
+import threading
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from .server import StandInConfig, StandInHandler, StandInServer, route
+
+
+@dataclass
+class KrakenState:
+    balances: Dict[str, str] = field(default_factory=dict)
+    # Keyed by Kraken's internal pair name, every entry carries its altname
+    pairs: Dict[str, Dict] = field(default_factory=dict)
+    prices: Dict[str, str] = field(default_factory=dict)  # keyed by altname
+    orders: List[Dict] = field(default_factory=list)
+    nonces: Dict[str, int] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add_pair(
+        self,
+        name: str,
+        altname: str,
+        price: str,
+        *,
+        pair_decimals: int = 1,
+        lot_decimals: int = 8,
+        ordermin: str = "0.0001",
+        costmin: Optional[str] = None,
+    ):
+        self.pairs[name] = {
+            "altname": altname,
+            "pair_decimals": pair_decimals,
+            "lot_decimals": lot_decimals,
+            "ordermin": ordermin,
+            "costmin": costmin,
+            "status": "online",
+        }
+        self.prices[altname] = price
+
+    def pair_by_altname(self, altname: str) -> Optional[Dict]:
+        return next(
+            (info for info in self.pairs.values() if info["altname"] == altname),
+            None,
+        )
+
+    def accept_nonce(self, api_key: str, nonce: int) -> bool:
+        # Kraken rejects a nonce that is not higher than the previous one
+        if nonce <= self.nonces.get(api_key, 0):
+            return False
+
+        self.nonces[api_key] = nonce
+        return True
+
+
+def kraken_config(**kwargs) -> StandInConfig:
+    # Private calls raise a counter by one that decays by 0.33 per second up to
+    # 15, modelled as a bucket of 15 tokens refilled over 45 seconds
+    kwargs.setdefault("rate_limits", {"POST": 15})
+    kwargs.setdefault("rate_limit_period", 45.0)
+    return StandInConfig(**kwargs)
+
+
+class KrakenHandler(StandInHandler):
+    server: "KrakenStandIn"
+
+    def not_found(self, description: str):
+        self.send_json(404, {"error": [f"EGeneral:Unknown method. {description}"]})
+
+    def too_many_requests(self):
+        self.send_json(429, {"error": ["EAPI:Rate limit exceeded"]})
+
+    def failure(self, status: int):
+        self.send_json(status, {"error": ["EService:Unavailable"]})
+
+    def _result(self, result):
+        self.send_json(200, {"error": [], "result": result})
+
+    def _errors(self, *errors: str):
+        self.send_json(200, {"error": list(errors)})
+
+    def _private_payload(self) -> Optional[Dict]:
+        if self.headers.get("Content-Type") == "application/json":
+            payload = json.loads(self.body)
+        else:
+            payload = {
+                key: values[0]
+                for key, values in parse_qs(self.body.decode("UTF-8")).items()
+            }
+
+        api_key = self.headers.get("API-Key")
+        if not api_key or not self.headers.get("API-Sign"):
+            self._errors("EAPI:Invalid key")
+            return None
+
+        with self.server.state.lock:
+            accepted = self.server.state.accept_nonce(api_key, int(payload["nonce"]))
+
+        if not accepted:
+            self._errors("EAPI:Invalid nonce")
+            return None
+
+        return payload
+
+    def _requested_pairs(self) -> Optional[List[str]]:
+        pair = self.query.get("pair")
+        return pair[0].split(",") if pair else None
+
+    def ticker(self):
+        state = self.server.state
+        result = {}
+        for altname in self._requested_pairs() or state.prices:
+            for name, info in state.pairs.items():
+                if info["altname"] == altname:
+                    result[name] = {"c": [state.prices[altname], "1.0"]}
+
+        if not result:
+            self._errors("EQuery:Unknown asset pair")
+            return
+
+        self._result(result)
+
+    def asset_pairs(self):
+        requested = self._requested_pairs()
+        result = {
+            name: info
+            for name, info in self.server.state.pairs.items()
+            if requested is None or info["altname"] in requested
+        }
+        if not result:
+            self._errors("EQuery:Unknown asset pair")
+            return
+
+        self._result(result)
+
+    def balance(self):
+        if self._private_payload() is not None:
+            self._result(self.server.state.balances)
+
+    def _place_order(self, pair: str, order: Dict) -> Dict:
+        info = self.server.state.pair_by_altname(pair)
+        if info is None:
+            return {"error": "EQuery:Unknown asset pair"}
+
+        if Decimal(order["volume"]) < Decimal(info["ordermin"]):
+            return {"error": "EOrder:Order minimum not met"}
+
+        txid = secrets.token_hex(9).upper()
+        with self.server.state.lock:
+            self.server.state.orders.append({**order, "pair": pair, "txid": txid})
+
+        description = (
+            f"{order['type']} {order['volume']} {pair} @ limit {order['price']}"
+        )
+        return {"txid": txid, "descr": {"order": description}}
+
+    def add_order(self):
+        payload = self._private_payload()
+        if payload is None:
+            return
+
+        result = self._place_order(payload["pair"], payload)
+        if "error" in result:
+            self._errors(result["error"])
+            return
+
+        self._result({"descr": result["descr"], "txid": [result["txid"]]})
+
+    def add_order_batch(self):
+        payload = self._private_payload()
+        if payload is None:
+            return
+
+        orders = payload.get("orders", [])
+        if not 2 <= len(orders) <= 15:
+            self._errors("EGeneral:Invalid arguments:orders")
+            return
+
+        self._result(
+            {"orders": [self._place_order(payload["pair"], order) for order in orders]}
+        )
+
+    routes = [
+        route("GET", r"/0/public/Ticker", ticker),
+        route("GET", r"/0/public/AssetPairs", asset_pairs),
+        route("POST", r"/0/private/Balance", balance),
+        route("POST", r"/0/private/AddOrder", add_order),
+        route("POST", r"/0/private/AddOrderBatch", add_order_batch),
+    ]
+
+
+class KrakenStandIn(StandInServer):
+    def __init__(
+        self,
+        config: Optional[StandInConfig] = None,
+        *,
+        state: Optional[KrakenState] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        super().__init__(KrakenHandler, config or kraken_config(), host=host, port=port)
+        self.state = state or KrakenState()
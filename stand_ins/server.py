@@ -0,0 +1,188 @@
+import json
+import random
+import re
+import threading
+from abc import abstractmethod
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+from typing import Callable, Deque, Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass
+class StandInConfig:
+    latency: float = 0.0  # seconds added to every response
+    jitter: float = 0.0  # seconds, uniformly added on top of the latency
+    failure_rate: float = 0.0  # share of requests answered with a 5xx
+    too_many_requests_rate: float = 0.0  # share of requests answered with a 429
+    # Requests per method allowed within rate_limit_period, unlimited when empty
+    rate_limits: Dict[str, int] = field(default_factory=dict)
+    rate_limit_period: float = 3.0
+    seed: Optional[int] = None
+
+
+Route = Tuple[str, Pattern, Callable]
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        handler_class,
+        config: Optional[StandInConfig] = None,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        super().__init__((host, port), handler_class)
+        self.config = config or StandInConfig()
+        self.random = random.Random(self.config.seed)
+        # The times of the accepted requests per rate limited method
+        self.windows: Dict[str, Deque[float]] = {
+            method: deque() for method in self.config.rate_limits
+        }
+        self.requests: Counter = Counter()
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def outcome(self, method: str) -> Optional[int]:
+        # Decides whether a request is throttled or fails before it is routed
+        with self.lock:
+            if not self._within_rate_limit(method):
+                return 429
+
+            draw = self.random.random()
+            delay = self.config.latency + self.random.random() * self.config.jitter
+
+        if delay:
+            sleep(delay)
+
+        if draw < self.config.too_many_requests_rate:
+            return 429
+
+        if draw < self.config.too_many_requests_rate + self.config.failure_rate:
+            return 503
+
+        return None
+
+    def _within_rate_limit(self, method: str) -> bool:
+        # Like the providers, allows at most the limit of requests within any
+        # rate_limit_period consecutive seconds. Rejected requests do not count.
+        window = self.windows.get(method)
+        if window is None:
+            return True
+
+        now = monotonic()
+        while window and now - window[0] >= self.config.rate_limit_period:
+            window.popleft()
+
+        if len(window) >= self.config.rate_limits[method]:
+            return False
+
+        window.append(now)
+        return True
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: StandInServer
+    routes: List[Route] = []
+    body: bytes = b""
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def log_message(self, *_):
+        pass
+
+    @property
+    def query(self) -> Dict[str, List[str]]:
+        return parse_qs(urlparse(self.path).query)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status: int, payload, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("UTF-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in self.sign(body).items():
+            self.send_header(name, value)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def sign(self, body: bytes) -> Dict[str, str]:
+        return {}
+
+    @abstractmethod
+    def not_found(self, description: str):
+        ...
+
+    @abstractmethod
+    def too_many_requests(self):
+        ...
+
+    @abstractmethod
+    def failure(self, status: int):
+        ...
+
+    def _dispatch(self, method: str):
+        # The body is always consumed, so a rejected request leaves the
+        # keep-alive connection usable
+        self.body = self.read_body()
+        path = urlparse(self.path).path
+        for route_method, pattern, handle in self.routes:
+            match = pattern.fullmatch(path)
+            if route_method != method or match is None:
+                continue
+
+            with self.server.lock:
+                self.server.requests[(method, pattern.pattern)] += 1
+
+            status = self.server.outcome(method)
+            if status == 429:
+                self.too_many_requests()
+            elif status is not None:
+                self.failure(status)
+            else:
+                handle(self, *match.groups())
+            return
+
+        self.not_found(f"Unknown endpoint {method} {path}")
+
+
+def route(method: str, pattern: str, handle: Callable) -> Route:
+    return method, re.compile(pattern), handle